@@ -115,7 +115,7 @@ def bootstrap(app):
             attr = getattr(module, attr_str)
             if "_bootstrap.Function" in f"{attr}":
                 continue
-            if getattr(attr, "_dummy_function", None):
+            if isinstance(attr, type) and getattr(attr, "_dummy_function", None):
                 print("Setting fn to ", attr)
                 fn = attr
 
@@ -0,0 +1,114 @@
+"""
+Compares the NFT list endpoint loading whole NFT entities against selecting
+the src.utils.rows columns, for a user holding --nfts NFTs.
+
+    python -m benchmarks.list_rows [--nfts 10000] [--runs 20]
+
+The user and their NFTs are created in one transaction that is rolled back
+at the end, nothing is left in the database. Prints the median time and the
+peak Python memory (tracemalloc) of loading and encoding the response.
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from src.database import database
+from src.models import NFT, Network, NFTType, User
+from src.utils import rows
+
+
+def _where(user_id: int):
+    return and_(
+        NFT.user_id == user_id, NFT.network == Network.Ethereum, NFT.deleted == False
+    )
+
+
+def entities(session: Session, user_id: int) -> str:
+    """GET /user/list/nft/eth as it was: entities, dicts, jsonable_encoder."""
+    nfts = list(session.scalars(select(NFT).where(_where(user_id))))
+    response_data = []
+    for nft in nfts:
+        response_data.append(
+            {
+                "id": nft.id,
+                "imageUrl": nft.image_url,
+                "price": nft.price,
+                "quantity": nft.quantity,
+            }
+        )
+    return json.dumps(jsonable_encoder(response_data))
+
+
+def columns(session: Session, user_id: int) -> str:
+    nfts = session.execute(select(*rows.NFT_ITEM).where(_where(user_id)))
+    return json.dumps([rows.nft_item(nft) for nft in nfts])
+
+
+def measure(session: Session, load, user_id: int, runs: int):
+    seconds = []
+    for _ in range(runs):
+        # every run starts from an empty identity map, as a request does
+        session.expunge_all()
+        start = time.perf_counter()
+        load(session, user_id)
+        seconds.append(time.perf_counter() - start)
+
+    session.expunge_all()
+    tracemalloc.start()
+    load(session, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(seconds), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nfts", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    session = database.get_db_session()
+    try:
+        user = User(name="bench", address="bench-list-rows")
+        session.add(user)
+        session.flush()
+        session.execute(
+            NFT.__table__.insert(),
+            [
+                {
+                    "user_id": user.id,
+                    "network": Network.Ethereum,
+                    "nft_type": NFTType.ERC721,
+                    "token_address": "0x" + "00" * 20,
+                    "token_id": str(i),
+                    "name": "bench #{}".format(i),
+                    "image_url": "https://example.com/{}.png".format(i),
+                    "price": float(i),
+                    "quantity": 1,
+                }
+                for i in range(args.nfts)
+            ],
+        )
+        assert entities(session, user.id) == columns(session, user.id)
+
+        print("{} nfts, median of {} runs".format(args.nfts, args.runs))
+        for name, load in (("entities", entities), ("columns", columns)):
+            seconds, peak = measure(session, load, user.id, args.runs)
+            print(
+                "  {:<9} {:>8.1f} ms {:>8.1f} MiB peak".format(
+                    name, seconds * 1000, peak / 2**20
+                )
+            )
+    finally:
+        session.rollback()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
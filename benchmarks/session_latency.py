@@ -0,0 +1,155 @@
+"""
+Compares the latency of GET /user/ and GET /user/history/crypto when served
+through the blocking Session dependency (old path) and the AsyncSession
+dependency (new path) under concurrent load.
+
+The app is driven in-process over ASGI, so the client shares the event loop
+with the handlers exactly like a uvicorn worker does: a blocking query stalls
+every other in-flight request. Run from the repository root against a
+database that already holds the user:
+
+    python -m benchmarks.session_latency --user-id 1 --requests 2000 --concurrency 50
+
+--slow-every N makes every Nth request also run a SELECT SLEEP(--slow-ms) to
+show how one slow query affects the rest of the worker.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI, Depends
+from sqlalchemy import desc, and_, func, select, text
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.dependencies.database_deps import get_db_session, get_async_db_read_session
+from src.models import Transaction, User
+
+
+def build_app(user_id: int, slow_every: int, slow_ms: int) -> FastAPI:
+    app = FastAPI()
+    counter = {"n": 0}
+
+    def slow_query():
+        counter["n"] += 1
+        if slow_every and counter["n"] % slow_every == 0:
+            return text("SELECT SLEEP({})".format(slow_ms / 1000))
+        return None
+
+    def user_query():
+        return (
+            select(User)
+            .options(joinedload(User.avatar), joinedload(User.access_key))
+            .where(and_(User.id == user_id, User.deleted == False))
+        )
+
+    def records_query():
+        return (
+            select(Transaction)
+            .where(Transaction.user_id == user_id)
+            .order_by(desc(Transaction.created_at))
+            .limit(10)
+        )
+
+    def total_query():
+        return select(func.count(Transaction.id)).where(Transaction.user_id == user_id)
+
+    @app.get("/old/user/")
+    async def old_user(session: Session = Depends(get_db_session)):
+        if (slow := slow_query()) is not None:
+            session.execute(slow)
+        user: User = session.scalar(user_query())
+        return {"name": user.name, "avatar": user.avatar_url}
+
+    @app.get("/old/user/history/crypto")
+    async def old_records(session: Session = Depends(get_db_session)):
+        if (slow := slow_query()) is not None:
+            session.execute(slow)
+        total = session.scalar(total_query())
+        records = list(session.scalars(records_query()))
+        return {"records": len(records), "total": total}
+
+    @app.get("/new/user/")
+    async def new_user(session: AsyncSession = Depends(get_async_db_read_session)):
+        if (slow := slow_query()) is not None:
+            await session.execute(slow)
+        user: User = await session.scalar(user_query())
+        return {"name": user.name, "avatar": user.avatar_url}
+
+    @app.get("/new/user/history/crypto")
+    async def new_records(session: AsyncSession = Depends(get_async_db_read_session)):
+        if (slow := slow_query()) is not None:
+            await session.execute(slow)
+        total = await session.scalar(total_query())
+        records = list(await session.scalars(records_query()))
+        return {"records": len(records), "total": total}
+
+    return app
+
+
+async def run(app: FastAPI, path: str, requests: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+
+        await asyncio.gather(*[one() for _ in range(requests)])
+
+    return latencies
+
+
+def report(path: str, latencies: list, elapsed: float):
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        "{:<28} n={:<6} rps={:>8.1f} p50={:>8.2f}ms p95={:>8.2f}ms p99={:>8.2f}ms max={:>8.2f}ms".format(
+            path,
+            len(latencies),
+            len(latencies) / elapsed,
+            q[49],
+            q[94],
+            q[98],
+            max(latencies),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--slow-every", type=int, default=0)
+    parser.add_argument("--slow-ms", type=int, default=200)
+    args = parser.parse_args()
+
+    app = build_app(args.user_id, args.slow_every, args.slow_ms)
+
+    # one event loop for every path, pooled async connections are loop bound
+    async def all_paths():
+        for path in (
+            "/old/user/",
+            "/new/user/",
+            "/old/user/history/crypto",
+            "/new/user/history/crypto",
+        ):
+            start = time.perf_counter()
+            latencies = await run(app, path, args.requests, args.concurrency)
+            report(path, latencies, time.perf_counter() - start)
+
+    asyncio.run(all_paths())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os.path
 import pathlib
+from multiprocessing import cpu_count
 
 from app.__internal import ConfigBase, UNSET
 
@@ -16,6 +17,69 @@ class Configuration(ConfigBase):
     DB_HOST: str = "localhost"
     DB_PORT: str = "3306"
     DATABASE: str = "modern_game"
+    # read replica for GET endpoints, empty keeps every read on the primary
+    DB_REPLICA_HOST: str = ""
+    DB_REPLICA_PORT: str = "3306"
+    # how long a user reads from the primary after a write, a key in REDIS_URL
+    DB_READ_YOUR_WRITES_SECONDS: int = 5
+    # replays of a write request that hit an InnoDB deadlock or lock wait timeout
+    DB_DEADLOCK_RETRIES: int = 3
+    # connections the whole deployment may hold, split across every process
+    DB_MAX_CONNECTIONS: int = 150
+    DB_RESERVED_CONNECTIONS: int = 10
+    DB_CELERY_POOL_SIZE: int = 2
+    # shards past the DB_HOST database as comma separated SQLAlchemy URLs, and
+    # which shard each user bucket lives on ("0-511:0,512-1023:1"), empty
+    # splits the buckets evenly. Change the map with scripts/reshard.py only.
+    DB_SHARD_URLS: str = ""
+    DB_SHARD_MAP: str = ""
+
+    WEB_WORKERS: int = cpu_count() + 1
+    CELERY_CONCURRENCY: int = cpu_count()
+    # balance ledger: how often entries are folded into snapshots
+    BALANCE_SNAPSHOT_SECONDS: int = 300
+    # transaction_rollup: how often changed days are recounted, and how old a
+    # change must be before it is read
+    TRANSACTION_ROLLUP_SECONDS: int = 300
+    TRANSACTION_ROLLUP_SETTLE_SECONDS: int = 60
+    # nft_history: months served from the hot partitions before archiving, and
+    # how many monthly partitions are created in advance
+    NFT_HISTORY_HOT_MONTHS: int = 6
+    NFT_HISTORY_MONTHS_AHEAD: int = 3
+    # outbox relay: rows published per broker round trip, how long it sleeps
+    # once the outbox is drained, and how long published rows are kept
+    OUTBOX_BATCH: int = 100
+    OUTBOX_POLL_SECONDS: float = 0.5
+    OUTBOX_KEEP_HOURS: int = 24
+
+    # celery broker and cross-worker cache invalidation
+    REDIS_URL: str = "redis://127.0.0.1:6379/0"
+    # upper bound on a stale avatar list if an invalidation message is missed,
+    # and how many users' own avatars each web worker keeps
+    AVATAR_CACHE_SECONDS: int = 600
+    AVATAR_CACHE_MAX_USERS: int = 10000
+    # GET /user/ cache per user, 0 turns it off
+    USER_PROFILE_CACHE_SECONDS: int = 5
+    # the web workers' client for third-party APIs: seconds per call and to
+    # connect, connections per worker and per host, idle keep-alive seconds
+    HTTP_TIMEOUT_SECONDS: float = 10
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 5
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 20
+    HTTP_KEEPALIVE_SECONDS: float = 30
+    # ETH and SOL prices: how often each web worker refreshes them, and how
+    # old the last good price may get while CoinGecko fails
+    PRICE_REFRESH_SECONDS: float = 60
+    PRICE_MAX_STALE_SECONDS: float = 300
+    # ChangeNOW estimates: seconds a quote is kept, quotes kept per web worker
+    QUOTE_CACHE_SECONDS: float = 5
+    QUOTE_CACHE_MAX_ENTRIES: int = 10000
+    # X-Debug-Key for the /debug endpoints, empty turns them off
+    DEBUG_API_KEY: str = ""
+    # share of requests whose SQL is profiled without asking for it by header,
+    # and how often one statement shape must repeat to be reported as an N+1
+    SQL_PROFILE_SAMPLE_RATE: float = 0
+    SQL_PROFILE_REPEAT_THRESHOLD: int = 5
 
     GOOGLE_CLIENT_ID: str = UNSET
     GOOGLE_CLIENT_SECRET: str = UNSET
@@ -1,10 +1,10 @@
-from multiprocessing import cpu_count
+from config import cfg
 
 # Socket Path
 bind = "unix:/home/modern-game-backend/gunicorn.sock"
 
 # Worker Options
-workers = cpu_count() + 1
+workers = int(cfg.WEB_WORKERS)
 worker_class = "uvicorn.workers.UvicornWorker"
 
 # Logging Options
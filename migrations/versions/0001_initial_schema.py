@@ -0,0 +1,152 @@
+"""initial schema
+
+The tables as Base.metadata.create_all used to build them at boot. On a
+database that was created that way, mark this revision as applied instead of
+running it:
+
+    alembic stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "avatar",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("url", sa.String(1024), nullable=False),
+        sa.Column("owner_id", sa.Integer, nullable=True),
+    )
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String(512), nullable=False),
+        sa.Column("address", sa.String(512), nullable=True),
+        sa.Column(
+            "sign_method",
+            sa.Enum("Email", "Google", "MWallet", "PWallet", name="signmethod"),
+            nullable=False,
+        ),
+        sa.Column("hashed_password", sa.String(512), nullable=True),
+        sa.Column(
+            "role", sa.Enum("Dev", "Admin", "User", name="roleenum"), nullable=False
+        ),
+        sa.Column("avatar_id", sa.Integer, sa.ForeignKey("avatar.id"), nullable=False),
+        sa.Column("balance", sa.Float, nullable=False),
+        sa.Column("rollback", sa.Float, nullable=False),
+        sa.Column("deposit_balance", sa.Float, nullable=False),
+        sa.Column("withdraw_balance", sa.Float, nullable=False),
+        sa.Column("is_privacy", sa.Boolean),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP,
+            nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        ),
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP,
+            nullable=True,
+            server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        ),
+        sa.Column("deleted", sa.Boolean),
+    )
+    # avatar <-> user reference each other, close the cycle once both exist
+    op.create_foreign_key(
+        "fk_avatar_owner_id_user", "avatar", "user", ["owner_id"], ["id"]
+    )
+    op.create_table(
+        "user_access_key",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id")),
+        sa.Column("is_pending", sa.Boolean, nullable=False),
+        sa.Column("key", sa.String(6), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP,
+            nullable=True,
+            server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        ),
+    )
+    op.create_table(
+        "nft",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id")),
+        sa.Column(
+            "network", sa.Enum("Ethereum", "Solana", name="network"), nullable=False
+        ),
+        sa.Column("name", sa.String(512)),
+        sa.Column("token_address", sa.String(66), nullable=False),
+        sa.Column("token_id", sa.String(66), nullable=True),
+        sa.Column("image_url", sa.String(1024)),
+        sa.Column("price", sa.Float, nullable=False),
+        sa.Column(
+            "nft_type", sa.Enum("ERC721", "ERC1155", name="nfttype"), nullable=False
+        ),
+        sa.Column("deleted", sa.Boolean, nullable=False),
+    )
+    op.create_table(
+        "nft_history",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nft_id", sa.Integer, sa.ForeignKey("nft.id")),
+        sa.Column(
+            "before_user_id", sa.Integer, sa.ForeignKey("user.id"), nullable=True
+        ),
+        sa.Column("after_user_id", sa.Integer, sa.ForeignKey("user.id"), nullable=True),
+        sa.Column("price", sa.Float, nullable=False),
+        sa.Column(
+            "note",
+            sa.Enum("Jackpot", "Marketplace", "Deposit", "Withdraw", name="nftnote"),
+            nullable=False,
+        ),
+        sa.Column("transaction_hash", sa.String(128), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP,
+            nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        ),
+    )
+    op.create_table(
+        "transaction",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id")),
+        sa.Column("transaction_id", sa.String(128), nullable=False),
+        sa.Column(
+            "method",
+            sa.Enum("Eth", "Usdt", "Usdc", "Sol", name="dwmethod"),
+            nullable=False,
+        ),
+        sa.Column(
+            "direct", sa.Enum("Deposit", "Withdraw", name="direct"), nullable=False
+        ),
+        sa.Column("amount_in", sa.Float),
+        sa.Column("amount_out", sa.Float),
+        sa.Column("status", sa.String(16)),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP,
+            nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("transaction")
+    op.drop_table("nft_history")
+    op.drop_table("nft")
+    op.drop_table("user_access_key")
+    op.drop_constraint("fk_avatar_owner_id_user", "avatar", type_="foreignkey")
+    op.drop_table("user")
+    op.drop_table("avatar")
@@ -0,0 +1,62 @@
+"""hot query indexes
+
+Composite indexes for every lookup the API and celery run per request, plus
+a unique changenow id on transaction. Check the plans with:
+
+    python -m scripts.explain_hot_queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # login / signup duplicate checks
+    op.create_index("ix_user_address_deleted", "user", ["address", "deleted"])
+    # /list/nft/{eth,sol}
+    op.create_index(
+        "ix_nft_user_network_deleted", "nft", ["user_id", "network", "deleted"]
+    )
+    # duplicate checks on deposit
+    op.create_index("ix_nft_token", "nft", ["token_address", "token_id"])
+    # /history/nft/{eth,sol}, one index per side of the OR so MySQL can merge them
+    op.create_index(
+        "ix_nft_history_before_user_created",
+        "nft_history",
+        ["before_user_id", "created_at"],
+    )
+    op.create_index(
+        "ix_nft_history_after_user_created",
+        "nft_history",
+        ["after_user_id", "created_at"],
+    )
+    op.create_index(
+        "ix_nft_history_transaction_hash", "nft_history", ["transaction_hash"]
+    )
+    # /history/crypto
+    op.create_index(
+        "ix_transaction_user_created", "transaction", ["user_id", "created_at"]
+    )
+    # dispatch_transaction looks rows up by the changenow id
+    op.create_unique_constraint(
+        "uq_transaction_transaction_id", "transaction", ["transaction_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_transaction_transaction_id", "transaction", type_="unique")
+    op.drop_index("ix_transaction_user_created", "transaction")
+    op.drop_index("ix_nft_history_transaction_hash", "nft_history")
+    op.drop_index("ix_nft_history_after_user_created", "nft_history")
+    op.drop_index("ix_nft_history_before_user_created", "nft_history")
+    op.drop_index("ix_nft_token", "nft")
+    op.drop_index("ix_nft_user_network_deleted", "nft")
+    op.drop_index("ix_user_address_deleted", "user")
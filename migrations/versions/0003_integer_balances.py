@@ -0,0 +1,72 @@
+"""integer balances
+
+Stores the user balances as BIGINT millionths of a USD instead of FLOAT, so
+debits and credits are exact and can run as a single conditional UPDATE.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("balance", "rollback", "deposit_balance", "withdraw_balance")
+MINOR_UNITS = 10**6
+
+
+def upgrade() -> None:
+    # go through DECIMAL so the scaling is not done in single precision
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            existing_type=sa.Float,
+            type_=sa.Numeric(30, 6),
+            existing_nullable=False,
+        )
+    op.execute(
+        "UPDATE `user` SET "
+        + ", ".join(
+            "`{0}` = ROUND(`{0}` * {1})".format(column, MINOR_UNITS)
+            for column in COLUMNS
+        )
+    )
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            existing_type=sa.Numeric(30, 6),
+            type_=sa.BigInteger,
+            existing_nullable=False,
+        )
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            existing_type=sa.BigInteger,
+            type_=sa.Numeric(30, 6),
+            existing_nullable=False,
+        )
+    op.execute(
+        "UPDATE `user` SET "
+        + ", ".join(
+            "`{0}` = `{0}` / {1}".format(column, MINOR_UNITS) for column in COLUMNS
+        )
+    )
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            existing_type=sa.Numeric(30, 6),
+            type_=sa.Float,
+            existing_nullable=False,
+        )
@@ -0,0 +1,111 @@
+"""balance ledger
+
+Moves the user balances into an append-only balance_entry ledger folded into
+balance_snapshot by the snapshot_balances celery task. The current user
+columns become every user's first snapshot.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("balance", "rollback", "deposit_balance", "withdraw_balance")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "balance_entry",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("amount", sa.BigInteger, nullable=False),
+        sa.Column(
+            "reason",
+            sa.Enum("Deposit", "Withdraw", "Fee", name="ledgerreason"),
+            nullable=False,
+        ),
+        sa.Column(
+            "transaction_id",
+            sa.Integer,
+            sa.ForeignKey("transaction.id"),
+            nullable=True,
+        ),
+        sa.Column(
+            "nft_history_id",
+            sa.Integer,
+            sa.ForeignKey("nft_history.id"),
+            nullable=True,
+        ),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP,
+            nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        ),
+    )
+    op.create_index("ix_balance_entry_user_id", "balance_entry", ["user_id", "id"])
+    op.create_table(
+        "balance_snapshot",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("entry_id", sa.Integer, nullable=False),
+        *[sa.Column(column, sa.BigInteger, nullable=False) for column in COLUMNS],
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP,
+            nullable=True,
+            server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        ),
+    )
+    op.execute(
+        "INSERT INTO balance_snapshot (user_id, entry_id, {0}) "
+        "SELECT id, 0, {0} FROM `user`".format(", ".join(COLUMNS))
+    )
+    for column in COLUMNS:
+        op.drop_column("user", column)
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.add_column(
+            "user",
+            sa.Column(column, sa.BigInteger, nullable=False, server_default="0"),
+        )
+    # fold whatever is left in the ledger back into the columns
+    op.execute(
+        "UPDATE `user` u "
+        "LEFT JOIN balance_snapshot s ON s.user_id = u.id "
+        "LEFT JOIN ("
+        " SELECT e.user_id,"
+        " SUM(e.amount) AS balance,"
+        " SUM(IF(e.reason = 'Deposit', e.amount, 0)) AS deposit_balance,"
+        " SUM(IF(e.reason = 'Withdraw', -e.amount, 0)) AS withdraw_balance"
+        " FROM balance_entry e"
+        " LEFT JOIN balance_snapshot s2 ON s2.user_id = e.user_id"
+        " WHERE e.id > COALESCE(s2.entry_id, 0)"
+        " GROUP BY e.user_id"
+        ") e ON e.user_id = u.id "
+        "SET u.balance = COALESCE(s.balance, 0) + COALESCE(e.balance, 0),"
+        " u.rollback = COALESCE(s.rollback, 0),"
+        " u.deposit_balance = COALESCE(s.deposit_balance, 0)"
+        " + COALESCE(e.deposit_balance, 0),"
+        " u.withdraw_balance = COALESCE(s.withdraw_balance, 0)"
+        " + COALESCE(e.withdraw_balance, 0)"
+    )
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            existing_type=sa.BigInteger,
+            server_default=None,
+            existing_nullable=False,
+        )
+    op.drop_table("balance_snapshot")
+    op.drop_index("ix_balance_entry_user_id", "balance_entry")
+    op.drop_table("balance_entry")
@@ -0,0 +1,57 @@
+"""nft quantity
+
+ERC1155 copies are held as one nft row with a quantity instead of one row per
+copy. Existing copies of the same token held by the same user are merged into
+their oldest row, the others are marked deleted and keep their history.
+
+Downgrade drops the columns and does not split merged rows back up.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+HOLDINGS = (
+    "SELECT MIN(id) AS id, COUNT(*) AS quantity,"
+    " user_id, network, token_address, token_id"
+    " FROM nft WHERE nft_type = 'ERC1155' AND deleted = 0"
+    " GROUP BY user_id, network, token_address, token_id"
+    " HAVING COUNT(*) > 1"
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        "nft", sa.Column("quantity", sa.Integer, nullable=False, server_default="1")
+    )
+    op.add_column(
+        "nft_history",
+        sa.Column("quantity", sa.Integer, nullable=False, server_default="1"),
+    )
+    op.execute(
+        "UPDATE nft n JOIN ({}) h ON h.id = n.id SET n.quantity = h.quantity".format(
+            HOLDINGS
+        )
+    )
+    op.execute(
+        "UPDATE nft n JOIN ({}) h"
+        " ON h.user_id = n.user_id AND h.network = n.network"
+        " AND h.token_address = n.token_address AND h.token_id = n.token_id"
+        " SET n.deleted = 1"
+        " WHERE n.nft_type = 'ERC1155' AND n.deleted = 0 AND n.id <> h.id".format(
+            HOLDINGS
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("nft_history", "quantity")
+    op.drop_column("nft", "quantity")
@@ -0,0 +1,116 @@
+"""partition nft history
+
+Partitions nft_history by created_at month and adds nft_history_archive for
+the partitions the maintain_nft_history celery task moves out of it.
+Everything before the current month starts in one pold partition, which is
+archived once the hot window has moved past it.
+
+MySQL can't partition a table involved in a foreign key, so the ones on
+nft_history and balance_entry.nft_history_id are dropped, and the primary
+key becomes (id, created_at). Looking the foreign keys up needs a live
+connection, run this revision online.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 00:00:00
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.utils.history_partitions import month_start, partition_clause
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+COLUMNS = (
+    "id, nft_id, before_user_id, after_user_id, price, quantity, note,"
+    " transaction_hash, created_at"
+)
+HISTORY_FOREIGN_KEYS = {
+    "nft_id": "nft",
+    "before_user_id": "user",
+    "after_user_id": "user",
+}
+
+
+def _drop_foreign_keys(table, columns) -> None:
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key["constrained_columns"][0] in columns:
+            op.drop_constraint(foreign_key["name"], table, type_="foreignkey")
+
+
+def upgrade() -> None:
+    _drop_foreign_keys("balance_entry", ["nft_history_id"])
+    _drop_foreign_keys("nft_history", list(HISTORY_FOREIGN_KEYS))
+    op.execute(
+        "ALTER TABLE nft_history MODIFY id INTEGER NOT NULL AUTO_INCREMENT,"
+        " DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)"
+    )
+
+    now = datetime.now()
+    op.execute(
+        "ALTER TABLE nft_history PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) ("
+        "PARTITION pold VALUES LESS THAN (UNIX_TIMESTAMP('{}')), {},"
+        " PARTITION pmax VALUES LESS THAN MAXVALUE)".format(
+            month_start(now).strftime("%Y-%m-%d %H:%M:%S"),
+            ", ".join(
+                partition_clause(month_start(now, months))
+                for months in range(MONTHS_AHEAD + 1)
+            ),
+        )
+    )
+
+    op.create_table(
+        "nft_history_archive",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("nft_id", sa.Integer),
+        sa.Column("before_user_id", sa.Integer, nullable=True),
+        sa.Column("after_user_id", sa.Integer, nullable=True),
+        sa.Column("price", sa.Float, nullable=False),
+        sa.Column("quantity", sa.Integer, nullable=False),
+        sa.Column(
+            "note",
+            sa.Enum("Jackpot", "Marketplace", "Deposit", "Withdraw", name="nftnote"),
+            nullable=False,
+        ),
+        sa.Column("transaction_hash", sa.String(128), nullable=True),
+        sa.Column("created_at", sa.TIMESTAMP, nullable=False),
+        mysql_row_format="COMPRESSED",
+    )
+    op.create_index(
+        "ix_nft_history_archive_before_user_created",
+        "nft_history_archive",
+        ["before_user_id", "created_at"],
+    )
+    op.create_index(
+        "ix_nft_history_archive_after_user_created",
+        "nft_history_archive",
+        ["after_user_id", "created_at"],
+    )
+    op.create_index(
+        "ix_nft_history_archive_transaction_hash",
+        "nft_history_archive",
+        ["transaction_hash"],
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "INSERT INTO nft_history ({0}) SELECT {0} FROM nft_history_archive".format(
+            COLUMNS
+        )
+    )
+    op.drop_table("nft_history_archive")
+    op.execute("ALTER TABLE nft_history REMOVE PARTITIONING")
+    op.execute("ALTER TABLE nft_history DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+    for column, referred in HISTORY_FOREIGN_KEYS.items():
+        op.create_foreign_key(None, "nft_history", referred, [column], ["id"])
+    op.create_foreign_key(
+        None, "balance_entry", "nft_history", ["nft_history_id"], ["id"]
+    )
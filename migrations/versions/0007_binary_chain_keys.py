@@ -0,0 +1,126 @@
+"""binary chain keys
+
+Stores nft.token_address, nft.token_id and nft_history(_archive).transaction_hash
+as raw bytes, see src.utils.column_types. Every value is converted with the
+same types the models use, in id batches: first a read-only pass that fails
+on anything that doesn't parse, then a new column is filled and swapped in.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from src.utils.column_types import ChainAddress, TokenId, TransactionHash
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+BATCH = 5000
+# table, column, binary type, old type, nullable
+COLUMNS = (
+    ("nft", "token_address", ChainAddress(), sa.String(66), False),
+    ("nft", "token_id", TokenId(), sa.String(66), True),
+    ("nft_history", "transaction_hash", TransactionHash(), sa.String(128), True),
+    (
+        "nft_history_archive",
+        "transaction_hash",
+        TransactionHash(),
+        sa.String(128),
+        True,
+    ),
+)
+# table -> (name, columns) of the indexes over converted columns
+INDEXES = {
+    "nft": ("ix_nft_token", ["token_address", "token_id"]),
+    "nft_history": ("ix_nft_history_transaction_hash", ["transaction_hash"]),
+    "nft_history_archive": (
+        "ix_nft_history_archive_transaction_hash",
+        ["transaction_hash"],
+    ),
+}
+
+
+def _batches(table, column):
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text(
+                "SELECT id, {1} FROM {0} WHERE id > :last_id AND {1} IS NOT NULL"
+                " ORDER BY id LIMIT :batch".format(table, column)
+            ),
+            {"last_id": last_id, "batch": BATCH},
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def _convert(table, column, convert, new_type, nullable):
+    """Fills column via a temporary column of new_type, then swaps it in."""
+    connection = op.get_bind()
+    op.add_column(table, sa.Column(column + "_new", new_type, nullable=True))
+    for rows in _batches(table, column):
+        connection.execute(
+            sa.text(
+                "UPDATE {0} SET {1}_new = :value WHERE id = :id".format(table, column)
+            ),
+            [{"id": row.id, "value": convert(row[1])} for row in rows],
+        )
+    op.drop_column(table, column)
+    op.alter_column(
+        table,
+        column + "_new",
+        new_column_name=column,
+        existing_type=new_type,
+        nullable=nullable,
+    )
+
+
+def upgrade() -> None:
+    bad = []
+    for table, column, binary, _, _ in COLUMNS:
+        for rows in _batches(table, column):
+            for row in rows:
+                try:
+                    binary.process_bind_param(row[1], None)
+                except (ValueError, OverflowError):
+                    bad.append(
+                        "{}.{} id {}: {!r}".format(table, column, row.id, row[1])
+                    )
+    if bad:
+        raise ValueError("Fix or null these values first:\n" + "\n".join(bad[:100]))
+
+    for table, (name, _) in INDEXES.items():
+        op.drop_index(name, table_name=table)
+    for table, column, binary, _, nullable in COLUMNS:
+        _convert(
+            table,
+            column,
+            lambda value, binary=binary: binary.process_bind_param(value, None),
+            binary.impl,
+            nullable,
+        )
+    for table, (name, columns) in INDEXES.items():
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for table, (name, _) in INDEXES.items():
+        op.drop_index(name, table_name=table)
+    for table, column, binary, text, nullable in COLUMNS:
+        _convert(
+            table,
+            column,
+            lambda value, binary=binary: binary.process_result_value(value, None),
+            text,
+            nullable,
+        )
+    for table, (name, columns) in INDEXES.items():
+        op.create_index(name, table, columns)
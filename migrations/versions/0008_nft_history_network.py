@@ -0,0 +1,78 @@
+"""nft history network
+
+Copies network, name and image_url from nft onto nft_history and
+nft_history_archive, and swaps the (user, created_at) indexes for
+(network, user, created_at) ones, so the history endpoints read a single
+table. Existing rows are backfilled in id ranges of BATCH rows.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+BATCH = 10000
+TABLES = ("nft_history", "nft_history_archive")
+
+
+def _backfill(table) -> None:
+    connection = op.get_bind()
+    low, high = connection.execute(
+        sa.text("SELECT MIN(id), MAX(id) FROM {}".format(table))
+    ).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH):
+        connection.execute(
+            sa.text(
+                "UPDATE {} h JOIN nft n ON n.id = h.nft_id"
+                " SET h.network = n.network, h.nft_name = n.name,"
+                " h.nft_image_url = n.image_url"
+                " WHERE h.id >= :start AND h.id < :end".format(table)
+            ),
+            {"start": start, "end": start + BATCH},
+        )
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column(
+                "network", sa.Enum("Ethereum", "Solana", name="network"), nullable=True
+            ),
+        )
+        op.add_column(table, sa.Column("nft_name", sa.String(512), nullable=True))
+        op.add_column(table, sa.Column("nft_image_url", sa.String(1024), nullable=True))
+        _backfill(table)
+
+        for side in ("before", "after"):
+            op.drop_index("ix_{}_{}_user_created".format(table, side), table_name=table)
+            op.create_index(
+                "ix_{}_network_{}_user_created".format(table, side),
+                table,
+                ["network", side + "_user_id", "created_at"],
+            )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        for side in ("before", "after"):
+            op.drop_index(
+                "ix_{}_network_{}_user_created".format(table, side), table_name=table
+            )
+            op.create_index(
+                "ix_{}_{}_user_created".format(table, side),
+                table,
+                [side + "_user_id", "created_at"],
+            )
+        op.drop_column(table, "nft_image_url")
+        op.drop_column(table, "nft_name")
+        op.drop_column(table, "network")
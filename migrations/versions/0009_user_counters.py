@@ -0,0 +1,36 @@
+"""user counters
+
+Adds user_counter, the per user totals of the paginated endpoints, and fills
+it with the repair pass the repair_user_counters celery task runs, see
+src.utils.counters.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from src.utils.counters import repair
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_counter",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("name", sa.String(32), primary_key=True),
+        sa.Column("value", sa.BigInteger, nullable=False),
+    )
+    # joins the migration's transaction, its commits are savepoints
+    repair(Session(bind=op.get_bind()))
+
+
+def downgrade() -> None:
+    op.drop_table("user_counter")
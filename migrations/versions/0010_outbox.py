@@ -0,0 +1,38 @@
+"""outbox
+
+Adds the outbox table celery tasks are written to by the API and published
+from by src.outbox_relay, see src.utils.outbox.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("task", sa.String(128), nullable=False),
+        sa.Column("args", sa.JSON, nullable=False),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP,
+            nullable=False,
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+        ),
+        sa.Column("published_at", sa.TIMESTAMP, nullable=True),
+    )
+    op.create_index("ix_outbox_pending", "outbox", ["published_at", "id"])
+
+
+def downgrade() -> None:
+    op.drop_table("outbox")
@@ -0,0 +1,36 @@
+"""user directory
+
+Adds user_directory, the home shard's map of every user id to its sign up
+address, see src.utils.user_directory. On the home shard it is filled from
+the existing users, which all live there until the first reshard.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_directory",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("address", sa.String(512), nullable=True),
+    )
+    op.create_index("ix_user_directory_address", "user_directory", ["address"])
+
+    if int(context.get_x_argument(as_dictionary=True).get("shard", 0)) == 0:
+        op.execute(
+            "INSERT INTO user_directory (id, address) SELECT id, address FROM `user`"
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("user_directory")
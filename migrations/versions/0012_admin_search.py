@@ -0,0 +1,60 @@
+"""admin search
+
+Indexes behind every filter of GET /admin/users, a balance_snapshot row for
+each user that had none, and shard_summary, the per shard totals of
+GET /admin/users/summary, filled with the repair pass the
+repair_user_counters celery task runs, see src.utils.summaries.
+
+Run it on every shard with -x shard=N.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from src.utils.summaries import repair
+
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # created_at ranges and order, sign method filters
+    op.create_index("ix_user_created", "user", ["created_at"])
+    op.create_index(
+        "ix_user_sign_method_created", "user", ["sign_method", "created_at"]
+    )
+    # pending filter
+    op.create_index(
+        "ix_user_access_key_pending_user", "user_access_key", ["is_pending", "user_id"]
+    )
+    # balance ranges and order, on the snapshot every user now has
+    op.create_index("ix_balance_snapshot_balance", "balance_snapshot", ["balance"])
+    op.execute(
+        "INSERT INTO balance_snapshot"
+        " (user_id, entry_id, balance, rollback, deposit_balance, withdraw_balance)"
+        " SELECT id, 0, 0, 0, 0, 0 FROM `user` WHERE NOT EXISTS"
+        " (SELECT 1 FROM balance_snapshot WHERE balance_snapshot.user_id = `user`.id)"
+    )
+
+    op.create_table(
+        "shard_summary",
+        sa.Column("name", sa.String(64), primary_key=True),
+        sa.Column("value", sa.BigInteger, nullable=False),
+    )
+    # joins the migration's transaction, its commits are savepoints
+    repair(Session(bind=op.get_bind()))
+
+
+def downgrade() -> None:
+    op.drop_table("shard_summary")
+    op.drop_index("ix_balance_snapshot_balance", "balance_snapshot")
+    op.drop_index("ix_user_access_key_pending_user", "user_access_key")
+    op.drop_index("ix_user_sign_method_created", "user")
+    op.drop_index("ix_user_created", "user")
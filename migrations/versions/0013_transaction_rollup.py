@@ -0,0 +1,66 @@
+"""transaction rollup
+
+Adds transaction.updated_at and transaction_rollup, the daily transaction
+counts and volumes of GET /admin/volume, with rollup_watermark, how far the
+rollup_transactions celery task has read, see src.utils.rollups. The first
+run of the task counts every day.
+
+Run it on every shard with -x shard=N.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "transaction",
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP,
+            nullable=True,
+            server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        ),
+    )
+    # days to recount, and their rows
+    op.create_index("ix_transaction_updated", "transaction", ["updated_at"])
+    op.create_index("ix_transaction_created", "transaction", ["created_at"])
+
+    op.create_table(
+        "transaction_rollup",
+        sa.Column("day", sa.Date, primary_key=True),
+        sa.Column(
+            "method",
+            sa.Enum("Eth", "Usdt", "Usdc", "Sol", name="dwmethod"),
+            primary_key=True,
+        ),
+        sa.Column(
+            "direct", sa.Enum("Deposit", "Withdraw", name="direct"), primary_key=True
+        ),
+        sa.Column("status", sa.String(16), primary_key=True),
+        sa.Column("count", sa.BigInteger, nullable=False),
+        sa.Column("amount_in", sa.Float, nullable=False),
+        sa.Column("amount_out", sa.Float, nullable=False),
+    )
+    op.create_table(
+        "rollup_watermark",
+        sa.Column("name", sa.String(64), primary_key=True),
+        sa.Column("through", sa.TIMESTAMP, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rollup_watermark")
+    op.drop_table("transaction_rollup")
+    op.drop_index("ix_transaction_created", "transaction")
+    op.drop_index("ix_transaction_updated", "transaction")
+    op.drop_column("transaction", "updated_at")
@@ -0,0 +1,38 @@
+"""unique ledger transaction
+
+One balance_entry per transaction and reason, so a deposit delivered twice by
+the outbox is credited once whatever the two runs read. Entries without a
+transaction, NFT fees and refunds of failed withdrawals, aren't constrained.
+
+Run it on every shard with -x shard=N. It fails on a shard already holding a
+deposit credited twice, those have to be reversed by hand first.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0014"
+down_revision = "0013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_unique_constraint(
+        "uq_balance_entry_transaction",
+        "balance_entry",
+        ["transaction_id", "reason"],
+    )
+
+
+def downgrade() -> None:
+    # the transaction_id foreign key needs an index of its own once the
+    # constraint is gone
+    op.create_index(
+        "ix_balance_entry_transaction_id", "balance_entry", ["transaction_id"]
+    )
+    op.drop_constraint("uq_balance_entry_transaction", "balance_entry", type_="unique")
@@ -0,0 +1,161 @@
+"""
+Prints the MySQL EXPLAIN plan of every hot query the API and celery run, so
+a schema or query change that drops index use shows up before it ships.
+
+    python -m scripts.explain_hot_queries [--user-id 1]
+
+Exits with status 1 when any query falls back to a full table scan.
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import and_, desc, func, or_, select, text
+
+from src.database import database, shard_for
+from src.models import (
+    NFT,
+    NFTHistory,
+    Network,
+    SignMethod,
+    Transaction,
+    TransactionRollup,
+    User,
+    UserCounter,
+)
+from src.utils import counters, rollups, user_search
+from src.utils.balance import balance_query
+from src.utils.history_partitions import hot_since
+from src.utils.pagination import encode_cursor, keyset_before
+from src.utils.user_profile import profile_query
+
+CURSOR = encode_cursor(datetime(2022, 1, 1), 1000)
+
+
+def hot_queries(user_id: int) -> dict:
+    return {
+        "login by address": select(User).where(
+            and_(
+                User.address == "0x0000000000000000000000000000000000000000",
+                User.deleted == False,
+            )
+        ),
+        "nft list": select(NFT).where(
+            and_(
+                NFT.user_id == user_id,
+                NFT.network == Network.Ethereum,
+                NFT.deleted == False,
+            )
+        ),
+        "nft duplicate check": select(NFT).where(
+            and_(NFT.token_address == "0x" + "00" * 20, NFT.token_id == "0")
+        ),
+        "nft history by tx hash": select(func.count(NFTHistory.id)).where(
+            NFTHistory.transaction_hash == "0x" + "00" * 32
+        ),
+        "user counter": select(UserCounter.value).where(
+            and_(
+                UserCounter.user_id == user_id,
+                UserCounter.name == counters.nft_history(Network.Ethereum),
+            )
+        ),
+        "nft history page": select(NFTHistory)
+        .where(
+            and_(
+                NFTHistory.network == Network.Ethereum,
+                or_(
+                    NFTHistory.before_user_id == user_id,
+                    NFTHistory.after_user_id == user_id,
+                ),
+                NFTHistory.created_at >= hot_since(),
+            )
+        )
+        .order_by(desc(NFTHistory.created_at))
+        .limit(10),
+        "crypto history page": select(Transaction)
+        .where(Transaction.user_id == user_id)
+        .order_by(desc(Transaction.created_at))
+        .limit(10),
+        "transaction by changenow id": select(Transaction).where(
+            Transaction.transaction_id == "0"
+        ),
+        "crypto history keyset page": select(Transaction)
+        .where(
+            and_(
+                Transaction.user_id == user_id,
+                keyset_before(Transaction.created_at, Transaction.id, CURSOR),
+            )
+        )
+        .order_by(desc(Transaction.created_at), desc(Transaction.id))
+        .limit(11),
+        "nft history keyset side": select(NFTHistory.id)
+        .where(
+            and_(
+                NFTHistory.network == Network.Ethereum,
+                NFTHistory.after_user_id == user_id,
+                NFTHistory.created_at >= hot_since(),
+                keyset_before(NFTHistory.created_at, NFTHistory.id, CURSOR),
+            )
+        )
+        .order_by(desc(NFTHistory.created_at), desc(NFTHistory.id))
+        .limit(11),
+        "balance": balance_query(user_id),
+        "user profile": profile_query(user_id),
+        "admin search by sign method": user_search.search_query(
+            "created_at", True, 21, sign_method=SignMethod.Email
+        ),
+        "admin search pending": user_search.search_query(
+            "created_at", True, 21, pending=True
+        ),
+        "admin search by address": user_search.search_query(
+            "created_at", True, 21, address_prefix="0x00"
+        ),
+        "admin search by balance": user_search.search_query(
+            "balance", True, 21, min_balance=1000000
+        ),
+        "rollup changed days": rollups.changed_days(
+            datetime(2022, 1, 1, 0, 5), datetime(2022, 1, 1)
+        ),
+        "volume report": select(TransactionRollup).where(
+            TransactionRollup.day >= datetime(2022, 1, 1).date()
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    # explained on the shard that holds the user
+    engine = database.get_db_connection(shard_for(args.user_id))
+    full_scans = []
+
+    with engine.connect() as connection:
+        for name, query in hot_queries(args.user_id).items():
+            sql = str(
+                query.compile(
+                    dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                )
+            )
+            print("=== {}".format(name))
+            for row in connection.execute(text("EXPLAIN " + sql)).mappings():
+                print(
+                    "  {:<14} type={:<12} key={} rows={} {}".format(
+                        row["table"],
+                        row["type"],
+                        row["key"],
+                        row["rows"],
+                        row["Extra"] or "",
+                    )
+                )
+                if row["type"] == "ALL":
+                    full_scans.append("{} ({})".format(name, row["table"]))
+
+    if full_scans:
+        print("\nFull table scans: " + ", ".join(full_scans))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Moves users' rows between shards for a new DB_SHARD_MAP.
+
+    python -m scripts.reshard plan    --to "0-511:0,512-1023:1"
+    python -m scripts.reshard prepare --to ...
+    python -m scripts.reshard copy    --to ...
+    python -m scripts.reshard verify  --to ...
+    python -m scripts.reshard cleanup --from <old map> --to ...
+
+--from defaults to the DB_SHARD_MAP in effect, both maps are over the shards
+of DB_SHARD_URLS. To add a shard, list it in DB_SHARD_URLS with the old map
+still spelled out in DB_SHARD_MAP, migrate it (alembic -x shard=N upgrade
+head), then:
+
+1. prepare raises the target shards' AUTO_INCREMENT past every id in use, so
+   ids stay unique across shards, and copies the public avatars to them,
+2. copy copies the moving users' rows while the API keeps serving them,
+3. stop the API, celery and the outbox relay, copy again to pick up what
+   changed meanwhile, deploy with DB_SHARD_MAP set to the new map and start
+   them again,
+4. verify, then cleanup deletes the moved rows from their old shards,
+5. run the repair_user_counters celery task and rollup_transactions with
+   full=True, they recount the shard_summary totals and transaction_rollup
+   days of every shard, which don't follow the moved users.
+
+copy replaces each moving user's rows on the target, so it can be rerun, but
+never once the new map is live: it would overwrite newer rows with older.
+"""
+import argparse
+import sys
+from contextlib import contextmanager
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import (
+    Table,
+    create_engine,
+    delete,
+    func,
+    insert,
+    pool,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+
+from config import cfg
+from src.database import Base, bucket_of, parse_shard_map, shard_map, shard_urls
+from src.models import Avatar, User
+
+# the column naming the owner of each table's rows, in an order that inserts
+# users before their rows; user_directory and outbox stay where they are
+OWNER_COLUMNS = {
+    "user": "id",
+    "user_access_key": "user_id",
+    "avatar": "owner_id",
+    "nft": "user_id",
+    "nft_history": None,
+    "nft_history_archive": None,
+    "transaction": "user_id",
+    "balance_entry": "user_id",
+    "balance_snapshot": "user_id",
+    "user_counter": "user_id",
+}
+
+
+def _tables() -> List[Table]:
+    return [Base.metadata.tables[name] for name in OWNER_COLUMNS]
+
+
+def owner(table: Table):
+    if OWNER_COLUMNS[table.name] is None:
+        # history rows name their user on either side, rows naming two users
+        # (no route writes them) move with the receiving one
+        return func.coalesce(table.c.after_user_id, table.c.before_user_id)
+    return table.c[OWNER_COLUMNS[table.name]]
+
+
+def moves(old: List[int], new: List[int]) -> Dict[Tuple[int, int], Set[int]]:
+    """(from shard, to shard) -> the buckets moving between them."""
+    moving = {}
+    for bucket, (source, target) in enumerate(zip(old, new)):
+        if source != target:
+            moving.setdefault((source, target), set()).add(bucket)
+    return moving
+
+
+def moving_users(connection: Connection, buckets: Set[int]) -> List[int]:
+    """Ids of the users on connection's shard whose bucket is in buckets."""
+    return [
+        user_id
+        for user_id in connection.scalars(select(User.id).order_by(User.id))
+        if bucket_of(user_id) in buckets
+    ]
+
+
+def _batches(ids: List[int], size: int):
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+@contextmanager
+def _writing(engine: Engine):
+    with engine.begin() as connection:
+        if connection.dialect.name == "mysql":
+            # a user's rows arrive table by table, avatar and user point at
+            # each other; the connection is not pooled, see engines()
+            connection.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+        yield connection
+
+
+def _rows(connection: Connection, table: Table, user_ids: List[int]) -> List[dict]:
+    return [
+        dict(row)
+        for row in connection.execute(
+            select(table).where(owner(table).in_(user_ids))
+        ).mappings()
+    ]
+
+
+def _counts(connection: Connection, user_ids: List[int]) -> Dict[str, int]:
+    return {
+        table.name: connection.scalar(
+            select(func.count()).select_from(table).where(owner(table).in_(user_ids))
+        )
+        for table in _tables()
+    }
+
+
+def plan(engines: List[Engine], old: List[int], new: List[int]) -> dict:
+    """(from shard, to shard) -> (buckets, users) moving between them."""
+    planned = {}
+    for (source, target), buckets in sorted(moves(old, new).items()):
+        with engines[source].connect() as connection:
+            planned[(source, target)] = (
+                len(buckets),
+                len(moving_users(connection, buckets)),
+            )
+    return planned
+
+
+def prepare(engines: List[Engine], old: List[int], new: List[int]) -> None:
+    avatars = Avatar.__table__
+    with engines[0].connect() as home:
+        public = [
+            dict(row)
+            for row in home.execute(
+                select(avatars).where(avatars.c.owner_id == None)
+            ).mappings()
+        ]
+
+    id_tables = [
+        table
+        for table in Base.metadata.sorted_tables
+        if "id" in table.c and table.c.id.primary_key
+    ]
+    top = {table.name: 0 for table in id_tables}
+    for engine in engines:
+        with engine.connect() as connection:
+            for table in id_tables:
+                top[table.name] = max(
+                    top[table.name],
+                    connection.scalar(select(func.max(table.c.id))) or 0,
+                )
+
+    for target in sorted({target for _, target in moves(old, new)}):
+        with _writing(engines[target]) as connection:
+            if public:
+                connection.execute(
+                    delete(avatars).where(
+                        avatars.c.id.in_([avatar["id"] for avatar in public])
+                    )
+                )
+                connection.execute(insert(avatars), public)
+            if connection.dialect.name == "mysql":
+                for name, value in top.items():
+                    connection.execute(
+                        text(
+                            "ALTER TABLE `{}` AUTO_INCREMENT = {}".format(
+                                name, value + 1
+                            )
+                        )
+                    )
+
+
+def copy(engines: List[Engine], old: List[int], new: List[int], batch: int) -> int:
+    """Replaces the moving users' rows on their new shard with the ones on
+    their old shard, a transaction per batch of users. Returns rows copied."""
+    copied = 0
+    for (source, target), buckets in sorted(moves(old, new).items()):
+        with engines[source].connect() as reader:
+            for user_ids in _batches(moving_users(reader, buckets), batch):
+                with _writing(engines[target]) as writer:
+                    for table in reversed(_tables()):
+                        writer.execute(delete(table).where(owner(table).in_(user_ids)))
+                    for table in _tables():
+                        rows = _rows(reader, table, user_ids)
+                        if rows:
+                            writer.execute(insert(table), rows)
+                            copied += len(rows)
+                # a fresh snapshot of the source for the next batch
+                reader.rollback()
+    return copied
+
+
+def verify(
+    engines: List[Engine], old: List[int], new: List[int], batch: int
+) -> List[str]:
+    """Tables whose row counts differ between a batch of moving users' old
+    and new shards, empty when the copy is complete."""
+    mismatches = []
+    for (source, target), buckets in sorted(moves(old, new).items()):
+        with engines[source].connect() as reader, engines[target].connect() as moved:
+            for user_ids in _batches(moving_users(reader, buckets), batch):
+                before, after = _counts(reader, user_ids), _counts(moved, user_ids)
+                for name in OWNER_COLUMNS:
+                    if before[name] != after[name]:
+                        mismatches.append(
+                            "{}: shard {} has {}, shard {} has {} (users {}-{})".format(
+                                name,
+                                source,
+                                before[name],
+                                target,
+                                after[name],
+                                user_ids[0],
+                                user_ids[-1],
+                            )
+                        )
+    return mismatches
+
+
+def cleanup(engines: List[Engine], old: List[int], new: List[int], batch: int) -> int:
+    """Deletes the moved users' rows from their old shard, returns how many."""
+    deleted = 0
+    for (source, _), buckets in sorted(moves(old, new).items()):
+        with engines[source].connect() as reader:
+            user_ids = moving_users(reader, buckets)
+        for ids in _batches(user_ids, batch):
+            with _writing(engines[source]) as writer:
+                for table in reversed(_tables()):
+                    deleted += writer.execute(
+                        delete(table).where(owner(table).in_(ids))
+                    ).rowcount
+    return deleted
+
+
+def engines() -> List[Engine]:
+    # dedicated connections, the session settings above never reach a pool
+    return [create_engine(url, poolclass=pool.NullPool) for url in shard_urls()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "step", choices=["plan", "prepare", "copy", "verify", "cleanup"]
+    )
+    parser.add_argument("--from", dest="old", default=cfg.DB_SHARD_MAP)
+    parser.add_argument("--to", dest="new", required=True)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    shards = len(shard_urls())
+    old, new = parse_shard_map(args.old, shards), parse_shard_map(args.new, shards)
+    if old == new:
+        print("Nothing moves between these maps")
+        return
+    # copy must not run once the new map is live, cleanup only once it is
+    live = shard_map()
+    if args.step in ("prepare", "copy") and live != old:
+        print("DB_SHARD_MAP is not the --from map, has the new map been deployed?")
+        sys.exit(1)
+    if args.step == "cleanup" and live != new:
+        print("Deploy DB_SHARD_MAP={} before cleaning up".format(args.new))
+        sys.exit(1)
+
+    shard_engines = engines()
+    if args.step == "plan":
+        for (source, target), (buckets, users) in plan(shard_engines, old, new).items():
+            print(
+                "shard {} -> {}: {} buckets, {} users".format(
+                    source, target, buckets, users
+                )
+            )
+    elif args.step == "prepare":
+        prepare(shard_engines, old, new)
+        print("Target shards prepared")
+    elif args.step == "copy":
+        print("Copied {} rows".format(copy(shard_engines, old, new, args.batch)))
+    elif args.step == "verify":
+        mismatches = verify(shard_engines, old, new, args.batch)
+        for mismatch in mismatches:
+            print(mismatch)
+        if mismatches:
+            sys.exit(1)
+        print("Every moving user's rows are on their new shard")
+    else:
+        print("Deleted {} rows".format(cleanup(shard_engines, old, new, args.batch)))
+
+
+if __name__ == "__main__":
+    main()
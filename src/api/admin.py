@@ -0,0 +1,166 @@
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from app.__internal import Function
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, status
+from fastapi.responses import JSONResponse
+
+from src.database import ShardSessions, shard_count
+from src.dependencies.auth_deps import get_current_admin
+from src.dependencies.database_deps import UnitOfWorkRoute, get_async_db_read_shards
+from src.models import Direct, DWMethod, SignMethod
+from src.utils import rollups, summaries, user_profile, user_search
+from src.utils.balance import from_minor, to_minor
+from src.utils.pagination import next_page
+
+
+class AdminAPI(Function):
+    def __init__(self, error: Callable):
+        self.log.info("admin api initailized")
+
+    def Bootstrap(self, app: FastAPI):
+        router = APIRouter(
+            prefix="/admin",
+            tags=["admin"],
+            responses={404: {"description": "Not found"}},
+            dependencies=[Depends(get_current_admin)],
+            route_class=UnitOfWorkRoute,
+        )
+
+        @router.get("/users", summary="Search users, balances as of the last snapshot")
+        async def search_users(
+            sign_method: SignMethod = None,
+            pending: bool = None,
+            address: str = Query(default=None, description="Address prefix"),
+            created_from: datetime = None,
+            created_to: datetime = None,
+            min_balance: float = None,
+            max_balance: float = None,
+            sort: str = Query(default="created_at", regex="^(created_at|balance)$"),
+            order: str = Query(default="desc", regex="^(asc|desc)$"),
+            count: int = Query(default=20, ge=1, le=100),
+            cursor: str = None,
+            shards: ShardSessions = Depends(get_async_db_read_shards),
+        ):
+            descending = order == "desc"
+            # count + 1 from every shard, merged, tells if there is a next page
+            rows = await shards.rows_everywhere(
+                user_search.search_query(
+                    sort,
+                    descending,
+                    count + 1,
+                    cursor=cursor,
+                    sign_method=sign_method,
+                    pending=pending,
+                    address_prefix=address,
+                    created_from=created_from,
+                    created_to=created_to,
+                    min_balance=None if min_balance is None else to_minor(min_balance),
+                    max_balance=None if max_balance is None else to_minor(max_balance),
+                )
+            )
+            key = user_search.sort_key(sort)
+            rows.sort(key=key, reverse=descending)
+            page, next_cursor = next_page(rows[: count + 1], count, key)
+            return JSONResponse(
+                {
+                    "users": [user_search.item(row) for row in page],
+                    "next_cursor": next_cursor,
+                }
+            )
+
+        @router.get("/users/summary", summary="User counts and balance totals")
+        async def get_users_summary(
+            shards: ShardSessions = Depends(get_async_db_read_shards),
+        ):
+            totals = {}
+            for shard in range(shard_count()):
+                for name, value in (await summaries.load(shards[shard])).items():
+                    totals[name] = totals.get(name, 0) + value
+
+            users = {
+                sign_method.value: totals.get(summaries.users(sign_method), 0)
+                for sign_method in SignMethod
+            }
+            return {
+                "users": users,
+                "total": sum(users.values()),
+                "pending": totals.get(summaries.PENDING, 0),
+                "balance": from_minor(totals.get(summaries.BALANCE, 0)),
+                "depositBalance": from_minor(totals.get(summaries.DEPOSIT_BALANCE, 0)),
+                "withdrawBalance": from_minor(
+                    totals.get(summaries.WITHDRAW_BALANCE, 0)
+                ),
+            }
+
+        @router.get("/users/{user_id}", summary="A user with live balances")
+        async def get_user(
+            user_id: int,
+            shards: ShardSessions = Depends(get_async_db_read_shards),
+        ):
+            row = (
+                await shards.for_user(user_id).execute(
+                    user_profile.profile_query(user_id)
+                )
+            ).first()
+            if row is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="User doesn't exist",
+                )
+
+            return {
+                "id": user_id,
+                "name": row.name,
+                "address": row.address,
+                "avatar": row.avatar,
+                "signMethod": row.sign_method,
+                "isPrivacy": row.is_privacy,
+                "isPending": row.is_pending,
+                "balance": from_minor(row.balance),
+                "depositBalance": from_minor(row.deposit_balance),
+                "withdrawBalance": from_minor(row.withdraw_balance),
+                "rollback": from_minor(row.rollback),
+            }
+
+        @router.get("/volume", summary="Daily transaction counts and volumes")
+        async def get_volume(
+            start: date = Query(
+                default=None, description="First day, 30 days ago by default"
+            ),
+            end: date = Query(default=None, description="Last day, today by default"),
+            method: DWMethod = None,
+            direct: Direct = None,
+            shards: ShardSessions = Depends(get_async_db_read_shards),
+        ):
+            end = end or date.today()
+            start = start or end - timedelta(days=30)
+            totals = {}
+            for shard in range(shard_count()):
+                for row in await rollups.load(
+                    shards[shard], start, end, method, direct
+                ):
+                    key = (row.day, row.method.value, row.direct.value, row.status)
+                    count, amount_in, amount_out = totals.get(key, (0, 0.0, 0.0))
+                    totals[key] = (
+                        count + row.count,
+                        amount_in + row.amount_in,
+                        amount_out + row.amount_out,
+                    )
+
+            days = []
+            for key, (count, amount_in, amount_out) in sorted(totals.items()):
+                days.append(
+                    {
+                        "day": key[0].isoformat(),
+                        "method": key[1],
+                        "direct": key[2],
+                        "status": key[3],
+                        "count": count,
+                        "amountIn": amount_in,
+                        "amountOut": amount_out,
+                    }
+                )
+            return {"days": days}
+
+        app.include_router(router)
@@ -10,10 +10,11 @@ from fastapi import (
     Depends,
 )
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from operator import and_
 
-import requests
 from src.dependencies.auth_deps import (
     get_current_user_from_oauth,
     get_current_user_from_refresh_token,
@@ -30,10 +31,23 @@ from src.utils.auth import (
 )
 from src.schemas.user import EmailUserBase, WalletUserBase
 from src.schemas.auth import TokenPayload, TokenSchema
-from src.models import Avatar, SignMethod, User, UserAccessKey
-from src.dependencies.database_deps import get_db_session
+from src.models import Avatar, BalanceSnapshot, SignMethod, User, UserAccessKey
+from src.database import ShardSessions
+from src.dependencies.database_deps import (
+    UnitOfWorkRoute,
+    get_async_db_read_session,
+    get_async_db_read_shards,
+    get_async_db_write_shards,
+)
 
 from config import cfg
+from src.utils import (
+    http_client,
+    recent_writes,
+    summaries,
+    user_directory,
+    user_profile,
+)
 from src.utils.web3 import compare_eth_address
 
 scopes = [
@@ -51,6 +65,7 @@ class AuthAPI(Function):
             prefix="/auth",
             tags=["auth"],
             responses={404: {"description": "Not found"}},
+            route_class=UnitOfWorkRoute,
         )
 
         @router.post(
@@ -58,14 +73,11 @@ class AuthAPI(Function):
             summary="Create new user",
         )
         async def create_user_by_email(
-            data: EmailUserBase, session: Session = Depends(get_db_session)
+            data: EmailUserBase,
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             # querying database to check if user already exist
-            user = (
-                session.query(User)
-                .filter(and_(User.address == data.email, User.deleted == False))
-                .first()
-            )
+            user = await user_directory.find_user(shards, data.email)
             if user is not None:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -73,21 +85,27 @@ class AuthAPI(Function):
                 )
 
             new_user = User()
+            new_user.id = await user_directory.allocate(shards, data.email)
             new_user.address = data.email
             new_user.sign_method = SignMethod.Email
             new_user.hashed_password = get_hashed_password(data.password)
 
+            session = shards.for_user(new_user.id)
+            # the new user's next requests read what was just written
+            recent_writes.mark_after_commit(session, new_user.id)
             session.add(new_user)
-            session.flush()
-            session.refresh(new_user, attribute_names=["id"])
+            await session.flush()
             data = {"user_id": new_user.id}
             new_access_key = UserAccessKey()
             new_access_key.is_pending = True
             new_access_key.key = generate_accesskey()
             new_access_key.user_id = new_user.id
             session.add(new_access_key)
+            # every user has a snapshot, see BalanceSnapshot
+            session.add(BalanceSnapshot(user_id=new_user.id))
+            await summaries.count_signup(session, SignMethod.Email, True)
 
-            session.commit()
+            await shards.commit()
             return data
 
         @router.post(
@@ -95,14 +113,11 @@ class AuthAPI(Function):
             summary="Create new user",
         )
         async def create_user_by_metamask(
-            data: WalletUserBase, session: Session = Depends(get_db_session)
+            data: WalletUserBase,
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             # querying database to check if user already exist
-            user = (
-                session.query(User)
-                .filter(and_(User.address == data.wallet, User.deleted == False))
-                .first()
-            )
+            user = await user_directory.find_user(shards, data.wallet)
             if user is not None:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -117,19 +132,23 @@ class AuthAPI(Function):
                 )
 
             new_user = User()
+            new_user.id = await user_directory.allocate(shards, data.wallet)
             new_user.address = data.wallet
             new_user.sign_method = SignMethod.MWallet
 
+            session = shards.for_user(new_user.id)
+            recent_writes.mark_after_commit(session, new_user.id)
             session.add(new_user)
-            session.flush()
-            session.refresh(new_user, attribute_names=["id"])
+            await session.flush()
             new_access_key = UserAccessKey()
             new_access_key.is_pending = False
             new_access_key.key = generate_accesskey()
             new_access_key.user_id = new_user.id
             session.add(new_access_key)
+            session.add(BalanceSnapshot(user_id=new_user.id))
+            await summaries.count_signup(session, SignMethod.MWallet, False)
 
-            session.commit()
+            await shards.commit()
 
             return {
                 "access_token": create_access_token(new_user.id),
@@ -141,14 +160,11 @@ class AuthAPI(Function):
             summary="Create new user",
         )
         async def create_user_by_phantom(
-            data: WalletUserBase, session: Session = Depends(get_db_session)
+            data: WalletUserBase,
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             # querying database to check if user already exist
-            user = (
-                session.query(User)
-                .filter(and_(User.address == data.wallet, User.deleted == False))
-                .first()
-            )
+            user = await user_directory.find_user(shards, data.wallet)
             if user is not None:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -161,19 +177,23 @@ class AuthAPI(Function):
                 )
 
             new_user = User()
+            new_user.id = await user_directory.allocate(shards, data.wallet)
             new_user.address = data.wallet
             new_user.sign_method = SignMethod.PWallet
 
+            session = shards.for_user(new_user.id)
+            recent_writes.mark_after_commit(session, new_user.id)
             session.add(new_user)
-            session.flush()
-            session.refresh(new_user, attribute_names=["id"])
+            await session.flush()
             new_access_key = UserAccessKey()
             new_access_key.is_pending = False
             new_access_key.key = generate_accesskey()
             new_access_key.user_id = new_user.id
             session.add(new_access_key)
+            session.add(BalanceSnapshot(user_id=new_user.id))
+            await summaries.count_signup(session, SignMethod.PWallet, False)
 
-            session.commit()
+            await shards.commit()
 
             return {
                 "access_token": create_access_token(new_user.id),
@@ -187,13 +207,9 @@ class AuthAPI(Function):
         )
         async def login_with_email(
             form_data: OAuth2PasswordRequestForm = Depends(),
-            session: Session = Depends(get_db_session),
+            shards: ShardSessions = Depends(get_async_db_read_shards),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.address == form_data.username, User.deleted == False))
-                .first()
-            )
+            user: User = await user_directory.find_user(shards, form_data.username)
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -218,13 +234,9 @@ class AuthAPI(Function):
         )
         async def login_with_metamask(
             data: WalletUserBase,
-            session: Session = Depends(get_db_session),
+            shards: ShardSessions = Depends(get_async_db_read_shards),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.address == data.wallet, User.deleted == False))
-                .first()
-            )
+            user: User = await user_directory.find_user(shards, data.wallet)
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -250,13 +262,9 @@ class AuthAPI(Function):
         )
         async def login_with_phantom(
             form_data: WalletUserBase,
-            session: Session = Depends(get_db_session),
+            shards: ShardSessions = Depends(get_async_db_read_shards),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.address == form_data.wallet, User.deleted == False))
-                .first()
-            )
+            user: User = await user_directory.find_user(shards, form_data.wallet)
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -280,14 +288,15 @@ class AuthAPI(Function):
             response_model=TokenSchema,
         )
         async def signup_with_google(
-            access_token: str, session: Session = Depends(get_db_session)
+            access_token: str,
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             url = (
                 "https://www.googleapis.com/oauth2/v3/userinfo?access_token={}".format(
                     access_token
                 )
             )
-            response = requests.get(url)
+            response = await http_client.get(url)
 
             if response.status_code != 200:
                 raise HTTPException(
@@ -297,11 +306,7 @@ class AuthAPI(Function):
 
             user_data = json.loads(response.content.decode("utf-8"))
 
-            user = (
-                session.query(User)
-                .filter(and_(User.address == user_data["email"], User.deleted == False))
-                .first()
-            )
+            user = await user_directory.find_user(shards, user_data["email"])
 
             if user is not None:
                 raise HTTPException(
@@ -310,31 +315,35 @@ class AuthAPI(Function):
                 )
 
             new_user = User()
+            new_user.id = await user_directory.allocate(shards, user_data["email"])
             new_user.address = user_data["email"]
             new_user.name = user_data["name"]
             new_user.sign_method = SignMethod.Google
 
+            session = shards.for_user(new_user.id)
+            recent_writes.mark_after_commit(session, new_user.id)
             session.add(new_user)
-            session.flush()
-            session.refresh(new_user, attribute_names=["id"])
+            await session.flush()
 
             new_access_key = UserAccessKey()
             new_access_key.is_pending = False
             new_access_key.key = generate_accesskey()
             new_access_key.user_id = new_user.id
             session.add(new_access_key)
+            session.add(BalanceSnapshot(user_id=new_user.id))
+            await summaries.count_signup(session, SignMethod.Google, False)
 
             avatar = Avatar()
             avatar.owner_id = new_user.id
             avatar.url = user_data["picture"]
 
             session.add(avatar)
-            session.flush()
-            session.refresh(avatar, attribute_names=["id"])
+            await session.flush()
+            await session.refresh(avatar, attribute_names=["id"])
 
             new_user.avatar_id = avatar.id
 
-            session.commit()
+            await shards.commit()
 
             return {
                 "access_token": create_access_token(new_user.id),
@@ -347,13 +356,14 @@ class AuthAPI(Function):
             response_model=TokenSchema,
         )
         async def login_with_google(
-            access_token: str, session: Session = Depends(get_db_session)
+            access_token: str,
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             try:
                 url = "https://www.googleapis.com/oauth2/v3/userinfo?access_token={}".format(
                     access_token
                 )
-                response = requests.get(url)
+                response = await http_client.get(url)
 
                 if response.status_code != 200:
                     raise HTTPException(
@@ -363,12 +373,8 @@ class AuthAPI(Function):
 
                 user_data = json.loads(response.content.decode("utf-8"))
 
-                user: User = (
-                    session.query(User)
-                    .filter(
-                        and_(User.address == user_data["email"], User.deleted == False)
-                    )
-                    .first()
+                user: User = await user_directory.find_user(
+                    shards, user_data["email"], joinedload(User.access_key)
                 )
                 if user is None:
                     raise HTTPException(
@@ -376,8 +382,13 @@ class AuthAPI(Function):
                         detail="You need to sign up",
                     )
 
+                session = shards.for_user(user.id)
+                if user.is_pending:
+                    await session.execute(summaries.increment(summaries.PENDING, -1))
                 user.is_pending = False
-                session.commit()
+                user_profile.forget_after_commit(session, user.id)
+                recent_writes.mark_after_commit(session, user.id)
+                await shards.commit()
 
                 return {
                     "access_token": create_access_token(user.id),
@@ -407,12 +418,12 @@ class AuthAPI(Function):
         async def confirm(
             code: str,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.id == payload.sub, User.deleted == False))
-                .one()
+            user: User = await session.scalar(
+                select(User)
+                .options(joinedload(User.access_key))
+                .where(and_(User.id == payload.sub, User.deleted == False))
             )
 
             if user is None:
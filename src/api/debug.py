@@ -0,0 +1,59 @@
+import os
+from typing import Callable
+
+from app.__internal import Function
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+
+from src.database import pool_layout
+from src.dependencies.auth_deps import require_debug_key
+from src.utils import pool_metrics, quotes, sql_profiler
+from src.utils.sql_profiler import SQLProfileMiddleware
+
+
+class DebugAPI(Function):
+    def __init__(self, error: Callable):
+        self.log.info("debug api initailized")
+
+    def Bootstrap(self, app: FastAPI):
+        app.add_middleware(SQLProfileMiddleware)
+
+        # none of these touch the database, they must answer while the pool is
+        # exhausted. Every figure is for the worker process that answers.
+        router = APIRouter(
+            prefix="/debug",
+            tags=["debug"],
+            responses={404: {"description": "Not found"}},
+            dependencies=[Depends(require_debug_key)],
+        )
+
+        @router.get("/pool", summary="Pool layout, counters and current holders")
+        async def get_pool():
+            return {
+                "pid": os.getpid(),
+                "layout": pool_layout(),
+                "pools": pool_metrics.snapshot(),
+                "holders": pool_metrics.holders(),
+            }
+
+        @router.get("/pool/holders", summary="Checked out connections, longest first")
+        async def get_pool_holders():
+            return pool_metrics.holders()
+
+        @router.get("/quotes", summary="ChangeNOW estimate cache counters")
+        async def get_quotes():
+            return {"pid": os.getpid(), "quotes": quotes.snapshot()}
+
+        @router.get(
+            "/metrics", summary="Pool and quote metrics in the Prometheus text format"
+        )
+        async def get_metrics():
+            return PlainTextResponse(
+                pool_metrics.prometheus(os.getpid()) + quotes.prometheus(os.getpid())
+            )
+
+        @router.get("/sql", summary="SQL profile per route, most database time first")
+        async def get_sql_profile():
+            return {"pid": os.getpid(), "routes": sql_profiler.summary()}
+
+        app.include_router(router)
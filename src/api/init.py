@@ -3,7 +3,9 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.__internal import Function
-from src.database import Base, Database
+from src.database import describe_pool_layout
+from src.utils import http_client
+from src.utils.avatar_cache import avatar_cache
 from config import cfg
 
 
@@ -22,8 +24,15 @@ class Init(Function):
         )
         app.add_middleware(SessionMiddleware, secret_key=cfg.JWT_SECRET_KEY)
 
-        database = Database()
-        engine = database.get_db_connection()
-        database.get_db_session()
+        @app.on_event("startup")
+        async def open_clients():
+            http_client.client()
+            avatar_cache.redis()
 
-        Base.metadata.create_all(bind=engine, checkfirst=True)
+        @app.on_event("shutdown")
+        async def close_clients():
+            await http_client.close()
+            await avatar_cache.close()
+
+        # the schema is owned by the migrations (alembic upgrade head), not boot
+        self.log.info("DB pool layout:", describe_pool_layout())
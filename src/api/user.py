@@ -1,23 +1,44 @@
 from __future__ import annotations
+import asyncio
 from dataclasses import Field
 from itertools import count
 from typing import Callable
 
 from app.__internal import Function
 from fastapi import FastAPI, APIRouter, Query, status, HTTPException, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_, or_
-import requests
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import (
+    and_,
+    desc,
+    exists,
+    func,
+    or_,
+    select,
+    true,
+    union_all,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 import json
 
 from src.dependencies.auth_deps import get_current_user_from_oauth
-from src.dependencies.database_deps import get_db_session
+from src.database import ShardSessions
+from src.dependencies.database_deps import (
+    UnitOfWorkRoute,
+    get_async_db_read_session,
+    get_async_db_write_session,
+    get_async_db_write_session_no_retry,
+    get_async_db_write_shards,
+)
 from src.models import (
     NFT,
     Avatar,
     DWMethod,
     Direct,
+    LedgerReason,
     NFTHistory,
+    NFTHistoryArchive,
     NFTNote,
     NFTType,
     Network,
@@ -28,9 +49,29 @@ from src.schemas.auth import TokenPayload
 
 from config import cfg
 from src.schemas.user import UserUpdateData
+from src.utils.avatar_cache import avatar_cache
+from src.utils.balance import (
+    append,
+    debit,
+    entry,
+    reversal,
+    to_minor,
+)
+from src.utils import (
+    counters,
+    http_client,
+    opensea,
+    outbox,
+    quotes,
+    rows,
+    user_profile,
+)
+from src.utils.history_partitions import hot_since
+from src.utils.pagination import keyset_before, next_page
+from src.utils.price_oracle import PriceUnavailable, price_oracle
+from src.utils.quotes import QuoteFailed
 
-from src.changenow_api.client import api_wrapper as cnio_api
-from opensea import OpenseaAPI
+from src.changenow_api.client import async_api_wrapper as cnio_api
 from src.utils.solana_web3 import (
     get_solana_nft_transaction_data,
     is_owner_of_nft,
@@ -55,71 +96,194 @@ from src.celery import dispatch_transaction
 class UserAPI(Function):
     def __init__(self, error: Callable):
         self.log.info("user api initailized")
-        self.opensea = OpenseaAPI(apikey=cfg.OPENSEA_API)
+
+    async def history_page(
+        self,
+        session: AsyncSession,
+        history,
+        network: Network,
+        user_id: int,
+        count: int,
+        cursor: str,
+        window,
+    ) -> list:
+        """One keyset page of history rows within window.
+
+        history is NFTHistory or NFTHistoryArchive, they share their columns.
+        """
+        # walk each side of the OR on its own (network, user, created_at)
+        # index, both sides read at most count + 1 index entries whatever the
+        # page depth
+        sides = []
+        for column, other_side in (
+            (history.before_user_id, true()),
+            (
+                history.after_user_id,
+                or_(
+                    history.before_user_id == None,
+                    history.before_user_id != user_id,
+                ),
+            ),
+        ):
+            side = (
+                select(history.id, history.created_at)
+                .where(and_(history.network == network, column == user_id, other_side))
+                .where(window)
+                .order_by(desc(history.created_at), desc(history.id))
+                .limit(count + 1)
+            )
+            if cursor != "":
+                side = side.where(keyset_before(history.created_at, history.id, cursor))
+            side = side.subquery()
+            sides.append(select(side.c.id, side.c.created_at))
+
+        # created_at too, so each row is looked up in its own partition
+        page = union_all(*sides).subquery()
+        return list(
+            (
+                await session.execute(
+                    select(*rows.history_item_columns(history))
+                    .join(
+                        page,
+                        and_(
+                            page.c.id == history.id,
+                            page.c.created_at == history.created_at,
+                        ),
+                    )
+                    .order_by(desc(history.created_at), desc(history.id))
+                    .limit(count + 1)
+                )
+            ).all()
+        )
+
+    async def nft_history(
+        self,
+        session: AsyncSession,
+        network: Network,
+        user_id: int,
+        offset: int,
+        count: int,
+        cursor: str,
+    ):
+        # cursor pages only touch the hot partitions and fall through to the
+        # older ones once exhausted, offset pages read what the archive job
+        # left in nft_history, which is what the user counter counts
+        since = hot_since()
+        is_hot = NFTHistory.created_at >= since
+
+        if cursor is None:
+            involves_user = or_(
+                NFTHistory.before_user_id == user_id,
+                NFTHistory.after_user_id == user_id,
+            )
+            matches = and_(NFTHistory.network == network, involves_user)
+            total = await counters.get(session, user_id, counters.nft_history(network))
+            page = list(
+                (
+                    await session.execute(
+                        select(*rows.history_item_columns(NFTHistory))
+                        .where(matches)
+                        .order_by(desc(NFTHistory.created_at), desc(NFTHistory.id))
+                        .offset(offset)
+                        .limit(count + 1)
+                    )
+                ).all()
+            )
+        else:
+            page = await self.history_page(
+                session, NFTHistory, network, user_id, count, cursor, is_hot
+            )
+            if len(page) <= count:
+                # partitions past the hot window that the archive job hasn't
+                # moved yet, then the archive itself
+                older = await self.history_page(
+                    session,
+                    NFTHistory,
+                    network,
+                    user_id,
+                    count,
+                    cursor,
+                    NFTHistory.created_at < since,
+                )
+                older += await self.history_page(
+                    session, NFTHistoryArchive, network, user_id, count, cursor, true()
+                )
+                # archive_partitions copies a partition before dropping it,
+                # until then its rows are in both tables
+                older = list({row.id: row for row in older}.values())
+                older.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+                page += older[: count + 1 - len(page)]
+
+        histories, next_cursor = next_page(
+            page, count, lambda row: (row.created_at, row.id)
+        )
+
+        response_data = [rows.history_item(history) for history in histories]
+        if cursor is None:
+            return JSONResponse(
+                {
+                    "total": total,
+                    "records": response_data,
+                    "next_cursor": next_cursor,
+                }
+            )
+        return JSONResponse({"records": response_data, "next_cursor": next_cursor})
 
     def Bootstrap(self, app: FastAPI):
+        @app.on_event("startup")
+        async def start_avatar_cache_listener():
+            self.avatar_listener = asyncio.create_task(avatar_cache.listen())
+
+        @app.on_event("shutdown")
+        async def stop_avatar_cache_listener():
+            self.avatar_listener.cancel()
+
+        @app.on_event("startup")
+        async def start_price_oracle():
+            self.price_refresher = asyncio.create_task(price_oracle.run())
+
+        @app.on_event("shutdown")
+        async def stop_price_oracle():
+            self.price_refresher.cancel()
+
         router = APIRouter(
             prefix="/user",
             tags=["user"],
             responses={404: {"description": "Not found"}},
+            route_class=UnitOfWorkRoute,
         )
 
         @router.get("/avatars", summary="return available avatars")
         async def get_avatars(
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            avatars = list(
-                session.query(Avatar)
-                .filter(
-                    or_(
-                        Avatar.owner_id == None,
-                        Avatar.owner_id == payload.sub,
-                    )
-                )
-                .add_columns()
-            )
-
-            return avatars
+            return await avatar_cache.avatars_for(session, int(payload.sub))
 
         @router.get("/", summary="Get user data")
         async def get_user_data(
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.id == payload.sub, User.deleted == False))
-                .one()
-            )
+            # one query on a miss, none while the cached copy lives
+            profile = await user_profile.cached(session, int(payload.sub))
 
-            if user is None:
+            if profile is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="User doesn't exist",
                 )
 
-            return {
-                "name": user.name,
-                "address": user.address,
-                "avatar": user.avatar_url,
-                "signMethod": user.sign_method,
-                "balance": user.balance,
-                "rollback": user.rollback,
-                "isPrivacy": user.is_privacy,
-                "isPending": user.is_pending,
-            }
+            return profile
 
         @router.post("/", summary="Set user settings")
         async def set_user_data(
             data: UserUpdateData,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session),
         ):
-            user: User = (
-                session.query(User)
-                .filter(and_(User.id == payload.sub, User.deleted == False))
-                .first()
+            user: User = await session.scalar(
+                select(User).where(and_(User.id == payload.sub, User.deleted == False))
             )
 
             if user is None:
@@ -130,81 +294,70 @@ class UserAPI(Function):
 
             user.name = data.name
             user.is_privacy = data.isPrivacy
+            user_profile.forget_after_commit(session, user.id)
 
-            avatar: Avatar = (
-                session.query(Avatar).filter(Avatar.url == data.avatar).first()
-            )
+            avatar_id = await avatar_cache.id_by_url(session, user.id, data.avatar)
 
-            if avatar is not None:
-                user.avatar_id = avatar.id
+            if avatar_id is not None:
+                user.avatar_id = avatar_id
             else:
                 new_avatar = Avatar()
                 new_avatar.url = data.avatar
                 new_avatar.owner_id = user.id
 
                 session.add(new_avatar)
-                session.flush()
-                session.refresh(new_avatar, attribute_names=["id"])
+                await session.flush()
 
                 user.avatar_id = new_avatar.id
+                avatar_cache.forget_after_commit(session, user.id)
 
             return True
 
         @router.get("/price/eth", summary="return current eth price")
         async def get_price_eth():
             try:
-                url = "https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd"
-                response = requests.get(url)
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Invaild access token",
-                    )
-
-                data = json.loads(response.content.decode("utf-8"))
-
-                return data["ethereum"]["usd"]
-            except Exception as ex:
+                return await price_oracle.get("eth")
+            except PriceUnavailable as ex:
                 print(ex)
                 raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Price unavailable",
                 )
 
         @router.get("/price/sol", summary="return current eth price")
         async def get_price_sol():
             try:
-                url = "https://api.coingecko.com/api/v3/simple/price?ids=solana&vs_currencies=usd"
-                response = requests.get(url)
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Invaild access token",
-                    )
-
-                data = json.loads(response.content.decode("utf-8"))
-
-                return data["solana"]["usd"]
-            except Exception as ex:
+                return await price_oracle.get("sol")
+            except PriceUnavailable as ex:
                 print(ex)
                 raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Price unavailable",
                 )
 
-        @router.get(
-            "/price/eth/usdt/input",
-            summary="Returns the amount of USDT you get for exact ETH",
-        )
-        async def get_price_eth_usdt_input(amount: float) -> float:
+        async def get_quote(
+            from_currency: str,
+            from_network: str,
+            to_currency: str,
+            to_network: str,
+            amount: float,
+            reverse: bool = False,
+        ) -> float:
             try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=eth&fromNetwork=eth&fromAmount={}&toCurrency=usdt&toNetwork=eth&type=direct".format(
-                    amount
+                estimate = await quotes.estimate(
+                    from_currency,
+                    from_network,
+                    to_currency,
+                    to_network,
+                    amount,
+                    reverse,
+                )
+            except QuoteFailed as ex:
+                print(ex)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invaild access token",
                 )
-                response = requests.get(url)
-
             except Exception as ex:
                 print(ex)
                 raise HTTPException(
@@ -212,118 +365,40 @@ class UserAPI(Function):
                     detail="Something went wrong in server side",
                 )
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
+            if estimate == None:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
                 )
 
-            return data["summary"]["estimatedAmount"]
+            return estimate
+
+        @router.get(
+            "/price/eth/usdt/input",
+            summary="Returns the amount of USDT you get for exact ETH",
+        )
+        async def get_price_eth_usdt_input(amount: float) -> float:
+            return await get_quote("eth", "eth", "usdt", "eth", amount)
 
         @router.get(
             "/price/eth/usdt/output",
             summary="Returns the amount of ETH need to deposit for exact USDT",
         )
         async def get_price_eth_usdt_output(amount: float) -> float:
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=eth&fromNetwork=eth&toAmount={}&toCurrency=usdt&toNetwork=eth&flow=fixed-rate&type=reverse".format(
-                    amount
-                )
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-            return data["summary"]["estimatedAmount"]
+            return await get_quote("eth", "eth", "usdt", "eth", amount, reverse=True)
 
         @router.get(
             "/price/sol/usdt/input",
             summary="Returns the amount of USDT you get for exact SOL",
         )
         async def get_price_sol_usdt_input(amount: float) -> float:
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=sol&fromNetwork=sol&fromAmount={}&toCurrency=usdt&toNetwork=eth&type=direct".format(
-                    amount
-                )
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-
-            return data["summary"]["estimatedAmount"]
+            return await get_quote("sol", "sol", "usdt", "eth", amount)
 
         @router.get(
             "/price/sol/usdt/output",
             summary="Returns the amount of SOL need to deposit for exact USDT",
         )
         async def get_price_sol_usdt_output(amount: float) -> float:
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=sol&fromNetwork=sol&toCurrency=usdt&toNetwork=eth&toAmount={}&flow=fixed-rate&type=reverse".format(
-                    amount
-                )
-                print(url)
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-
-            return data["summary"]["estimatedAmount"]
+            return await get_quote("sol", "sol", "usdt", "eth", amount, reverse=True)
 
         @router.get(
             "/price/usdt/eth/input",
@@ -332,40 +407,13 @@ class UserAPI(Function):
         async def get_price_usdt_eth_input(amount: float) -> float:
 
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
 
-            amount -= fee
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=usdt&fromNetwork=eth&fromAmount={}&toCurrency=eth&toNetwork=eth&type=direct".format(
-                    amount
-                )
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-
-            return data["summary"]["estimatedAmount"]
+            return await get_quote("usdt", "eth", "eth", "eth", amount - fee)
 
         @router.get(
             "/price/usdt/eth/output",
@@ -374,37 +422,15 @@ class UserAPI(Function):
         async def get_price_usdt_eth_output(amount: float) -> float:
 
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
 
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=usdt&fromNetwork=eth&toAmount={}&toCurrency=eth&toNetwork=eth&flow=fixed-rate&type=reverse".format(
-                    amount
-                )
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-            return data["summary"]["estimatedAmount"] + fee
+            return (
+                await get_quote("usdt", "eth", "eth", "eth", amount, reverse=True) + fee
+            )
 
         @router.get(
             "/price/usdt/sol/input",
@@ -413,40 +439,13 @@ class UserAPI(Function):
         async def get_price_usdt_sol_input(amount: float) -> float:
 
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
 
-            amount -= fee
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=usdt&fromNetwork=eth&fromAmount={}&toCurrency=sol&toNetwork=sol&type=direct".format(
-                    amount
-                )
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-
-            return data["summary"]["estimatedAmount"]
+            return await get_quote("usdt", "eth", "sol", "sol", amount - fee)
 
         @router.get(
             "/price/usdt/sol/output",
@@ -455,53 +454,28 @@ class UserAPI(Function):
         async def get_price_usdt_sol_output(amount: float) -> float:
 
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
 
-            try:
-                url = "https://vip-api.changenow.io/v1.2/exchange/estimate?fromCurrency=usdt&fromNetwork=eth&toCurrency=sol&toNetwork=sol&toAmount={}&flow=fixed-rate&type=reverse".format(
-                    amount
-                )
-                print(url)
-                response = requests.get(url)
-
-            except Exception as ex:
-                print(ex)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Something went wrong in server side",
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invaild access token",
-                )
-
-            data = json.loads(response.content.decode("utf-8"))
-
-            if data["summary"]["estimatedAmount"] == None:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Too low amount"
-                )
-
-            return data["summary"]["estimatedAmount"] + fee
+            return (
+                await get_quote("usdt", "eth", "sol", "sol", amount, reverse=True) + fee
+            )
 
         @router.get("/deposit_wallet/eth", summary="Return deposit wallet data")
         async def deposit_eth(
             amount: float,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session_no_retry),
         ) -> float:
             if amount == 0:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Amount must be more than 0",
                 )
-            response = cnio_api(
+            response = await cnio_api(
                 "CREATE_TX",
                 api_key=cfg.CN_API_KEY,
                 from_ticker="eth",
@@ -518,22 +492,25 @@ class UserAPI(Function):
             transaction.transaction_id = response["id"]
 
             session.add(transaction)
+            await counters.bump(session, int(payload.sub), counters.TRANSACTIONS)
 
-            dispatch_transaction.delay(response["id"])
+            outbox.enqueue(
+                session, dispatch_transaction, response["id"], int(payload.sub)
+            )
             return response["payinAddress"]
 
         @router.get("/deposit_wallet/sol", summary="Return deposit wallet data")
         async def deposit_sol(
             amount: float,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session_no_retry),
         ) -> float:
             if amount == 0:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Amount must be more than 0",
                 )
-            response = cnio_api(
+            response = await cnio_api(
                 "CREATE_TX",
                 api_key=cfg.CN_API_KEY,
                 from_ticker="sol",
@@ -550,8 +527,11 @@ class UserAPI(Function):
             transaction.transaction_id = response["id"]
 
             session.add(transaction)
+            await counters.bump(session, int(payload.sub), counters.TRANSACTIONS)
 
-            dispatch_transaction.delay(response["id"])
+            outbox.enqueue(
+                session, dispatch_transaction, response["id"], int(payload.sub)
+            )
             return response["payinAddress"]
 
         @router.post("/withdraw/eth", summary="Withdraw crypto with eth")
@@ -559,40 +539,57 @@ class UserAPI(Function):
             amount: float,
             address: str = Query(regex="0x[a-zA-Z0-9]{40}"),
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session),
         ):
             if amount == 0:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Amount must be more than 0",
                 )
-            user: User = session.query(User).filter(User.id == payload.sub).one()
-
+            user_id = int(payload.sub)
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
-
-            if user.balance < amount + fee:
+            entries = [
+                entry(user_id, -to_minor(amount), LedgerReason.Withdraw),
+                entry(user_id, -to_minor(fee), LedgerReason.Fee),
+            ]
+
+            # take the funds up front and commit, so the row isn't locked
+            # while the exchange and the chain are called
+            if not await debit(session, entries):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="amount exceeded"
                 )
+            user_profile.forget_after_commit(session, user_id)
+            await session.commit()
 
-            response = cnio_api(
-                "CREATE_TX",
-                api_key=cfg.CN_API_KEY,
-                from_ticker="usdterc20",
-                to_ticker="eth",
-                address=address,
-                amount=amount,
-            )
-
-            send_eth_stable_to(cfg.ETH_USDT_ADDRESS, response["payinAddress"], amount)
+            try:
+                response = await cnio_api(
+                    "CREATE_TX",
+                    api_key=cfg.CN_API_KEY,
+                    from_ticker="usdterc20",
+                    to_ticker="eth",
+                    address=address,
+                    amount=amount,
+                )
+
+                await run_in_threadpool(
+                    send_eth_stable_to,
+                    cfg.ETH_USDT_ADDRESS,
+                    response["payinAddress"],
+                    amount,
+                )
+            except Exception:
+                await append(session, reversal(entries))
+                await session.commit()
+                raise
 
             transaction = Transaction()
-            transaction.user_id = payload.sub
+            transaction.user_id = user_id
             transaction.amount_in = amount
             transaction.amount_out = response["amount"]
             transaction.method = DWMethod.Eth
@@ -600,9 +597,10 @@ class UserAPI(Function):
             transaction.transaction_id = response["id"]
 
             session.add(transaction)
-
-            user.balance -= amount + fee
-            user.withdraw_balance += amount
+            await counters.bump(session, user_id, counters.TRANSACTIONS)
+            await session.flush()
+            for e in entries:
+                e.transaction_id = transaction.id
 
             return
 
@@ -611,40 +609,57 @@ class UserAPI(Function):
             amount: float,
             address: str,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session),
         ):
             if amount == 0:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Amount must be more than 0",
                 )
-            user: User = session.query(User).filter(User.id == payload.sub).one()
-
+            user_id = int(payload.sub)
             fee = (
-                get_current_gas_price()
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
-
-            if user.balance < amount + fee:
+            entries = [
+                entry(user_id, -to_minor(amount), LedgerReason.Withdraw),
+                entry(user_id, -to_minor(fee), LedgerReason.Fee),
+            ]
+
+            # take the funds up front and commit, so the row isn't locked
+            # while the exchange and the chain are called
+            if not await debit(session, entries):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="amount exceeded"
                 )
+            user_profile.forget_after_commit(session, user_id)
+            await session.commit()
 
-            response = cnio_api(
-                "CREATE_TX",
-                api_key=cfg.CN_API_KEY,
-                from_ticker="usdterc20",
-                to_ticker="eth",
-                address=address,
-                amount=amount,
-            )
-
-            send_eth_stable_to(cfg.ETH_USDT_ADDRESS, response["payinAddress"], amount)
+            try:
+                response = await cnio_api(
+                    "CREATE_TX",
+                    api_key=cfg.CN_API_KEY,
+                    from_ticker="usdterc20",
+                    to_ticker="eth",
+                    address=address,
+                    amount=amount,
+                )
+
+                await run_in_threadpool(
+                    send_eth_stable_to,
+                    cfg.ETH_USDT_ADDRESS,
+                    response["payinAddress"],
+                    amount,
+                )
+            except Exception:
+                await append(session, reversal(entries))
+                await session.commit()
+                raise
 
             transaction = Transaction()
-            transaction.user_id = payload.sub
+            transaction.user_id = user_id
             transaction.amount_in = amount
             transaction.amount_out = response["amount"]
             transaction.method = DWMethod.Eth
@@ -652,9 +667,10 @@ class UserAPI(Function):
             transaction.transaction_id = response["id"]
 
             session.add(transaction)
-
-            user.balance -= amount + fee
-            user.withdraw_balance += amount
+            await counters.bump(session, user_id, counters.TRANSACTIONS)
+            await session.flush()
+            for e in entries:
+                e.transaction_id = transaction.id
 
             return
 
@@ -662,30 +678,52 @@ class UserAPI(Function):
         async def get_records(
             offset: int = 0,
             count: int = 10,
+            cursor: str = None,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            total = (
-                session.query(Transaction)
-                .filter(Transaction.user_id == payload.sub)
-                .count()
+            # without a cursor: legacy offset paging with a total,
+            # with one (empty for the first page): keyset paging, no count
+            query = select(*rows.TRANSACTION_ITEM).where(
+                Transaction.user_id == payload.sub
             )
-            records = list(
-                session.query(Transaction)
-                .filter(Transaction.user_id == payload.sub)
-                .order_by(desc(Transaction.created_at))
-                .offset(offset)
-                .limit(count)
+            if cursor is None:
+                total = await counters.get(
+                    session, int(payload.sub), counters.TRANSACTIONS
+                )
+                query = query.offset(offset)
+            elif cursor != "":
+                query = query.where(
+                    keyset_before(Transaction.created_at, Transaction.id, cursor)
+                )
+
+            records, next_cursor = next_page(
+                list(
+                    (
+                        await session.execute(
+                            query.order_by(
+                                desc(Transaction.created_at), desc(Transaction.id)
+                            ).limit(count + 1)
+                        )
+                    ).all()
+                ),
+                count,
+                lambda record: (record.created_at, record.id),
             )
-            return {"records": records, "total": total}
+
+            records = [rows.transaction_item(record) for record in records]
+            if cursor is None:
+                return JSONResponse(
+                    {"records": records, "total": total, "next_cursor": next_cursor}
+                )
+            return JSONResponse({"records": records, "next_cursor": next_cursor})
 
         @router.get("/nft/wallet/eth", summary="Get all nft data from wallet address")
         async def get_nft_eth(
             address: str = Query(regex="0x[a-zA-Z0-9]{40}"),
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
         ):
-            nfts = self.opensea.assets(owner=address, order_by="sale_date")
+            nfts = await opensea.assets(owner=address, order_by="sale_date")
 
             response_data = []
 
@@ -725,7 +763,7 @@ class UserAPI(Function):
         async def deposit_eth_nft(
             tx_hash: str = Query(default=None, regex="0x[a-z0-9]{64}"),
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
             if tx_hash == None:
                 raise HTTPException(
@@ -733,18 +771,28 @@ class UserAPI(Function):
                     detail="You need to set hash",
                 )
 
-            if (
-                session.query(NFTHistory)
-                .filter(NFTHistory.transaction_hash == tx_hash)
-                .count()
-                > 0
+            # a hash deposited by any user, on any shard
+            if any(
+                await shards.scalars_everywhere(
+                    select(
+                        or_(
+                            exists().where(NFTHistory.transaction_hash == tx_hash),
+                            exists().where(
+                                NFTHistoryArchive.transaction_hash == tx_hash
+                            ),
+                        )
+                    )
+                )
             ):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="Already registered"
                 )
 
-            wait_transaction_receipt(tx_hash)
-            tx_data = get_transaction_nft_data(tx_hash)
+            user_id = int(payload.sub)
+            session = shards.for_user(user_id)
+            # minutes on a busy chain, off the event loop
+            await run_in_threadpool(wait_transaction_receipt, tx_hash)
+            tx_data = await run_in_threadpool(get_transaction_nft_data, tx_hash)
 
             deposited = []
             for log in tx_data:
@@ -764,7 +812,6 @@ class UserAPI(Function):
                     (token_id, amount) = erc1155_data_dispatch(log.data)
                     token_address = log.address
                     nft_type = NFTType.ERC1155
-                    response = self.opensea.asset(log.address, token_id)
 
                 else:
                     continue
@@ -772,15 +819,16 @@ class UserAPI(Function):
                 print(token_address, token_id, nft_type, amount)
                 price = 0
                 if nft_type == NFTType.ERC721:
-                    last_nfts: list[NFT] = list(
-                        session.query(NFT)
-                        .filter(
-                            and_(
-                                NFT.token_address == token_address,
-                                NFT.token_id == token_id,
+                    last_nfts: list[NFT] = sorted(
+                        await shards.scalars_everywhere(
+                            select(NFT).where(
+                                and_(
+                                    NFT.token_address == token_address,
+                                    NFT.token_id == str(token_id),
+                                )
                             )
-                        )
-                        .all()
+                        ),
+                        key=lambda nft: nft.id,
                     )
 
                     if (
@@ -794,56 +842,77 @@ class UserAPI(Function):
                     if len(last_nfts) > 0:
                         price = last_nfts[len(last_nfts) - 1].price
 
-                for _ in range(amount):
+                # ERC1155 copies stack on the user's holding of that token
+                new_nft = None
+                if nft_type == NFTType.ERC1155:
+                    new_nft = await session.scalar(
+                        select(NFT).where(
+                            and_(
+                                NFT.token_address == token_address,
+                                NFT.token_id == str(token_id),
+                                NFT.user_id == user_id,
+                                NFT.network == Network.Ethereum,
+                                NFT.deleted == False,
+                            )
+                        )
+                    )
 
+                holds = new_nft is not None
+                if not holds:
                     new_nft = NFT()
-                    new_nft.user_id = payload.sub
+                    new_nft.user_id = user_id
                     new_nft.token_address = token_address
                     new_nft.token_id = token_id
                     new_nft.price = price
                     new_nft.network = Network.Ethereum
                     new_nft.nft_type = nft_type
-
-                    try:
-                        response = self.opensea.asset(token_address, token_id)
-                        new_nft.image_url = response["image_url"]
-                        new_nft.name = response["name"]
-
-                        if response["last_sale"] != None:
-                            opensea_price = (
-                                float(response["last_sale"]["total_price"])
-                                / (
-                                    10
-                                    ** response["last_sale"]["payment_token"][
-                                        "decimals"
-                                    ]
-                                )
-                                * float(
-                                    response["last_sale"]["payment_token"]["usd_price"]
-                                )
-                            )
-                            if opensea_price > price:
-                                new_nft.price = opensea_price
-                    except:
-                        raise HTTPException(
-                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="Something went wrong on server side, Please retry",
+                    new_nft.quantity = amount
+                    session.add(new_nft)
+                else:
+                    price = new_nft.price
+                    new_nft.quantity = NFT.quantity + amount
+
+                try:
+                    response = await opensea.asset(token_address, token_id)
+                    new_nft.image_url = response["image_url"]
+                    new_nft.name = response["name"]
+
+                    if response["last_sale"] != None:
+                        opensea_price = (
+                            float(response["last_sale"]["total_price"])
+                            / (10 ** response["last_sale"]["payment_token"]["decimals"])
+                            * float(response["last_sale"]["payment_token"]["usd_price"])
                         )
+                        if opensea_price > price:
+                            new_nft.price = opensea_price
+                except:
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail="Something went wrong on server side, Please retry",
+                    )
 
-                    session.add(new_nft)
-                    session.flush()
-                    session.refresh(new_nft, attribute_names=["id"])
+                await session.flush()
+                if nft_type == NFTType.ERC1155:
+                    await session.refresh(new_nft, attribute_names=["quantity"])
+                if not holds:
+                    await counters.bump(
+                        session, user_id, counters.nfts(Network.Ethereum)
+                    )
 
-                    new_history = NFTHistory()
-                    new_history.nft_id = new_nft.id
-                    new_history.after_user_id = payload.sub
-                    new_history.note = NFTNote.Deposit
-                    new_history.price = new_nft.price
-                    new_history.transaction_hash = tx_hash
+                new_history = NFTHistory()
+                new_history.nft_id = new_nft.id
+                new_history.after_user_id = user_id
+                new_history.note = NFTNote.Deposit
+                new_history.price = new_nft.price
+                new_history.quantity = amount
+                new_history.transaction_hash = tx_hash
+                new_history.network = Network.Ethereum
+                new_history.nft_name = new_nft.name
+                new_history.nft_image_url = new_nft.image_url
 
-                    session.add(new_history)
-                    session.flush()
-                    deposited.append(new_nft)
+                session.add(new_history)
+                await counters.bump_history(session, new_history)
+                deposited.append(new_nft)
 
             return deposited
 
@@ -851,14 +920,13 @@ class UserAPI(Function):
         async def withdraw_nft_eth(
             id: int,
             address: str = Query(regex="0x[a-zA-Z0-9]{40}"),
+            quantity: int = Query(default=1, ge=1),
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session),
         ):
             user_id = int(payload.sub)
-            nft: NFT = (
-                session.query(NFT)
-                .filter(and_(NFT.id == id, NFT.deleted == False))
-                .one()
+            nft: NFT = await session.scalar(
+                select(NFT).where(and_(NFT.id == id, NFT.deleted == False))
             )
 
             if nft == None:
@@ -871,136 +939,136 @@ class UserAPI(Function):
                     status_code=status.HTTP_400_BAD_REQUEST, detail="Not your NFT"
                 )
 
-            user: User = session.query(User).filter(User.id == user_id).one()
-
-            if user == None:
+            if nft.nft_type == NFTType.ERC721 and quantity != 1:
                 raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Can't find such User"
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="ERC721 can only be withdrawn one at a time",
                 )
 
-            fee = (
-                get_current_gas_price()
+            fee = to_minor(
+                (await run_in_threadpool(get_current_gas_price))
                 * int(cfg.ETH_MAX_FEE)
                 / 10**18
                 * (await get_price_eth())
             )
+            entries = [entry(user_id, -fee, LedgerReason.Fee)]
 
-            if user.balance < fee:
+            if not await debit(session, entries):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient fee"
                 )
+            user_profile.forget_after_commit(session, user_id)
+            # take the units off the holding, it is deleted once it's empty
+            reserved = await session.execute(
+                update(NFT)
+                .where(
+                    and_(
+                        NFT.id == id,
+                        NFT.deleted == False,
+                        NFT.quantity >= quantity,
+                    )
+                )
+                .ordered_values(
+                    (NFT.deleted, NFT.quantity == quantity),
+                    (NFT.quantity, NFT.quantity - quantity),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if reserved.rowcount == 0:
+                await session.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Not enough quantity",
+                )
+            # our update holds the row lock, so this is the value it wrote
+            emptied = await session.scalar(select(NFT.deleted).where(NFT.id == id))
+            if emptied:
+                await counters.bump(session, user_id, counters.nfts(nft.network), -1)
+            await session.commit()
 
-            if nft.nft_type == NFTType.ERC721:
-                tx = send_eth_erc721_to(address, nft.token_address, nft.token_id)
-            else:
-                tx = send_eth_erc1155_to(address, nft.token_address, nft.token_id)
+            try:
+                if nft.nft_type == NFTType.ERC721:
+                    tx = await run_in_threadpool(
+                        send_eth_erc721_to, address, nft.token_address, nft.token_id
+                    )
+                else:
+                    tx = await run_in_threadpool(
+                        send_eth_erc1155_to,
+                        address,
+                        nft.token_address,
+                        nft.token_id,
+                        quantity,
+                    )
+            except Exception:
+                await append(session, reversal(entries))
+                await session.execute(
+                    update(NFT)
+                    .where(NFT.id == id)
+                    .values(deleted=False, quantity=NFT.quantity + quantity)
+                    .execution_options(synchronize_session=False)
+                )
+                if emptied:
+                    await counters.bump(session, user_id, counters.nfts(nft.network))
+                await session.commit()
+                raise
 
             nft_history = NFTHistory()
             nft_history.before_user_id = user_id
             nft_history.nft_id = id
             nft_history.price = nft.price
+            nft_history.quantity = quantity
             nft_history.note = NFTNote.Withdraw
             nft_history.transaction_hash = tx["transactionHash"].hex()
+            nft_history.network = nft.network
+            nft_history.nft_name = nft.name
+            nft_history.nft_image_url = nft.image_url
 
             session.add(nft_history)
-
-            user.balance -= fee
-            nft.deleted = True
+            await counters.bump_history(session, nft_history)
+            await session.flush()
+            entries[0].nft_history_id = nft_history.id
 
         @router.get("/list/nft/eth", summary="Get ETH NFT list")
         async def get_eth_nft_list(
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            nfts: list[NFT] = list(
-                session.query(NFT)
-                .filter(
+            nfts = await session.execute(
+                select(*rows.NFT_ITEM).where(
                     and_(
                         and_(
-                            NFT.user_id == payload.sub, NFT.network == Network.Ethereum
+                            NFT.user_id == payload.sub,
+                            NFT.network == Network.Ethereum,
                         ),
                         NFT.deleted == False,
                     )
                 )
-                .all()
             )
-
-            response_data = []
-            for nft in nfts:
-                data = {
-                    "id": nft.id,
-                    "imageUrl": nft.image_url,
-                    "price": nft.price,
-                }
-                response_data.append(data)
-
-            return response_data
+            return JSONResponse([rows.nft_item(nft) for nft in nfts])
 
         @router.get("/history/nft/eth", summary="Get Ethereum NFT history")
         async def get_eth_nft_history(
             offset: int = 0,
             count: int = 10,
+            cursor: str = None,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            user_id = int(payload.sub)
-            total = (
-                session.query(NFTHistory, NFT)
-                .filter(
-                    and_(NFT.id == NFTHistory.nft_id, NFT.network == Network.Ethereum)
-                )
-                .filter(
-                    or_(
-                        NFTHistory.before_user_id == user_id,
-                        NFTHistory.after_user_id == user_id,
-                    )
-                )
-                .count()
-            )
-            histories: list[any] = list(
-                session.query(NFTHistory, NFT)
-                .filter(
-                    and_(
-                        and_(
-                            NFT.id == NFTHistory.nft_id, NFT.network == Network.Ethereum
-                        ),
-                        or_(
-                            NFTHistory.before_user_id == user_id,
-                            NFTHistory.after_user_id == user_id,
-                        ),
-                    )
-                )
-                .order_by(desc(NFTHistory.created_at))
-                .offset(offset)
-                .limit(count)
+            return await self.nft_history(
+                session, Network.Ethereum, int(payload.sub), offset, count, cursor
             )
 
-            response_data = []
-            for (history, nft) in histories:
-                data = {
-                    "imageUrl": nft.image_url,
-                    "name": nft.name,
-                    "created_at": history.created_at,
-                    "transactionHash": history.transaction_hash,
-                    "note": history.note,
-                    "price": history.price,
-                }
-                response_data.append(data)
-
-            return {"total": total, "records": response_data}
-
         @router.post("/deposit/nft/sol", summary="Deposit Solana NFT")
         async def deposit_eth_nft(
             tx_sig: str,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            shards: ShardSessions = Depends(get_async_db_write_shards),
         ):
+            session = shards.for_user(int(payload.sub))
             # get nft transfer transaction data
             tx_datas = await get_solana_nft_transaction_data(tx_sig)
             # get current solana price
-            url = "https://api.coingecko.com/api/v3/simple/price?ids=solana&vs_currencies=usd"
-            response = requests.get(url)
-            sol_price = json.loads(response.content.decode("utf-8"))["solana"]["usd"]
+            sol_price = await get_price_sol()
             # loop nfts
             for tx_data in tx_datas:
                 if not await is_owner_of_nft(
@@ -1008,15 +1076,17 @@ class UserAPI(Function):
                 ):
                     continue
 
-                last_nfts: list[NFT] = list(
-                    session.query(NFT)
-                    .filter(
-                        and_(
-                            NFT.token_address == tx_data["token"],
-                            NFT.network == Network.Solana,
+                # the mint's earlier deposits, by any user on any shard
+                last_nfts: list[NFT] = sorted(
+                    await shards.scalars_everywhere(
+                        select(NFT).where(
+                            and_(
+                                NFT.token_address == tx_data["token"],
+                                NFT.network == Network.Solana,
+                            )
                         )
-                    )
-                    .all()
+                    ),
+                    key=lambda nft: nft.id,
                 )
 
                 if len(list(filter(lambda nft: nft.deleted == False, last_nfts))) > 0:
@@ -1026,7 +1096,7 @@ class UserAPI(Function):
                     tx_data["token"]
                 )
 
-                response = requests.get(url)
+                response = await http_client.get(url)
                 nft_data = json.loads(response.content.decode("utf-8"))
 
                 # create new nft
@@ -1046,7 +1116,7 @@ class UserAPI(Function):
                         tx_data["token"]
                     )
                 )
-                response = requests.get(url)
+                response = await http_client.get(url)
                 trade_data = json.loads(response.content.decode("utf-8"))
 
                 if len(list(trade_data["data"])) > 0:
@@ -1055,8 +1125,11 @@ class UserAPI(Function):
                         new_nft.price = price
 
                 session.add(new_nft)
-                session.flush()
-                session.refresh(new_nft, attribute_names=["id"])
+                await session.flush()
+                await session.refresh(new_nft, attribute_names=["id"])
+                await counters.bump(
+                    session, int(payload.sub), counters.nfts(Network.Solana)
+                )
 
                 new_history = NFTHistory()
                 new_history.after_user_id = payload.sub
@@ -1064,8 +1137,12 @@ class UserAPI(Function):
                 new_history.note = NFTNote.Deposit
                 new_history.transaction_hash = tx_sig
                 new_history.price = new_nft.price
+                new_history.network = Network.Solana
+                new_history.nft_name = new_nft.name
+                new_history.nft_image_url = new_nft.image_url
 
                 session.add(new_history)
+                await counters.bump_history(session, new_history)
 
             return tx_datas
 
@@ -1077,7 +1154,6 @@ class UserAPI(Function):
         async def get_nft_sol(
             address: str,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
         ):
             url = (
                 "https://api-mainnet.magiceden.dev/v2/wallets/{}/tokens?limit=4".format(
@@ -1086,13 +1162,9 @@ class UserAPI(Function):
             )
 
             try:
-                response = requests.get(url)
+                response = await http_client.get(url)
                 tokens = json.loads(response.content.decode("utf-8"))
-                url = "https://api.coingecko.com/api/v3/simple/price?ids=solana&vs_currencies=usd"
-                response = requests.get(url)
-                sol_price = json.loads(response.content.decode("utf-8"))["solana"][
-                    "usd"
-                ]
+                sol_price = await price_oracle.get("sol")
             except:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1109,7 +1181,7 @@ class UserAPI(Function):
                         token["mintAddress"]
                     )
                     try:
-                        response = requests.get(url)
+                        response = await http_client.get(url)
                         trade_data = json.loads(response.content.decode("utf-8"))
                     except:
                         continue
@@ -1141,13 +1213,11 @@ class UserAPI(Function):
             id: int,
             address: str,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_write_session),
         ):
             user_id = int(payload.sub)
-            nft: NFT = (
-                session.query(NFT)
-                .filter(and_(NFT.id == id, NFT.deleted == False))
-                .one()
+            nft: NFT = await session.scalar(
+                select(NFT).where(and_(NFT.id == id, NFT.deleted == False))
             )
 
             if nft == None:
@@ -1161,118 +1231,89 @@ class UserAPI(Function):
                     detail="Not owner of that NFT",
                 )
 
-            user: User = session.query(User).filter(User.id == user_id).one()
+            fee = to_minor(float(cfg.ETH_MAX_FEE) / 10**9 * (await get_price_eth()))
+            entries = [entry(user_id, -fee, LedgerReason.Fee)]
 
-            if user == None:
+            if not await debit(session, entries):
                 raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Not found such User"
+                    status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient fee"
                 )
-
-            fee = float(cfg.ETH_MAX_FEE) / 10**9 * (await get_price_eth())
-
-            if user.balance < fee:
+            user_profile.forget_after_commit(session, user_id)
+            # reserve the NFT, a concurrent withdrawal of it finds it deleted
+            reserved = await session.execute(
+                update(NFT)
+                .where(and_(NFT.id == id, NFT.deleted == False))
+                .values(deleted=True)
+                .execution_options(synchronize_session=False)
+            )
+            if reserved.rowcount == 0:
+                await session.rollback()
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient fee"
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Not found such NFT"
                 )
+            await counters.bump(session, user_id, counters.nfts(nft.network), -1)
+            await session.commit()
 
             try:
                 tx_data = await transfer_solana_nft(nft.token_address, address)
             except:
+                await append(session, reversal(entries))
+                await session.execute(
+                    update(NFT)
+                    .where(NFT.id == id)
+                    .values(deleted=False)
+                    .execution_options(synchronize_session=False)
+                )
+                await counters.bump(session, user_id, counters.nfts(nft.network))
+                await session.commit()
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Something went wrong on server side",
                 )
 
-            nft.deleted = True
-
             nft_history = NFTHistory()
             nft_history.before_user_id = user_id
             nft_history.nft_id = nft.id
             nft_history.note = NFTNote.Withdraw
             nft_history.price = nft.price
             nft_history.transaction_hash = tx_data
+            nft_history.network = nft.network
+            nft_history.nft_name = nft.name
+            nft_history.nft_image_url = nft.image_url
 
             session.add(nft_history)
+            await counters.bump_history(session, nft_history)
+            await session.flush()
+            entries[0].nft_history_id = nft_history.id
 
         @router.get("/list/nft/sol", summary="Get Solana NFT list")
         async def get_sol_nft_list(
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            nfts: list[NFT] = list(
-                session.query(NFT)
-                .filter(
+            nfts = await session.execute(
+                select(*rows.NFT_ITEM).where(
                     and_(
-                        and_(NFT.user_id == payload.sub, NFT.network == Network.Solana),
+                        and_(
+                            NFT.user_id == payload.sub,
+                            NFT.network == Network.Solana,
+                        ),
                         NFT.deleted == False,
                     )
                 )
-                .all()
             )
-
-            response_data = []
-            for nft in nfts:
-                data = {
-                    "id": nft.id,
-                    "imageUrl": nft.image_url,
-                    "price": nft.price,
-                }
-                response_data.append(data)
-
-            return response_data
+            return JSONResponse([rows.nft_item(nft) for nft in nfts])
 
         @router.get("/history/nft/sol", summary="Get Solana NFT history")
         async def get_sol_nft_history(
             offset: int = 0,
             count: int = 10,
+            cursor: str = None,
             payload: TokenPayload = Depends(get_current_user_from_oauth),
-            session: Session = Depends(get_db_session),
+            session: AsyncSession = Depends(get_async_db_read_session),
         ):
-            total = (
-                session.query(NFTHistory, NFT)
-                .filter(
-                    and_(
-                        and_(
-                            NFT.id == NFTHistory.nft_id, NFT.network == Network.Solana
-                        ),
-                        or_(
-                            NFTHistory.before_user_id == payload.sub,
-                            NFTHistory.after_user_id == payload.sub,
-                        ),
-                    )
-                )
-                .count()
+            return await self.nft_history(
+                session, Network.Solana, int(payload.sub), offset, count, cursor
             )
-            histories: list[any] = list(
-                session.query(NFTHistory, NFT)
-                .filter(
-                    and_(
-                        and_(
-                            NFT.id == NFTHistory.nft_id, NFT.network == Network.Solana
-                        ),
-                        or_(
-                            NFTHistory.before_user_id == payload.sub,
-                            NFTHistory.after_user_id == payload.sub,
-                        ),
-                    )
-                )
-                .order_by(desc(NFTHistory.created_at))
-                .offset(offset)
-                .limit(count)
-            )
-
-            response_data = []
-            for (history, nft) in histories:
-                data = {
-                    "imageUrl": nft.image_url,
-                    "name": nft.name,
-                    "created_at": history.created_at,
-                    "transactionHash": history.transaction_hash,
-                    "note": history.note,
-                    "price": history.price,
-                }
-                response_data.append(data)
-
-            return {"total": total, "records": response_data}
 
         app.include_router(router)
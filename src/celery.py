@@ -1,48 +1,173 @@
 from datetime import datetime, timedelta
 from celery import Celery
+from celery.signals import celeryd_init, task_prerun
 from celery.utils.log import get_task_logger
-from src.database import database, Database
-from src.models import Transaction, User
+from sqlalchemy.exc import IntegrityError
+from src.database import database, describe_pool_layout, shard_count, shard_for
+from src.models import LedgerReason, Transaction
+from src.utils import counters, rollups, summaries
+from src.utils.balance import (
+    credited,
+    entry,
+    ledger_lock,
+    take_snapshots,
+    to_minor,
+)
+from src.utils.history_partitions import add_partitions, archive_partitions, hot_since
+from src.utils.pool_metrics import current_holder
+from src.utils.user_profile import forget_sync
 from src.changenow_api.client import api_wrapper as cnio_api
 from config import cfg
 
-celery = Celery(
-    __name__, broker="redis://127.0.0.1:6379/0", backend="redis://127.0.0.1:6379/0"
-)
-
-database = Database()
-engine = database.get_db_connection()
-session = database.get_db_session()
+celery = Celery(__name__, broker=cfg.REDIS_URL, backend=cfg.REDIS_URL)
+# must match the process count the connection budget was split for
+celery.conf.worker_concurrency = int(cfg.CELERY_CONCURRENCY)
+# run with `celery -A src.celery beat` next to the workers
+celery.conf.beat_schedule = {
+    "snapshot-balances": {
+        "task": "src.celery.snapshot_balances",
+        "schedule": float(cfg.BALANCE_SNAPSHOT_SECONDS),
+    },
+    "maintain-nft-history": {
+        "task": "src.celery.maintain_nft_history",
+        "schedule": 24 * 60 * 60.0,
+    },
+    "rollup-transactions": {
+        "task": "src.celery.rollup_transactions",
+        "schedule": float(cfg.TRANSACTION_ROLLUP_SECONDS),
+    },
+    "repair-user-counters": {
+        "task": "src.celery.repair_user_counters",
+        "schedule": 24 * 60 * 60.0,
+    },
+}
 
 celery_log = get_task_logger(__name__)
 
 
+@celeryd_init.connect
+def log_pool_layout(**kwargs):
+    celery_log.info("DB pool layout: " + describe_pool_layout())
+
+
+@task_prerun.connect
+def name_pool_holder(task=None, **kwargs):
+    current_holder.set(task.name)
+
+
 @celery.task
-def dispatch_transaction(id: str) -> None:
+def dispatch_transaction(id: str, user_id: int = None) -> None:
     import time
 
-    transaction: Transaction = (
-        session.query(Transaction).filter(Transaction.transaction_id == id).one()
-    )
-    endTime = datetime.strptime(
-        str(transaction.created_at), "%Y-%m-%d %H:%M:%S"
-    ) + timedelta(days=1)
-    while transaction.status != "finished":
+    # tasks queued before sharding carry no user_id, their rows are on the home shard
+    session = database.get_db_session(0 if user_id is None else shard_for(user_id))
+    try:
+        transaction: Transaction = (
+            session.query(Transaction).filter(Transaction.transaction_id == id).one()
+        )
+        if credited(session, transaction.id):
+            return
+        endTime = datetime.strptime(
+            str(transaction.created_at), "%Y-%m-%d %H:%M:%S"
+        ) + timedelta(days=1)
+        while transaction.status != "finished":
+            try:
+                response = cnio_api(
+                    "TX_STATUS", id=transaction.transaction_id, api_key=cfg.CN_API_KEY
+                )
+                celery_log.info(transaction.transaction_id + response["status"])
+                transaction.status = response["status"]
+
+                if datetime.now() > endTime:
+                    break
+            except Exception as ex:
+                celery_log.error(ex)
+
+            # hand the connection back to the pool while sleeping
+            session.commit()
+            time.sleep(500)
+
+        if transaction.status != "finished":
+            # failed, refunded or expired, or still pending after a day
+            session.commit()
+            return
+        session.execute(ledger_lock(transaction.user_id))
+        session.add(
+            entry(
+                transaction.user_id,
+                to_minor(transaction.amount_out),
+                LedgerReason.Deposit,
+                transaction_id=transaction.id,
+            )
+        )
+        try:
+            session.commit()
+        except IntegrityError:
+            # the outbox delivers at least once, uq_balance_entry_transaction
+            # turns the second credit away whatever either run read
+            session.rollback()
+            return
+        forget_sync(transaction.user_id)
+    finally:
+        session.close()
+
+
+@celery.task
+def snapshot_balances() -> None:
+    for shard in range(shard_count()):
+        session = database.get_db_session(shard)
         try:
-            response = cnio_api(
-                "TX_STATUS", id=transaction.transaction_id, api_key=cfg.CN_API_KEY
+            folded = take_snapshots(session)
+            celery_log.info(
+                "balance snapshots updated for {} users on shard {}".format(
+                    folded, shard
+                )
             )
-            celery_log.info(transaction.transaction_id + response["status"])
-            transaction.status = response["status"]
+        finally:
+            session.close()
 
-            if datetime.now() > endTime:
-                break
-        except Exception as ex:
-            celery_log.error(ex)
 
-        time.sleep(500)
+@celery.task
+def maintain_nft_history() -> None:
+    for shard in range(shard_count()):
+        with database.get_db_connection(shard).connect() as connection:
+            added = add_partitions(connection, int(cfg.NFT_HISTORY_MONTHS_AHEAD))
+            archived = archive_partitions(connection, hot_since())
+            celery_log.info(
+                "nft_history partitions on shard {} added {}, archived {}".format(
+                    shard, added, archived
+                )
+            )
 
-    user: User = session.query(User).filter(User.id == Transaction.user_id).one()
 
-    user.balance += transaction.amount_out
-    user.deposit_balance += transaction.amount_out
+@celery.task
+def repair_user_counters() -> None:
+    for shard in range(shard_count()):
+        session = database.get_db_session(shard)
+        try:
+            fixed = counters.repair(session)
+            fixed += summaries.repair(session)
+            celery_log.info(
+                "user counters and summaries repaired on shard {}: {}".format(
+                    shard, fixed
+                )
+            )
+        finally:
+            session.close()
+
+
+@celery.task
+def rollup_transactions(full: bool = False) -> None:
+    for shard in range(shard_count()):
+        session = database.get_db_session(shard)
+        try:
+            days = rollups.refresh(
+                session, int(cfg.TRANSACTION_ROLLUP_SETTLE_SECONDS), full
+            )
+            celery_log.info(
+                "transaction rollups recounted for {} days on shard {}".format(
+                    days, shard
+                )
+            )
+        finally:
+            session.close()
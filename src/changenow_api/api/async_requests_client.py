@@ -0,0 +1,19 @@
+from src.utils import http_client
+
+HEADERS = {'Content-Type': 'application/json; charset=utf-8', 'User-Agent': 'Mozilla/5.0'}
+
+
+async def get(url, params=None):
+    if params is None:
+        params = {}
+    response = await http_client.get(url, params=params, headers=HEADERS)
+    response.raise_for_status()
+    return response.json()
+
+
+async def post(url, body=None):
+    if body is None:
+        body = {}
+    response = await http_client.post(url, json=body, headers=HEADERS)
+    response.raise_for_status()
+    return response.json()
@@ -4,6 +4,10 @@ from . import requests_client
 class ChangeNowAPi:
     __api_url = "https://changenow.io/api/v1/"
 
+    def __init__(self, client=requests_client):
+        # requests_client blocks, async_requests_client returns coroutines
+        self._client = client
+
     def get_currencies(self, active=False, fixed_rate=False):
         payload = {}
         if active:
@@ -13,7 +17,7 @@ class ChangeNowAPi:
             payload["fixedRate"] = "true"
 
         url = self.__api_url + "currencies"
-        response = requests_client.get(url, params=payload)
+        response = self._client.get(url, params=payload)
         return response
 
     def get_currencies_to(self, ticker="", fixed_rate=False):
@@ -22,12 +26,12 @@ class ChangeNowAPi:
             payload["fixedRate"] = "true"
 
         url = self.__api_url + "{}/{}".format("currencies-to", ticker)
-        response = requests_client.get(url, params=payload)
+        response = self._client.get(url, params=payload)
         return response
 
     def get_currency_info(self, ticker=""):
         url = self.__api_url + "{}/{}".format("currencies", ticker)
-        response = requests_client.get(url)
+        response = self._client.get(url)
         return response
 
     def get_transactions_list(
@@ -51,29 +55,29 @@ class ChangeNowAPi:
             "dateTo": date_to,
         }
         url = self.__api_url + "{}/{}".format("transactions", api_key)
-        response = requests_client.get(url, params=payload)
+        response = self._client.get(url, params=payload)
         return response
 
     def get_transaction_status(self, id="", api_key=""):
         url = self.__api_url + "{}/{}/{}".format("transactions", id, api_key)
-        response = requests_client.get(url)
+        response = self._client.get(url)
         return response
 
     def get_available_pairs(self, include_partners=False):
         payload = {"includePartners": str(include_partners).lower()}
         url = self.__api_url + "market-info/available-pairs"
-        response = requests_client.get(url, params=payload)
+        response = self._client.get(url, params=payload)
         return response
 
     def get_minimal_exchange_amount(self, from_ticker="", to_ticker=""):
         from_to = "{}_{}".format(from_ticker.lower(), to_ticker.lower())
         url = self.__api_url + "{}/{}".format("min-amount", from_to)
-        response = requests_client.get(url)
+        response = self._client.get(url)
         return response
 
     def get_fixed_rate_available_pairs(self, api_key=""):
         url = self.__api_url + "{}/{}".format("market-info/fixed-rate", api_key)
-        response = requests_client.get(url)
+        response = self._client.get(url)
         return response
 
     def get_exchange_amount(
@@ -86,7 +90,7 @@ class ChangeNowAPi:
 
         from_to = "{}_{}".format(from_ticker.lower(), to_ticker.lower())
         url = self.__api_url + "{}/{}/{}".format(method_name, amount, from_to)
-        response = requests_client.get(url, params=payload)
+        response = self._client.get(url, params=payload)
         return response
 
     def create_exchange(
@@ -125,5 +129,5 @@ class ChangeNowAPi:
             method_name += "/fixed-rate"
 
         url = self.__api_url + "{}/{}".format(method_name, api_key)
-        response = requests_client.post(url, body=transaction_data)
+        response = self._client.post(url, body=transaction_data)
         return response
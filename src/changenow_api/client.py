@@ -1,21 +1,30 @@
-from .api import changenow_api
+from .api import async_requests_client, changenow_api
+from httpx import HTTPStatusError, TransportError
 from urllib.error import HTTPError, URLError
 from .exceptions import ChangeNowApiError
 
 _CLIENT = changenow_api.ChangeNowAPi()
+# for the web handlers, through the worker's pooled client
+_ASYNC_CLIENT = changenow_api.ChangeNowAPi(async_requests_client)
 
-_METHODS = {
-    'CURRENCIES': _CLIENT.get_currencies,
-    'CURRENCIES_TO': _CLIENT.get_currencies_to,
-    'CURRENCY_INFO': _CLIENT.get_currency_info,
-    'LIST_OF_TRANSACTIONS': _CLIENT.get_transactions_list,
-    'TX_STATUS': _CLIENT.get_transaction_status,
-    'ESTIMATED': _CLIENT.get_exchange_amount,
-    'MIN_AMOUNT': _CLIENT.get_minimal_exchange_amount,
-    'PAIRS': _CLIENT.get_available_pairs,
-    'FIXED_RATE_PAIRS': _CLIENT.get_fixed_rate_available_pairs,
-    'CREATE_TX': _CLIENT.create_exchange
-}
+
+def _methods(client):
+    return {
+        'CURRENCIES': client.get_currencies,
+        'CURRENCIES_TO': client.get_currencies_to,
+        'CURRENCY_INFO': client.get_currency_info,
+        'LIST_OF_TRANSACTIONS': client.get_transactions_list,
+        'TX_STATUS': client.get_transaction_status,
+        'ESTIMATED': client.get_exchange_amount,
+        'MIN_AMOUNT': client.get_minimal_exchange_amount,
+        'PAIRS': client.get_available_pairs,
+        'FIXED_RATE_PAIRS': client.get_fixed_rate_available_pairs,
+        'CREATE_TX': client.create_exchange
+    }
+
+
+_METHODS = _methods(_CLIENT)
+_ASYNC_METHODS = _methods(_ASYNC_CLIENT)
 
 
 def api_wrapper(call_name, **kwargs):
@@ -28,3 +37,15 @@ def api_wrapper(call_name, **kwargs):
         raise ChangeNowApiError(err.reason, err.code, err.read())
     except URLError as err:
         raise ChangeNowApiError(err.reason)
+
+
+async def async_api_wrapper(call_name, **kwargs):
+    try:
+        response = await _ASYNC_METHODS[call_name](**kwargs)
+        return response
+    except KeyError as err:
+        raise ValueError('Undefined api method: {}'.format(err.args[0]))
+    except HTTPStatusError as err:
+        raise ChangeNowApiError(err.response.reason_phrase, err.response.status_code, err.response.content)
+    except TransportError as err:
+        raise ChangeNowApiError(str(err))
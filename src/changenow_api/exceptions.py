@@ -1,8 +1,12 @@
 import json
 
 
-class ChangeNowApiError(BaseException):
+class ChangeNowApiError(Exception):
     def __init__(self, reason, code='', body=''):
         self.reason = reason
         self.code = code
-        self.body = json.loads(body)
+        try:
+            self.body = json.loads(body)
+        except ValueError:
+            # no body, or an error page from a proxy
+            self.body = body
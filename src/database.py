@@ -1,44 +1,318 @@
-from sqlalchemy import create_engine
+import hashlib
+import os
+from threading import Lock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from config import cfg
+from src.utils import pool_metrics, sql_profiler
+from src.utils.pool_metrics import InstrumentedAsyncPool, InstrumentedQueuePool
 
 MYSQL_URL = "mysql+pymysql://{}:{}@{}:{}/{}?charset=utf8".format(cfg.DB_USER, cfg.DB_PASSWORD, cfg.DB_HOST, cfg.DB_PORT, cfg.DATABASE)
-POOL_SIZE = 20
+ASYNC_MYSQL_URL = "mysql+aiomysql://{}:{}@{}:{}/{}?charset=utf8".format(cfg.DB_USER, cfg.DB_PASSWORD, cfg.DB_HOST, cfg.DB_PORT, cfg.DATABASE)
+ASYNC_MYSQL_REPLICA_URL = "mysql+aiomysql://{}:{}@{}:{}/{}?charset=utf8".format(cfg.DB_USER, cfg.DB_PASSWORD, cfg.DB_REPLICA_HOST, cfg.DB_REPLICA_PORT, cfg.DATABASE)
 POOL_RECYCLE = 3600
 POOL_TIMEOUT = 15
-MAX_OVERFLOW = 2
 CONNECT_TIMEOUT = 60
+ASYNC_DRIVERS = {"mysql+pymysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+
+# Users are spread over the shards by bucket, a hash of user_id, and
+# DB_SHARD_MAP assigns buckets to shards, so resharding moves whole buckets
+# (see scripts/reshard.py). With several shards the MySQL ids of each
+# shard step by SHARD_ID_STRIDE from their own offset, so a user's rows keep
+# their ids on any shard, which caps the shard count at SHARD_ID_STRIDE.
+SHARD_BUCKETS = 1024
+SHARD_ID_STRIDE = 64
+
+# One engine and one sessionmaker per kind, shard and process. The async
+# engines serve the gunicorn workers (primary for writes, replica or primary
+# in autocommit for reads), the sync engine serves celery and scripts.
+_registry_lock = Lock()
+_registry_pid = None
+_engines = {}
+_sessionmakers = {}
+_shard_maps = {}
+
+
+def shard_urls():
+  """Sync URL of every shard. Shard 0, the home shard, is the DB_HOST database
+  and also holds the tables that aren't split by user."""
+  return [MYSQL_URL] + [url.strip() for url in cfg.DB_SHARD_URLS.split(",") if url.strip()]
+
+
+def shard_count():
+  return len(shard_urls())
+
+
+def parse_shard_map(spec, shards):
+  """Bucket -> shard list from "0-511:0,512-1023:1", an empty spec splits the
+  buckets evenly and in order across the shards."""
+  if not spec.strip():
+    return [bucket * shards // SHARD_BUCKETS for bucket in range(SHARD_BUCKETS)]
+  buckets = [None] * SHARD_BUCKETS
+  for part in spec.split(","):
+    span, shard = part.split(":")
+    first, _, last = span.partition("-")
+    for bucket in range(int(first), int(last or first) + 1):
+      buckets[bucket] = int(shard)
+  if None in buckets or not all(0 <= shard < shards for shard in buckets):
+    raise ValueError("Shard map must give each of the {} buckets one of the {} shards: {}".format(SHARD_BUCKETS, shards, spec))
+  return buckets
+
+
+def shard_map():
+  key = (cfg.DB_SHARD_MAP, shard_count())
+  if key not in _shard_maps:
+    _shard_maps[key] = parse_shard_map(*key)
+  return _shard_maps[key]
+
+
+def bucket_of(user_id):
+  # md5 for its spread, crc32 clusters neighbouring ids; never change it,
+  # every row is placed by it
+  return int.from_bytes(hashlib.md5(str(int(user_id)).encode()).digest()[:4], "big") % SHARD_BUCKETS
+
+
+def shard_for(user_id):
+  """Shard holding every row of user_id."""
+  return shard_map()[bucket_of(user_id)]
+
+
+def pool_layout(shard=0):
+  """Splits cfg.DB_MAX_CONNECTIONS across every process that holds a pool.
+
+  Each shard is a server of its own with the same budget, only the home
+  shard has the read replica."""
+  replica = bool(cfg.DB_REPLICA_HOST) and shard == 0
+  web_workers = max(1, int(cfg.WEB_WORKERS))
+  celery_workers = int(cfg.CELERY_CONCURRENCY)
+  reserved = int(cfg.DB_RESERVED_CONNECTIONS)
+  sync_pool = max(1, int(cfg.DB_CELERY_POOL_SIZE))
+
+  async_pool = (int(cfg.DB_MAX_CONNECTIONS) - reserved - celery_workers * sync_pool) // web_workers
+  if async_pool < 2:
+    print("Warning: DB_MAX_CONNECTIONS leaves no connections for web workers, using 2")
+    async_pool = 2
+  # a replica has a budget of its own, otherwise reads share the primary's
+  read_pool = async_pool if replica else async_pool // 2
+  if not replica:
+    async_pool -= read_pool
+
+  return {
+    "budget": int(cfg.DB_MAX_CONNECTIONS),
+    "reserved": reserved,
+    "web_workers": web_workers,
+    "celery_workers": celery_workers,
+    "async": async_pool,
+    "read": read_pool,
+    "sync": sync_pool,
+    "peak": reserved + web_workers * (async_pool + (0 if replica else read_pool)) + celery_workers * sync_pool,
+    "replica": "{}:{}".format(cfg.DB_REPLICA_HOST, cfg.DB_REPLICA_PORT) if replica else "none",
+    "shards": shard_count(),
+  }
+
+
+def describe_pool_layout():
+  layout = pool_layout()
+  return "budget {budget} ({reserved} reserved) per shard, {shards} shards: {web_workers} web workers x ({async} write + {read} read), {celery_workers} celery workers x {sync} sync, peak {peak}, replica {replica}".format(**layout)
+
+
+def _pool_args(connections):
+  # pool_size + max_overflow never exceeds the process share
+  max_overflow = connections // 5
+  return {"pool_size": connections - max_overflow, "max_overflow": max_overflow}
+
+
+def _registry():
+  global _registry_pid
+  if _registry_pid != os.getpid():
+    # forked child: drop the parent's pools without touching their sockets
+    for engine in _engines.values():
+      getattr(engine, "sync_engine", engine).dispose(close=False)
+    _engines.clear()
+    _sessionmakers.clear()
+    _registry_pid = os.getpid()
+  return _engines, _sessionmakers
+
+
+def _interleave_ids(engine, shard):
+  engine = getattr(engine, "sync_engine", engine)
+  if engine.dialect.name != "mysql" or shard_count() == 1:
+    return
+
+  @event.listens_for(engine, "connect")
+  def set_id_offset(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SET SESSION auto_increment_increment = {}, auto_increment_offset = {}".format(SHARD_ID_STRIDE, shard + 1))
+    cursor.close()
+
+
+def _engine(kind, factory, shard=0):
+  with _registry_lock:
+    engines, _ = _registry()
+    if kind not in engines:
+      engines[kind] = factory()
+      _interleave_ids(engines[kind], shard)
+      pool_metrics.watch(kind, engines[kind])
+      sql_profiler.watch(engines[kind])
+    return engines[kind]
+
+
+def _sessionmaker(kind, engine, shard=0, **kwargs):
+  with _registry_lock:
+    _, makers = _registry()
+    if kind not in makers:
+      makers[kind] = sessionmaker(bind=engine, info={"shard": shard}, **kwargs)
+    return makers[kind]
+
+
+def _kind(kind, shard):
+  # the home shard keeps the plain names, they label the pool metrics
+  return kind if shard == 0 else "{}@{}".format(kind, shard)
+
+
+def _async_url(url):
+  url = make_url(url)
+  return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def _connect_args(url):
+  return {"connect_timeout": CONNECT_TIMEOUT} if make_url(url).get_backend_name() == "mysql" else {}
+
+
+def get_engine(shard=0):
+  kind, url = _kind("sync", shard), shard_urls()[shard]
+  return _engine(kind, lambda: create_engine(url, poolclass=InstrumentedQueuePool, pool_logging_name=kind, pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT,
+    connect_args=_connect_args(url), **_pool_args(pool_layout(shard)["sync"])), shard)
+
+
+def get_async_engine(shard=0):
+  kind, url = _kind("async", shard), _async_url(shard_urls()[shard])
+  return _engine(kind, lambda: create_async_engine(url, poolclass=InstrumentedAsyncPool, pool_logging_name=kind, pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT,
+    connect_args=_connect_args(url), **_pool_args(pool_layout(shard)["async"])), shard)
+
+
+def get_async_read_engine(shard=0):
+  # autocommit: reads never hold a transaction open, and neither COMMIT nor
+  # the pool's reset ROLLBACK is sent for them
+  kind = _kind("async_read", shard)
+  url = ASYNC_MYSQL_REPLICA_URL if cfg.DB_REPLICA_HOST and shard == 0 else _async_url(shard_urls()[shard])
+  return _engine(kind, lambda: create_async_engine(url, poolclass=InstrumentedAsyncPool, pool_logging_name=kind, pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT,
+    connect_args=_connect_args(url), isolation_level="AUTOCOMMIT", skip_autocommit_rollback=True,
+    **_pool_args(pool_layout(shard)["read"])), shard)
+
+
+def get_sessionmaker(shard=0):
+  return _sessionmaker(_kind("sync", shard), get_engine(shard), shard)
+
+
+def get_async_sessionmaker(shard=0):
+  return _sessionmaker(_kind("async", shard), get_async_engine(shard), shard, class_=AsyncSession, expire_on_commit=False)
+
+
+def get_async_read_sessionmaker(shard=0):
+  return _sessionmaker(_kind("async_read", shard), get_async_read_engine(shard), shard, class_=AsyncSession, expire_on_commit=False)
+
 
 class Database():
-  def __init__(self) -> None:
-    self.connection_is_active = False
-    self.engine = None
-
-  def get_db_connection(self):
-    if self.connection_is_active == False:
-      connect_args = {"connect_timeout":CONNECT_TIMEOUT}
-      try:
-        self.engine = create_engine(MYSQL_URL, pool_size=POOL_SIZE, pool_recycle=POOL_RECYCLE,
-        pool_timeout=POOL_TIMEOUT, max_overflow=MAX_OVERFLOW, connect_args=connect_args)
-        self.connection_is_active
-        return self.engine
-      except Exception as ex:
-        print("Error connecting to DB : ", ex)
-    return self.engine
-
-  def get_db_session(self):
-    if self.engine == None:
-      print("No database engine")
+  """Facade over the process-wide registry, every instance shares the same
+  engines. Every method takes the shard, the home shard by default."""
+
+  def get_db_connection(self, shard=0):
+    try:
+      return get_engine(shard)
+    except Exception as ex:
+      print("Error connecting to DB : ", ex)
       return None
+
+  def get_db_session(self, shard=0):
     try:
-      Session = sessionmaker(bind=self.engine)
-      session = Session()
-      return session
+      return get_sessionmaker(shard)()
     except Exception as ex:
       print("Error getting DB session : ", ex)
       return None
 
+  # asyncio variants used by the FastAPI handlers, so a slow query awaits on
+  # the event loop instead of blocking every other request of the worker
+  def get_async_db_connection(self, shard=0):
+    try:
+      return get_async_engine(shard)
+    except Exception as ex:
+      print("Error connecting to DB : ", ex)
+      return None
+
+  def get_async_db_session(self, shard=0):
+    try:
+      return get_async_sessionmaker(shard)()
+    except Exception as ex:
+      print("Error getting async DB session : ", ex)
+      return None
+
+  def get_async_db_read_session(self, shard=0):
+    try:
+      return get_async_read_sessionmaker(shard)()
+    except Exception as ex:
+      print("Error getting async DB read session : ", ex)
+      return None
+
+
+class ShardSessions():
+  """The sessions of one unit of work, opened on first use of each shard.
+
+  For work that isn't confined to one user's shard, the user directory on
+  the home shard or checks across every user. Commits are per shard, home
+  first, not atomic across shards.
+  """
+
+  def __init__(self, open_session):
+    self._open = open_session
+    self.sessions = {}
+
+  def __getitem__(self, shard):
+    if shard not in self.sessions:
+      self.sessions[shard] = self._open(shard)
+    return self.sessions[shard]
+
+  @property
+  def home(self):
+    return self[0]
+
+  def for_user(self, user_id):
+    return self[shard_for(user_id)]
+
+  def opened(self):
+    return [self.sessions[shard] for shard in sorted(self.sessions)]
+
+  async def scalars_everywhere(self, query):
+    """query run on every shard, the results one after the other."""
+    results = []
+    for shard in range(shard_count()):
+      results += list(await self[shard].scalars(query))
+    return results
+
+  async def rows_everywhere(self, query):
+    """query's rows from every shard, one shard after the other."""
+    rows = []
+    for shard in range(shard_count()):
+      rows += (await self[shard].execute(query)).all()
+    return rows
+
+  async def commit(self):
+    for session in self.opened():
+      await session.commit()
+
+  async def rollback(self):
+    for session in self.opened():
+      await session.rollback()
+
+  async def close(self):
+    for session in self.opened():
+      await session.close()
+
+
 Base = declarative_base()
-database = Database()
\ No newline at end of file
+database = Database()
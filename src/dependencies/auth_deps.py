@@ -1,14 +1,16 @@
-from fastapi import status, HTTPException, Depends
+from fastapi import status, HTTPException, Depends, Header
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from operator import and_
 from datetime import datetime
 from jose import jwt
 from pydantic import ValidationError
-from .database_deps import get_db_session
-from ..models import User
+from .database_deps import get_async_db_read_session, get_db_session
+from ..models import RoleEnum, User
 
-from ..utils.auth import ALGORITHM, JWT_REFRESH_SECRET_KEY, JWT_SECRET_KEY
+from ..utils.auth import ALGORITHM, JWT_REFRESH_SECRET_KEY, JWT_SECRET_KEY, is_debug_key
 from ..schemas.auth import TokenPayload
 
 email_oauth = OAuth2PasswordBearer(
@@ -58,3 +60,24 @@ async def get_current_user_from_refresh_token(token: str = Depends(email_oauth))
         )
 
     return token_data
+
+
+async def get_current_admin(
+    payload: TokenPayload = Depends(get_current_user_from_oauth),
+    session: AsyncSession = Depends(get_async_db_read_session),
+) -> TokenPayload:
+    role = await session.scalar(
+        select(User.role).where(and_(User.id == payload.sub, User.deleted == False))
+    )
+    if role not in (RoleEnum.Admin, RoleEnum.Dev):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+
+    return payload
+
+
+async def require_debug_key(x_debug_key: str = Header("")) -> None:
+    # checked without the database, so it still answers when the pool is exhausted
+    if not is_debug_key(x_debug_key):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
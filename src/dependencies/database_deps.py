@@ -1,12 +1,184 @@
-from ..database import database
+import asyncio
+import random
 
-engine = database.get_db_connection()
+from fastapi import Request
+from fastapi.routing import APIRoute
+from fastapi.security.utils import get_authorization_scheme_param
+from jose import jwt
+from pydantic import ValidationError
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from config import cfg
+from ..database import ShardSessions, database, shard_for
+from ..schemas.auth import TokenPayload
+from ..utils import recent_writes
+from ..utils.auth import ALGORITHM, JWT_SECRET_KEY
+from ..utils.pool_metrics import current_holder
+
+# InnoDB errors that roll the transaction back and are worth a second try
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+DEADLOCK_BACKOFF = 0.05
+
+def request_user(request: Request):
+  """Id of the user named by the request's access token, None without one.
+  It only picks sessions, get_current_user_from_oauth still rejects a bad
+  token."""
+  scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+  if scheme.lower() != "bearer" or not token:
+    return None
+  try:
+    return int(TokenPayload(**jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])).sub)
+  except (jwt.JWTError, ValidationError, ValueError):
+    return None
+
+def request_shard(request: Request):
+  """Shard of request_user(), the home shard without one."""
+  user_id = request_user(request)
+  return 0 if user_id is None else shard_for(user_id)
 
 # Dependencies
-async def get_db_session():
-  session = database.get_db_session()
+async def get_db_session(request: Request):
+  session = database.get_db_session(request_shard(request))
   try:
     yield session
   finally:
     session.commit()
-    session.close()
\ No newline at end of file
+    session.close()
+
+def _read_session(all_shards: bool):
+  async def get_session(request: Request):
+    # a user who just wrote stays on the primary until the replica has caught
+    # up, see recent_writes
+    user_id = request_user(request)
+    if user_id is not None and await recent_writes.wrote_recently(user_id):
+      shards = ShardSessions(database.get_async_db_session)
+    else:
+      shards = ShardSessions(database.get_async_db_read_session)
+    try:
+      yield shards if all_shards else shards[request_shard(request)]
+    finally:
+      await shards.close()
+  return get_session
+
+class _UnitOfWork():
+  """The write transaction of one attempt at a request, ended by
+  UnitOfWorkRoute before the response goes out: FastAPI runs the code after a
+  dependency's yield once the response is sent, and only once per request."""
+
+  def __init__(self, request: Request):
+    self.committed = False
+    self.ended = False
+    self.user_id = request_user(request)
+    def open_session(shard):
+      session = database.get_async_db_session(shard)
+      @event.listens_for(session.sync_session, "after_commit")
+      def on_commit(_):
+        # once anything is committed the request is no longer safe to replay
+        request.state.db_retry = False
+        self.committed = True
+      return session
+    self.shards = ShardSessions(open_session)
+
+  async def end(self, commit: bool):
+    """Commits, or rolls back, and closes every session opened. A failed
+    commit is rolled back and raised."""
+    if self.ended:
+      return
+    self.ended = True
+    try:
+      if commit:
+        await self.shards.commit()
+      else:
+        await self.shards.rollback()
+    except Exception:
+      await self.shards.rollback()
+      raise
+    finally:
+      # session.info["after_commit"]: coroutine functions run once the route
+      # is done, if anything it did was committed
+      callbacks = [callback for session in self.shards.opened() for callback in session.info.pop("after_commit", [])]
+      try:
+        if self.committed:
+          if self.user_id is not None:
+            await recent_writes.mark(self.user_id)
+          for callback in callbacks:
+            await callback()
+      finally:
+        await self.shards.close()
+
+def _write_session(retry: bool, all_shards: bool = False):
+  async def get_session(request: Request):
+    request.state.db_retry = retry
+    unit = _UnitOfWork(request)
+    if not hasattr(request.state, "db_units"):
+      raise RuntimeError("{} needs a UnitOfWorkRoute to commit".format(request.url.path))
+    request.state.db_units.append(unit)
+    try:
+      yield unit.shards if all_shards else unit.shards[request_shard(request)]
+    finally:
+      # the route ended the transaction already, unless it never got to run
+      await unit.end(commit=False)
+  return get_session
+
+# Read-only routes: an autocommit session, on the requesting user's shard,
+# that is never committed.
+get_async_db_read_session = _read_session(all_shards=False)
+# Write routes, under a UnitOfWorkRoute: one transaction on the requesting
+# user's shard committed when the route returns, before its response is sent,
+# and rolled back when it raises. UnitOfWorkRoute replays the request on a
+# deadlock.
+get_async_db_write_session = _write_session(retry=True)
+# for routes with side effects outside the database before their first commit
+get_async_db_write_session_no_retry = _write_session(retry=False)
+# ShardSessions for the routes that reach past the user's own shard, the auth
+# routes that go through the user directory and the deposit checks that look
+# at every user's rows
+get_async_db_read_shards = _read_session(all_shards=True)
+get_async_db_write_shards = _write_session(retry=True, all_shards=True)
+
+def is_retryable(ex: DBAPIError):
+  args = getattr(ex.orig, "args", ())
+  return bool(args) and args[0] in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT)
+
+async def _end_units(request: Request, commit: bool):
+  units, request.state.db_units = request.state.db_units, []
+  try:
+    for unit in units:
+      await unit.end(commit)
+  finally:
+    # a failed commit still leaves no session of the attempt open
+    for unit in units:
+      await unit.end(commit=False)
+
+class UnitOfWorkRoute(APIRoute):
+  """Commits the route's write transaction before its response is sent, a
+  commit that fails answers 500. Runs the route again, with jittered backoff,
+  when it hit a deadlock or lock wait timeout before committing anything,
+  the failed attempt's transaction rolled back first so its locks and rows
+  are gone."""
+
+  def get_route_handler(self):
+    handler = super().get_route_handler()
+
+    async def route_handler(request: Request):
+      # names the connections this request checks out, see /debug/pool/holders
+      current_holder.set("{} {}".format(request.method, self.path))
+      attempt = 0
+      while True:
+        request.state.db_retry = False
+        request.state.db_units = []
+        try:
+          response = await handler(request)
+          await _end_units(request, commit=True)
+          return response
+        except Exception as ex:
+          await _end_units(request, commit=False)
+          if not (isinstance(ex, DBAPIError) and request.state.db_retry and is_retryable(ex)) or attempt >= int(cfg.DB_DEADLOCK_RETRIES):
+            raise
+          attempt += 1
+          print("Retrying {} after : {}".format(request.url.path, ex.orig))
+          await asyncio.sleep(random.uniform(0, DEADLOCK_BACKOFF * 2 ** attempt))
+
+    return route_handler
@@ -2,17 +2,23 @@ from email.policy import default
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
     TIMESTAMP,
+    Date,
     Boolean,
     text,
     ForeignKey,
     Enum as SAEnum,
     Float,
+    Index,
+    UniqueConstraint,
+    JSON,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.associationproxy import association_proxy
 from src.database import Base
+from src.utils.column_types import ChainAddress, TokenId, TransactionHash
 from enum import Enum
 
 
@@ -31,6 +37,12 @@ class SignMethod(str, Enum):
 
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        Index("ix_user_address_deleted", "address", "deleted"),
+        # admin search, see src.utils.user_search
+        Index("ix_user_created", "created_at"),
+        Index("ix_user_sign_method_created", "sign_method", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(512), nullable=False, default="Unnamed")
     address = Column(String(512), nullable=True)
@@ -38,10 +50,6 @@ class User(Base):
     hashed_password = Column(String(512), nullable=True)
     role = Column(SAEnum(RoleEnum), nullable=False, default=RoleEnum.User)
     avatar_id = Column(Integer, ForeignKey("avatar.id"), nullable=False, default=0)
-    balance = Column(Float, nullable=False, default=0)
-    rollback = Column(Float, nullable=False, default=0)
-    deposit_balance = Column(Float, nullable=False, default=0)
-    withdraw_balance = Column(Float, nullable=False, default=0)
     is_privacy = Column(Boolean, default=False)
 
     created_at = Column(
@@ -64,27 +72,47 @@ class User(Base):
     nfts = relationship("NFT", back_populates="owner")
     out_nfts = relationship(
         "NFTHistory",
-        foreign_keys="[NFTHistory.before_user_id]",
+        primaryjoin="User.id == foreign(NFTHistory.before_user_id)",
         back_populates="before_user",
     )
     in_nfts = relationship(
         "NFTHistory",
-        foreign_keys="[NFTHistory.after_user_id]",
+        primaryjoin="User.id == foreign(NFTHistory.after_user_id)",
         back_populates="after_user",
     )
     # relationship with transaction
     transactions = relationship("Transaction", back_populates="user")
 
 
+class UserDirectory(Base):
+    """Every user's id and sign up address, on the home shard only.
+
+    Ids are allocated here and the user row itself lives on
+    src.database.shard_for(id), so a login finds the shard from the address.
+    """
+
+    __tablename__ = "user_directory"
+    __table_args__ = (Index("ix_user_directory_address", "address"),)
+    id = Column(Integer, primary_key=True)
+    address = Column(String(512), nullable=True)
+
+
 class Avatar(Base):
     __tablename__ = "avatar"
     id = Column(Integer, primary_key=True)
     url = Column(String(1024), nullable=False)
-    owner_id = Column(Integer, ForeignKey("user.id"), nullable=True)
+    owner_id = Column(
+        Integer,
+        ForeignKey("user.id", name="fk_avatar_owner_id_user", use_alter=True),
+        nullable=True,
+    )
 
 
 class UserAccessKey(Base):
     __tablename__ = "user_access_key"
+    __table_args__ = (
+        Index("ix_user_access_key_pending_user", "is_pending", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"))
     is_pending = Column(Boolean, nullable=False, default=True)
@@ -110,19 +138,29 @@ class NFTType(str, Enum):
 
 class NFT(Base):
     __tablename__ = "nft"
+    __table_args__ = (
+        Index("ix_nft_user_network_deleted", "user_id", "network", "deleted"),
+        Index("ix_nft_token", "token_address", "token_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"))
     network = Column(SAEnum(Network), nullable=False, default=Network.Ethereum)
     name = Column(String(512))
-    token_address = Column(String(66), nullable=False)
-    token_id = Column(String(66), nullable=True)
+    token_address = Column(ChainAddress, nullable=False)
+    token_id = Column(TokenId, nullable=True)
     image_url = Column(String(1024), default="")
     price = Column(Float, nullable=False, default=0)
     nft_type = Column(SAEnum(NFTType), nullable=False, default=NFTType.ERC721)
+    # copies held, always 1 for ERC721 and Solana NFTs
+    quantity = Column(Integer, nullable=False, default=1)
     deleted = Column(Boolean, nullable=False, default=False)
 
     owner = relationship("User", back_populates="nfts", uselist=False)
-    histories = relationship("NFTHistory", back_populates="nft")
+    histories = relationship(
+        "NFTHistory",
+        primaryjoin="NFT.id == foreign(NFTHistory.nft_id)",
+        back_populates="nft",
+    )
 
 
 class NFTNote(str, Enum):
@@ -132,25 +170,90 @@ class NFTNote(str, Enum):
     Withdraw = "WITHDRAW"
 
 
-class NFTHistory(Base):
-    __tablename__ = "nft_history"
+class NFTHistoryColumns:
     id = Column(Integer, primary_key=True)
-    nft_id = Column(Integer, ForeignKey("nft.id"))
-    before_user_id = Column(Integer, ForeignKey("user.id"), nullable=True)
-    after_user_id = Column(Integer, ForeignKey("user.id"), nullable=True)
+    # no foreign keys: MySQL can't partition a table that has any
+    nft_id = Column(Integer)
+    before_user_id = Column(Integer, nullable=True)
+    after_user_id = Column(Integer, nullable=True)
     price = Column(Float, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=1)
     note = Column(SAEnum(NFTNote), nullable=False)
-    transaction_hash = Column(String(128), nullable=True)
+    transaction_hash = Column(TransactionHash, nullable=True)
+    # copied from the nft when the row is written, so the history endpoints
+    # never join nft. NULL only on rows whose nft was gone at backfill.
+    network = Column(SAEnum(Network), nullable=True)
+    nft_name = Column(String(512))
+    nft_image_url = Column(String(1024), default="")
     created_at = Column(
         TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP")
     )
 
-    nft = relationship("NFT", back_populates="histories", uselist=False)
+
+class NFTHistory(NFTHistoryColumns, Base):
+    """Recent history, partitioned by created_at month.
+
+    The table's primary key is (id, created_at) as partitioning requires, id
+    alone is still unique. Old partitions move to NFTHistoryArchive, see
+    src.utils.history_partitions.
+    """
+
+    __tablename__ = "nft_history"
+    __table_args__ = (
+        Index(
+            "ix_nft_history_network_before_user_created",
+            "network",
+            "before_user_id",
+            "created_at",
+        ),
+        Index(
+            "ix_nft_history_network_after_user_created",
+            "network",
+            "after_user_id",
+            "created_at",
+        ),
+        Index("ix_nft_history_transaction_hash", "transaction_hash"),
+    )
+
+    nft = relationship(
+        "NFT",
+        primaryjoin="NFT.id == foreign(NFTHistory.nft_id)",
+        back_populates="histories",
+        uselist=False,
+    )
     before_user = relationship(
-        "User", foreign_keys=[before_user_id], back_populates="out_nfts", uselist=False
+        "User",
+        primaryjoin="User.id == foreign(NFTHistory.before_user_id)",
+        back_populates="out_nfts",
+        uselist=False,
     )
     after_user = relationship(
-        "User", foreign_keys=[after_user_id], back_populates="in_nfts", uselist=False
+        "User",
+        primaryjoin="User.id == foreign(NFTHistory.after_user_id)",
+        back_populates="in_nfts",
+        uselist=False,
+    )
+
+
+class NFTHistoryArchive(NFTHistoryColumns, Base):
+    """History rows older than cfg.NFT_HISTORY_HOT_MONTHS, same ids."""
+
+    __tablename__ = "nft_history_archive"
+    __table_args__ = (
+        Index(
+            "ix_nft_history_archive_network_before_user_created",
+            "network",
+            "before_user_id",
+            "created_at",
+        ),
+        Index(
+            "ix_nft_history_archive_network_after_user_created",
+            "network",
+            "after_user_id",
+            "created_at",
+        ),
+        Index("ix_nft_history_archive_transaction_hash", "transaction_hash"),
+        {"mysql_row_format": "COMPRESSED"},
     )
 
 
@@ -168,6 +271,12 @@ class Direct(str, Enum):
 
 class Transaction(Base):
     __tablename__ = "transaction"
+    __table_args__ = (
+        Index("ix_transaction_user_created", "user_id", "created_at"),
+        Index("ix_transaction_created", "created_at"),
+        Index("ix_transaction_updated", "updated_at"),
+        UniqueConstraint("transaction_id", name="uq_transaction_transaction_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"))
     transaction_id = Column(String(128), nullable=False)
@@ -179,5 +288,121 @@ class Transaction(Base):
     created_at = Column(
         TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP")
     )
+    # the rollups recount the days of rows changed since their last run
+    updated_at = Column(
+        TIMESTAMP,
+        nullable=True,
+        server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    )
 
     user = relationship("User", back_populates="transactions", uselist=False)
+
+
+class LedgerReason(str, Enum):
+    Deposit = "DEPOSIT"
+    Withdraw = "WITHDRAW"
+    Fee = "FEE"
+
+
+class BalanceEntry(Base):
+    """Append-only balance ledger, refunds are written as opposite entries.
+
+    Amounts are never changed. A withdrawal's debit is written before its
+    transaction or nft_history row exists, and is linked to it afterwards.
+    """
+
+    __tablename__ = "balance_entry"
+    __table_args__ = (
+        Index("ix_balance_entry_user_id", "user_id", "id"),
+        # a transaction is credited or debited once per reason
+        UniqueConstraint(
+            "transaction_id", "reason", name="uq_balance_entry_transaction"
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    # signed, millionths of a USD, see src.utils.balance
+    amount = Column(BigInteger, nullable=False)
+    reason = Column(SAEnum(LedgerReason), nullable=False)
+    transaction_id = Column(Integer, ForeignKey("transaction.id"), nullable=True)
+    # not a foreign key, nft_history is partitioned
+    nft_history_id = Column(Integer, nullable=True)
+    created_at = Column(
+        TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP")
+    )
+
+
+class BalanceSnapshot(Base):
+    """Per user totals of every balance_entry up to entry_id.
+
+    Every user has a row from sign up on, so admin search can filter and
+    sort users by balance on ix_balance_snapshot_balance.
+    """
+
+    __tablename__ = "balance_snapshot"
+    __table_args__ = (Index("ix_balance_snapshot_balance", "balance"),)
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    entry_id = Column(Integer, nullable=False, default=0)
+    balance = Column(BigInteger, nullable=False, default=0)
+    rollback = Column(BigInteger, nullable=False, default=0)
+    deposit_balance = Column(BigInteger, nullable=False, default=0)
+    withdraw_balance = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(
+        TIMESTAMP,
+        nullable=True,
+        server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    )
+
+
+class UserCounter(Base):
+    """Per user row counts kept in step with inserts, see src.utils.counters."""
+
+    __tablename__ = "user_counter"
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    # "transactions", "nft_history:<network>", "nfts:<network>"
+    name = Column(String(32), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class ShardSummary(Base):
+    """Totals over the users of one shard, see src.utils.summaries."""
+
+    __tablename__ = "shard_summary"
+    name = Column(String(64), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class TransactionRollup(Base):
+    """Per day transaction counts and volumes, see src.utils.rollups."""
+
+    __tablename__ = "transaction_rollup"
+    day = Column(Date, primary_key=True)
+    method = Column(SAEnum(DWMethod), primary_key=True)
+    direct = Column(SAEnum(Direct), primary_key=True)
+    status = Column(String(16), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    amount_in = Column(Float, nullable=False, default=0)
+    amount_out = Column(Float, nullable=False, default=0)
+
+
+class RollupWatermark(Base):
+    """How far each rollup has read its source table."""
+
+    __tablename__ = "rollup_watermark"
+    name = Column(String(64), primary_key=True)
+    through = Column(TIMESTAMP, nullable=False)
+
+
+class Outbox(Base):
+    """Celery tasks written with the rows they act on and published by the
+    outbox relay once that transaction has committed, see src.utils.outbox."""
+
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_pending", "published_at", "id"),)
+    id = Column(Integer, primary_key=True)
+    task = Column(String(128), nullable=False)
+    args = Column(JSON, nullable=False)
+    created_at = Column(
+        TIMESTAMP, nullable=False, server_default=text("CURRENT_TIMESTAMP")
+    )
+    published_at = Column(TIMESTAMP, nullable=True)
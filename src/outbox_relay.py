@@ -0,0 +1,50 @@
+"""
+Publishes the outbox to celery, see src.utils.outbox.
+
+    python -m src.outbox_relay
+
+Runs next to the celery workers, one process is enough: a batch holds row
+locks on what it publishes, so a second relay only waits its turn. Each shard
+has an outbox of its own, the relay takes a batch from each in turn over one
+connection per shard, taken from DB_RESERVED_CONNECTIONS.
+"""
+import time
+from datetime import timedelta
+
+from config import cfg
+from src.celery import celery
+from src.database import database, shard_count
+from src.utils import outbox
+from src.utils.pool_metrics import current_holder
+
+PURGE_EVERY_SECONDS = 600
+
+
+def main():
+    current_holder.set("outbox relay")
+    batch = int(cfg.OUTBOX_BATCH)
+    keep = timedelta(hours=int(cfg.OUTBOX_KEEP_HOURS))
+    last_purge = 0.0
+    while True:
+        purge = time.monotonic() - last_purge > PURGE_EVERY_SECONDS
+        busiest = 0
+        for shard in range(shard_count()):
+            session = database.get_db_session(shard)
+            try:
+                busiest = max(busiest, outbox.relay(session, celery, batch))
+                if purge:
+                    outbox.purge(session, keep)
+            except Exception as ex:
+                print("Error relaying outbox of shard {} : ".format(shard), ex)
+                session.rollback()
+            finally:
+                session.close()
+        if purge:
+            last_purge = time.monotonic()
+        # a full batch means there is more waiting
+        if busiest < batch:
+            time.sleep(float(cfg.OUTBOX_POLL_SECONDS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+dispatch_transaction credits a deposit once, and only a finished one,
+against SQLite shards.
+
+    python -m unittest src.test_deposit
+"""
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy.orm import Session
+
+from src import celery as tasks
+from src.database import shard_for
+from src.models import BalanceSnapshot, DWMethod, Transaction, User
+from src.test_sharding import ShardTestCase
+from src.utils.balance import balance_query, to_minor
+
+USER_ID = 1
+
+
+class DispatchTransactionTest(ShardTestCase):
+    def setUp(self):
+        super().setUp()
+        with Session(self.engines[shard_for(USER_ID)]) as session:
+            session.add(User(id=USER_ID, address="user1"))
+            session.add(BalanceSnapshot(user_id=USER_ID, balance=0))
+            # past its one day deadline, the first status read is the last
+            session.add(
+                Transaction(
+                    user_id=USER_ID,
+                    transaction_id="cn1",
+                    method=DWMethod.Eth,
+                    amount_out=25,
+                    created_at=datetime.now().replace(microsecond=0)
+                    - timedelta(days=2),
+                )
+            )
+            session.commit()
+
+    def dispatch(self, status):
+        with mock.patch.object(
+            tasks, "cnio_api", lambda *args, **kwargs: {"status": status}
+        ), mock.patch("time.sleep"):
+            tasks.dispatch_transaction("cn1", USER_ID)
+
+    def balance(self):
+        with self.engines[shard_for(USER_ID)].connect() as connection:
+            return connection.execute(balance_query(USER_ID)).first().balance
+
+    def status(self):
+        with Session(self.engines[shard_for(USER_ID)]) as session:
+            return session.query(Transaction.status).one().status
+
+    def test_finished_deposit_is_credited_once(self):
+        self.dispatch("finished")
+        # the outbox delivered it again
+        self.dispatch("finished")
+        self.assertEqual(self.balance(), to_minor(25))
+
+    def test_unfinished_deposit_is_not_credited(self):
+        for status in ("failed", "refunded", "expired", "waiting"):
+            self.dispatch(status)
+            self.assertEqual(self.status(), status)
+            self.assertEqual(self.balance(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+Shard routing and scripts/reshard.py, against three SQLite files.
+
+    python -m unittest src.test_sharding
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, func, pool, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+from starlette.requests import Request
+
+from config import cfg
+from scripts import reshard
+from src import database as db
+from src.database import (
+    SHARD_BUCKETS,
+    SHARD_ID_STRIDE,
+    Base,
+    ShardSessions,
+    parse_shard_map,
+    shard_for,
+)
+from src.dependencies.database_deps import request_shard
+from src.models import (
+    NFT,
+    DWMethod,
+    NFTHistory,
+    NFTNote,
+    Network,
+    Transaction,
+    User,
+    UserCounter,
+)
+from src.utils.auth import create_access_token
+
+SHARDS = 3
+
+
+@compiles(CreateColumn, "sqlite")
+def _sqlite_column(element, compiler, **kw):
+    # SQLite has no ON UPDATE clause
+    return compiler.visit_create_column(element, **kw).replace(
+        " ON UPDATE CURRENT_TIMESTAMP", ""
+    )
+
+
+class ShardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.urls = [
+            "sqlite:///" + os.path.join(self.dir, "shard{}.db".format(shard))
+            for shard in range(SHARDS)
+        ]
+        for patch in (
+            mock.patch.object(db, "shard_urls", lambda: self.urls),
+            mock.patch.object(cfg, "DB_SHARD_MAP", ""),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.engines = [
+            create_engine(url, poolclass=pool.NullPool) for url in self.urls
+        ]
+        for engine in self.engines:
+            Base.metadata.create_all(engine)
+
+    def tearDown(self):
+        for engine in db._engines.values():
+            getattr(engine, "sync_engine", engine).dispose()
+        db._engines.clear()
+        db._sessionmakers.clear()
+        shutil.rmtree(self.dir)
+
+    def user_ids_on(self, shard):
+        with self.engines[shard].connect() as connection:
+            return set(connection.scalars(select(User.id)))
+
+
+class ShardMapTest(ShardTestCase):
+    def test_empty_map_splits_buckets_evenly(self):
+        buckets = parse_shard_map("", SHARDS)
+        self.assertEqual(len(buckets), SHARD_BUCKETS)
+        self.assertEqual(buckets, sorted(buckets))
+        for shard in range(SHARDS):
+            self.assertAlmostEqual(
+                buckets.count(shard), SHARD_BUCKETS / SHARDS, delta=1
+            )
+
+    def test_explicit_map(self):
+        buckets = parse_shard_map("0-99:2,100-1022:0,1023:1", SHARDS)
+        self.assertEqual(buckets[:100], [2] * 100)
+        self.assertEqual(buckets[100:1023], [0] * 923)
+        self.assertEqual(buckets[1023], 1)
+
+    def test_incomplete_or_out_of_range_map(self):
+        with self.assertRaises(ValueError):
+            parse_shard_map("0-511:0", SHARDS)
+        with self.assertRaises(ValueError):
+            parse_shard_map("0-1023:3", SHARDS)
+
+    def test_interleaved_ids_spread_over_shards(self):
+        # the home shard hands out ids 1, 65, 129, ... once there are shards
+        user_ids = range(1, 3000 * SHARD_ID_STRIDE, SHARD_ID_STRIDE)
+        counts = [0] * SHARDS
+        for user_id in user_ids:
+            counts[shard_for(user_id)] += 1
+        for count in counts:
+            self.assertGreater(count, len(user_ids) / SHARDS * 0.8)
+
+
+class RoutingTest(ShardTestCase):
+    def test_sessions_write_to_the_users_shard(self):
+        for user_id in range(1, 50):
+            session = db.database.get_db_session(shard_for(user_id))
+            self.assertEqual(session.info["shard"], shard_for(user_id))
+            session.add(User(id=user_id, address="user{}".format(user_id)))
+            session.commit()
+            session.close()
+
+        for shard in range(SHARDS):
+            self.assertEqual(
+                self.user_ids_on(shard),
+                {user_id for user_id in range(1, 50) if shard_for(user_id) == shard},
+            )
+
+    def test_request_shard_follows_the_token(self):
+        def request(authorization):
+            headers = (
+                [(b"authorization", authorization.encode())] if authorization else []
+            )
+            return Request({"type": "http", "headers": headers})
+
+        for user_id in range(1, 20):
+            token = create_access_token(user_id)
+            self.assertEqual(
+                request_shard(request("Bearer " + token)), shard_for(user_id)
+            )
+        self.assertEqual(request_shard(request(None)), 0)
+        self.assertEqual(request_shard(request("Bearer not-a-token")), 0)
+
+    def test_shard_sessions(self):
+        async def run():
+            shards = ShardSessions(db.database.get_async_db_session)
+            try:
+                for user_id in range(1, 30):
+                    shards.for_user(user_id).add(User(id=user_id))
+                await shards.commit()
+                self.assertEqual(
+                    [session.info["shard"] for session in shards.opened()],
+                    list(range(SHARDS)),
+                )
+                return await shards.scalars_everywhere(select(User.id))
+            finally:
+                await shards.close()
+
+        self.assertEqual(sorted(asyncio.run(run())), list(range(1, 30)))
+        for shard in range(SHARDS):
+            self.assertTrue(
+                all(shard_for(user_id) == shard for user_id in self.user_ids_on(shard))
+            )
+
+
+class ReshardTest(ShardTestCase):
+    OLD = "0-1023:0"
+
+    def seed(self):
+        with Session(self.engines[0]) as session:
+            for user_id in range(1, 41):
+                session.add(User(id=user_id, address="user{}".format(user_id)))
+                session.add(
+                    NFT(
+                        id=user_id,
+                        user_id=user_id,
+                        token_address="0x" + "ab" * 20,
+                        token_id=str(user_id),
+                    )
+                )
+                session.add(
+                    NFTHistory(
+                        nft_id=user_id,
+                        after_user_id=user_id,
+                        note=NFTNote.Deposit,
+                        network=Network.Ethereum,
+                    )
+                )
+                session.add(
+                    Transaction(
+                        user_id=user_id,
+                        transaction_id="tx{}".format(user_id),
+                        method=DWMethod.Eth,
+                    )
+                )
+                session.add(UserCounter(user_id=user_id, name="transactions", value=1))
+            session.commit()
+
+    def rows_on(self, shard, user_id):
+        with self.engines[shard].connect() as connection:
+            return {
+                table.name: connection.scalar(
+                    select(func.count())
+                    .select_from(table)
+                    .where(reshard.owner(table) == user_id)
+                )
+                for table in reshard._tables()
+            }
+
+    def test_move_to_an_even_split(self):
+        self.seed()
+        old, new = parse_shard_map(self.OLD, SHARDS), parse_shard_map("", SHARDS)
+        planned = reshard.plan(self.engines, old, new)
+        self.assertEqual(set(planned), {(0, 1), (0, 2)})
+        moving = sum(users for _, users in planned.values())
+        self.assertEqual(moving, sum(1 for u in range(1, 41) if shard_for(u) != 0))
+
+        reshard.prepare(self.engines, old, new)
+        copied = reshard.copy(self.engines, old, new, batch=7)
+        # a rerun replaces the rows instead of adding to them
+        self.assertEqual(reshard.copy(self.engines, old, new, batch=7), copied)
+        self.assertEqual(reshard.verify(self.engines, old, new, batch=7), [])
+        reshard.cleanup(self.engines, old, new, batch=7)
+
+        for user_id in range(1, 41):
+            for shard in range(SHARDS):
+                counts = self.rows_on(shard, user_id)
+                expected = 1 if shard == shard_for(user_id) else 0
+                self.assertEqual(counts["user"], expected)
+                self.assertEqual(counts["nft"], expected)
+                self.assertEqual(counts["nft_history"], expected)
+                self.assertEqual(counts["transaction"], expected)
+                self.assertEqual(counts["user_counter"], expected)
+
+    def test_verify_reports_missing_rows(self):
+        self.seed()
+        old, new = parse_shard_map(self.OLD, SHARDS), parse_shard_map("", SHARDS)
+        self.assertNotEqual(reshard.verify(self.engines, old, new, batch=100), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
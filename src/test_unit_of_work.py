@@ -0,0 +1,129 @@
+"""
+UnitOfWorkRoute's commit and deadlock retry, against SQLite shards.
+
+    python -m unittest src.test_unit_of_work
+"""
+import unittest
+from unittest import mock
+
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from src.database import database
+from src.dependencies.database_deps import (
+    ER_LOCK_DEADLOCK,
+    UnitOfWorkRoute,
+    get_async_db_read_session,
+    get_async_db_write_session,
+)
+from src.models import DWMethod, Transaction, User
+from src.test_sharding import ShardTestCase
+from src.utils import recent_writes
+from src.utils.auth import create_access_token
+
+
+class FakeRedis:
+    def __init__(self):
+        self.keys = {}
+
+    async def set(self, key, value, ex=None):
+        self.keys[key] = ex
+
+    async def exists(self, key):
+        return int(key in self.keys)
+
+
+class UnitOfWorkTest(ShardTestCase):
+    def setUp(self):
+        super().setUp()
+        with Session(self.engines[0]) as session:
+            session.add(User(id=1, address="user1"))
+            session.commit()
+
+        self.attempts = 0
+        router = APIRouter(route_class=UnitOfWorkRoute)
+
+        @router.post("/transaction")
+        async def add_transaction(session=Depends(get_async_db_write_session)):
+            self.attempts += 1
+            session.add(
+                Transaction(
+                    user_id=1,
+                    transaction_id="t{}".format(self.attempts),
+                    method=DWMethod.Eth,
+                )
+            )
+            await session.flush()
+            if self.attempts == 1:
+                raise OperationalError(
+                    "INSERT", {}, Exception(ER_LOCK_DEADLOCK, "Deadlock found")
+                )
+            return self.attempts
+
+        @router.post("/user")
+        async def add_user(session=Depends(get_async_db_write_session)):
+            # the same id again, it only fails when flushed by the commit
+            session.add(User(id=1, address="again"))
+            return True
+
+        @router.get("/replica")
+        async def on_replica(session=Depends(get_async_db_read_session)):
+            return session.info.get("replica", False)
+
+        app = FastAPI()
+        app.include_router(router)
+        self.client = TestClient(app, raise_server_exceptions=False)
+
+    def transaction_ids(self):
+        with self.engines[0].connect() as connection:
+            return list(connection.scalars(select(Transaction.transaction_id)))
+
+    def test_deadlock_is_retried_without_the_first_attempt(self):
+        response = self.client.post("/transaction")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), 2)
+        self.assertEqual(self.transaction_ids(), ["t2"])
+
+    def test_a_users_reads_follow_their_writes_to_the_primary(self):
+        redis = FakeRedis()
+        read_session = database.get_async_db_read_session
+
+        def replica_session(shard=0):
+            session = read_session(shard)
+            session.info["replica"] = True
+            return session
+
+        for patch in (
+            mock.patch.object(recent_writes.cfg, "DB_REPLICA_HOST", "replica"),
+            mock.patch.object(recent_writes, "_redis", lambda: redis),
+            mock.patch.object(database, "get_async_db_read_session", replica_session),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        # bearer clients only, no cookie carries the window
+        user = {"Authorization": "Bearer " + create_access_token(1)}
+        other = {"Authorization": "Bearer " + create_access_token(2)}
+        self.assertIs(self.client.get("/replica", headers=user).json(), True)
+        self.assertEqual(
+            self.client.post("/transaction", headers=user).status_code, 200
+        )
+        self.assertEqual(
+            redis.keys, {"db-written:1": recent_writes.cfg.DB_READ_YOUR_WRITES_SECONDS}
+        )
+        self.client.cookies.clear()
+        self.assertIs(self.client.get("/replica", headers=user).json(), False)
+        self.assertIs(self.client.get("/replica", headers=other).json(), True)
+
+    def test_failed_commit_is_an_error_response(self):
+        response = self.client.post("/user")
+        self.assertEqual(response.status_code, 500)
+        with self.engines[0].connect() as connection:
+            self.assertEqual(list(connection.scalars(select(User.address))), ["user1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
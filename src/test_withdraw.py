@@ -0,0 +1,181 @@
+"""
+Withdrawals give the debit back when the exchange or the chain fails, and an
+NFT leaves once, against SQLite shards.
+
+    python -m unittest src.test_withdraw
+"""
+import asyncio
+import itertools
+import time
+import unittest
+from unittest import mock
+
+import httpx
+from base58 import b58encode
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.api import user as user_api
+from src.changenow_api.exceptions import ChangeNowApiError
+from src.database import shard_for
+from src.models import NFT, BalanceSnapshot, Network, User
+from src.test_sharding import ShardTestCase
+from src.utils.auth import create_access_token
+from src.utils import web3 as web3_utils
+from src.utils.balance import balance_query, to_minor
+
+USER_ID = 1
+MINT = "4kb8kG8NjqCjgim7DpGC3YWDPY4B5Y4fbFKNeibcPCpo"
+SIGNATURE = b58encode(bytes(range(64))).decode()
+
+
+class WithdrawTest(ShardTestCase):
+    def setUp(self):
+        super().setUp()
+        with Session(self.engines[shard_for(USER_ID)]) as session:
+            session.add(User(id=USER_ID, address="user1"))
+            session.add(BalanceSnapshot(user_id=USER_ID, balance=to_minor(100)))
+            session.add(
+                NFT(id=1, user_id=USER_ID, network=Network.Solana, token_address=MINT)
+            )
+            session.commit()
+
+        async def price(coin):
+            return 2000.0
+
+        async def create_tx(*args, **kwargs):
+            raise ChangeNowApiError("Bad Request", 400, b"")
+
+        for patch in (
+            mock.patch.object(user_api, "get_current_gas_price", lambda: 10**9),
+            mock.patch.object(user_api.price_oracle, "get", price),
+            mock.patch.object(user_api, "cnio_api", create_tx),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.app = FastAPI()
+        user_api.UserAPI(error=None).Bootstrap(self.app)
+        # the token also routes the request to the user's shard
+        self.headers = {"Authorization": "Bearer " + create_access_token(USER_ID)}
+        self.client = TestClient(
+            self.app, headers=self.headers, raise_server_exceptions=False
+        )
+
+    def balance(self):
+        with self.engines[shard_for(USER_ID)].connect() as connection:
+            return connection.execute(balance_query(USER_ID)).first().balance
+
+    def nft_deleted(self):
+        with self.engines[shard_for(USER_ID)].connect() as connection:
+            return connection.scalar(select(NFT.deleted).where(NFT.id == 1))
+
+    def withdraw_nft_sol(self):
+        return self.client.post(
+            "/user/withdraw/nft/sol", params={"id": 1, "address": MINT}
+        )
+
+    def test_failed_exchange_gives_the_debit_back(self):
+        before = self.balance()
+        for path, address in (
+            ("/user/withdraw/eth", "0x" + "ab" * 20),
+            ("/user/withdraw/sol", "4kb8kG8NjqCjgim7DpGC3YWDPY4B5Y4fbFKNeibcPCpo"),
+        ):
+            response = self.client.post(path, params={"amount": 10, "address": address})
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(self.balance(), before)
+
+    def test_failed_nft_transfer_gives_fee_and_nft_back(self):
+        async def transfer(token_address, address):
+            raise RuntimeError("rpc down")
+
+        before = self.balance()
+        with mock.patch.object(user_api, "transfer_solana_nft", transfer):
+            self.assertEqual(self.withdraw_nft_sol().status_code, 500)
+        self.assertEqual(self.balance(), before)
+        self.assertFalse(self.nft_deleted())
+
+    def test_nft_is_reserved_before_the_transfer(self):
+        transfers, concurrent = [], []
+
+        async def transfer(token_address, address):
+            transfers.append(token_address)
+            if len(transfers) == 1:
+                # a second withdrawal of the same NFT while this one sends it
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=self.app),
+                    base_url="http://testserver",
+                    headers=self.headers,
+                ) as client:
+                    response = await client.post(
+                        "/user/withdraw/nft/sol", params={"id": 1, "address": MINT}
+                    )
+                    concurrent.append(response.status_code)
+            return SIGNATURE
+
+        before = self.balance()
+        with mock.patch.object(user_api, "transfer_solana_nft", transfer):
+            self.assertEqual(self.withdraw_nft_sol().status_code, 200)
+        self.assertEqual(concurrent, [404])
+        self.assertEqual(len(transfers), 1)
+        self.assertTrue(self.nft_deleted())
+        # one fee, the refused withdrawal rolled its own back
+        fee = to_minor(float(user_api.cfg.ETH_MAX_FEE) / 10**9 * 2000.0)
+        self.assertEqual(self.balance(), before - fee)
+
+    def test_concurrent_withdrawals_get_their_own_nonce(self):
+        ids = itertools.count(1)
+        nonces = []
+
+        async def create_tx(*args, **kwargs):
+            return {
+                "id": "cn{}".format(next(ids)),
+                "payinAddress": "0x" + "cd" * 20,
+                "amount": 0.005,
+            }
+
+        def send_transaction(transaction):
+            nonces.append(transaction["nonce"])
+            # both sends in flight at once, none of them counted by the node
+            time.sleep(0.1)
+            return b"hash"
+
+        eth = mock.MagicMock()
+        eth.default_account = "0x" + "ef" * 20
+        eth.getTransactionCount.return_value = 7
+        eth.send_transaction.side_effect = send_transaction
+        contract = eth.contract.return_value
+        contract.functions.decimals.return_value.call.return_value = 6
+        contract.functions.transfer.return_value.buildTransaction.side_effect = (
+            lambda transaction: transaction
+        )
+
+        async def withdraw_twice():
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=self.app),
+                base_url="http://testserver",
+                headers=self.headers,
+            ) as client:
+                return await asyncio.gather(
+                    *[
+                        client.post(
+                            "/user/withdraw/eth",
+                            params={"amount": 10, "address": "0x" + "ab" * 20},
+                        )
+                        for _ in range(2)
+                    ]
+                )
+
+        with mock.patch.object(user_api, "cnio_api", create_tx), mock.patch.object(
+            web3_utils, "web3_eth", mock.MagicMock(eth=eth)
+        ), mock.patch.object(web3_utils, "_next_nonce", None):
+            responses = asyncio.run(withdraw_twice())
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(sorted(nonces), [7, 8])
+        eth.getTransactionCount.assert_called_with(eth.default_account, "pending")
+
+
+if __name__ == "__main__":
+    unittest.main()
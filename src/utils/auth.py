@@ -1,4 +1,5 @@
 from passlib.context import CryptContext
+import hmac
 import os
 from datetime import datetime, timedelta
 from typing import Union, Any
@@ -84,3 +85,7 @@ def validate_phantom_wallet(address: str, signature: str) -> bool:
     except Exception as ex:
         print(ex)
         return False
+
+
+def is_debug_key(key: str) -> bool:
+    return bool(cfg.DEBUG_API_KEY) and hmac.compare_digest(key, cfg.DEBUG_API_KEY)
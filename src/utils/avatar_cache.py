@@ -0,0 +1,155 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from redis import asyncio as aioredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import cfg
+from src.models import Avatar
+
+CHANNEL = "avatar-cache:invalidate"
+
+
+def _row(avatar: Avatar) -> dict:
+    return {"id": avatar.id, "url": avatar.url, "owner_id": avatar.owner_id}
+
+
+class AvatarCache:
+    """Avatars held per worker, so reading them costs no query.
+
+    The public avatars (no owner_id) are one copy per shard,
+    session.info["shard"], every shard holds the same ones. They only change
+    with migrations, AVATAR_CACHE_SECONDS bounds how long a change takes to
+    show.
+
+    A user's own avatars are cached per user, loaded on the owner_id index,
+    for the AVATAR_CACHE_MAX_USERS users asked for last. A route inserting
+    one calls forget_after_commit(), and every worker's listen() task drops
+    that user's list once the insert is committed. The TTL only covers a
+    missed message.
+    """
+
+    def __init__(self):
+        self._data: dict = {}
+        self._loaded_at: dict = {}
+        self._owned: Dict[int, tuple] = {}
+        # moves on every drop of owned avatars, see _get_owned()
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self._client: Optional[aioredis.Redis] = None
+
+    def redis(self) -> aioredis.Redis:
+        """The worker's client for the invalidation channel, Init opens it on
+        startup and closes it on shutdown."""
+        if self._client is None:
+            self._client = aioredis.from_url(cfg.REDIS_URL)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, session: AsyncSession) -> dict:
+        ttl = int(cfg.AVATAR_CACHE_SECONDS)
+        shard = session.info.get("shard", 0)
+        if shard in self._data and time.monotonic() - self._loaded_at[shard] < ttl:
+            return self._data[shard]
+
+        async with self._lock:
+            if (
+                shard not in self._data
+                or time.monotonic() - self._loaded_at[shard] >= ttl
+            ):
+                data = {"public": [], "by_url": {}}
+                for avatar in await session.scalars(
+                    select(Avatar).where(Avatar.owner_id == None).order_by(Avatar.id)
+                ):
+                    data["public"].append(_row(avatar))
+                    data["by_url"].setdefault(avatar.url, avatar.id)
+                self._data[shard] = data
+                self._loaded_at[shard] = time.monotonic()
+            return self._data[shard]
+
+    async def _get_owned(self, session: AsyncSession, user_id: int) -> List[dict]:
+        cached = self._owned.pop(user_id, None)
+        if cached is None or time.monotonic() - cached[0] >= int(
+            cfg.AVATAR_CACHE_SECONDS
+        ):
+            version = self._version
+            owned = await session.scalars(
+                select(Avatar).where(Avatar.owner_id == user_id).order_by(Avatar.id)
+            )
+            cached = (time.monotonic(), [_row(avatar) for avatar in owned])
+            if version != self._version:
+                # dropped while we read, what we read may predate the insert
+                return cached[1]
+        # reinserted last, the first entries are the users asked for longest ago
+        self._owned[user_id] = cached
+        while len(self._owned) > int(cfg.AVATAR_CACHE_MAX_USERS):
+            del self._owned[next(iter(self._owned))]
+        return cached[1]
+
+    async def avatars_for(self, session: AsyncSession, user_id: int) -> list:
+        """Public avatars followed by the ones user_id uploaded."""
+        data = await self._get(session)
+        return data["public"] + await self._get_owned(session, user_id)
+
+    async def id_by_url(
+        self, session: AsyncSession, user_id: int, url: str
+    ) -> Optional[int]:
+        """Id of the public avatar at url, else of user_id's own."""
+        avatar_id = (await self._get(session))["by_url"].get(url)
+        if avatar_id is None:
+            for avatar in await self._get_owned(session, user_id):
+                if avatar["url"] == url:
+                    return avatar["id"]
+        return avatar_id
+
+    def invalidate(self):
+        self._data = {}
+        self._forget_owned(None)
+
+    def _forget_owned(self, user_id: Optional[int]):
+        """Drops user_id's own avatars, every user's with None."""
+        self._version += 1
+        if user_id is None:
+            self._owned = {}
+        else:
+            self._owned.pop(user_id, None)
+
+    def forget_after_commit(self, session: AsyncSession, user_id: int):
+        """Drops user_id's own avatars in every worker once the write session
+        has committed, see get_async_db_write_session."""
+
+        async def callback():
+            self._forget_owned(user_id)
+            try:
+                await self.redis().publish(CHANNEL, str(user_id))
+            except Exception as ex:
+                print("Error publishing avatar cache invalidation : ", ex)
+
+        session.info.setdefault("after_commit", []).append(callback)
+
+    async def listen(self):
+        """Runs for the life of the worker, see UserAPI.Bootstrap."""
+        while True:
+            try:
+                async with self.redis().pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    # anything published while we weren't subscribed is lost
+                    self.invalidate()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._forget_owned(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                print("Avatar cache listener lost redis, retrying : ", ex)
+                self.invalidate()
+                await asyncio.sleep(5)
+
+
+avatar_cache = AvatarCache()
@@ -0,0 +1,240 @@
+from decimal import ROUND_HALF_UP, Decimal
+from typing import List, Optional
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from src.models import BalanceEntry, BalanceSnapshot, LedgerReason, User
+from src.utils import summaries
+
+# user balances are stored in millionths of a USD, the precision of USDT
+MINOR_UNITS = 10**6
+
+
+def to_minor(amount: float) -> int:
+    units = Decimal(str(amount)) * MINOR_UNITS
+    return int(units.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(units: int) -> float:
+    return float(Decimal(units) / MINOR_UNITS)
+
+
+def entry(
+    user_id: int,
+    amount: int,
+    reason: LedgerReason,
+    transaction_id: Optional[int] = None,
+    nft_history_id: Optional[int] = None,
+) -> BalanceEntry:
+    return BalanceEntry(
+        user_id=user_id,
+        amount=amount,
+        reason=reason,
+        transaction_id=transaction_id,
+        nft_history_id=nft_history_id,
+    )
+
+
+def reversal(entries: List[BalanceEntry]) -> List[BalanceEntry]:
+    """Entries cancelling out the given ones, the ledger is never edited."""
+    return [
+        entry(e.user_id, -e.amount, e.reason, e.transaction_id, e.nft_history_id)
+        for e in entries
+    ]
+
+
+def credited(session: Session, transaction_id: int) -> bool:
+    """Whether the deposit of transaction_id is in the ledger already.
+
+    A plain read, it can miss a credit committed after the transaction's
+    first read. uq_balance_entry_transaction is what keeps a deposit from
+    being credited twice, this only saves a redelivered task its polling.
+    """
+    return (
+        session.scalar(
+            select(BalanceEntry.id)
+            .where(
+                and_(
+                    BalanceEntry.transaction_id == transaction_id,
+                    BalanceEntry.reason == LedgerReason.Deposit,
+                )
+            )
+            .limit(1)
+        )
+        is not None
+    )
+
+
+def _sum_for(reason: LedgerReason, sign: int = 1):
+    return func.coalesce(
+        func.sum(
+            case((BalanceEntry.reason == reason, sign * BalanceEntry.amount), else_=0)
+        ),
+        0,
+    )
+
+
+def balance_query(user_id: int) -> Select:
+    """The user's balances: latest snapshot plus the entries written after it.
+
+    The entries are bounded by the snapshot interval, so this stays a point
+    lookup plus a short range on ix_balance_entry_user_id.
+    """
+    entry_id = func.coalesce(BalanceSnapshot.entry_id, 0)
+    return (
+        select(
+            (
+                func.coalesce(BalanceSnapshot.balance, 0)
+                + func.coalesce(func.sum(BalanceEntry.amount), 0)
+            ).label("balance"),
+            (
+                func.coalesce(BalanceSnapshot.deposit_balance, 0)
+                + _sum_for(LedgerReason.Deposit)
+            ).label("deposit_balance"),
+            (
+                func.coalesce(BalanceSnapshot.withdraw_balance, 0)
+                + _sum_for(LedgerReason.Withdraw, -1)
+            ).label("withdraw_balance"),
+            func.coalesce(BalanceSnapshot.rollback, 0).label("rollback"),
+        )
+        .select_from(User)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == User.id)
+        .outerjoin(
+            BalanceEntry,
+            and_(BalanceEntry.user_id == User.id, BalanceEntry.id > entry_id),
+        )
+        .where(User.id == user_id)
+        .group_by(
+            User.id,
+            BalanceSnapshot.balance,
+            BalanceSnapshot.deposit_balance,
+            BalanceSnapshot.withdraw_balance,
+            BalanceSnapshot.rollback,
+        )
+    )
+
+
+async def get_balance(
+    session: AsyncSession, user_id: int, locking: bool = False
+) -> Optional[int]:
+    """locking reads the latest committed snapshot and entries and holds a
+    shared lock on them, instead of the transaction's consistent snapshot."""
+    query = balance_query(user_id)
+    if locking:
+        query = query.with_for_update(read=True)
+    row = (await session.execute(query)).first()
+    return None if row is None else row.balance
+
+
+def ledger_lock(user_id: int) -> Select:
+    """Shared lock on the user row, taken before appending entries that need
+    no balance check. It keeps take_snapshots from folding the user until
+    they commit."""
+    return select(User.id).where(User.id == user_id).with_for_update(read=True)
+
+
+async def append(session: AsyncSession, entries: List[BalanceEntry]) -> None:
+    """Appends entries under ledger_lock, refunds. The caller commits."""
+    await session.execute(ledger_lock(entries[0].user_id))
+    session.add_all(entries)
+
+
+async def debit(session: AsyncSession, entries: List[BalanceEntry]) -> bool:
+    """Appends the negative entries if the user's balance covers all of them.
+
+    Debits take the user row lock exclusively, so a user's withdrawals are
+    serialized against each other while deposits only share it, see
+    ledger_lock. The caller commits.
+
+    Under REPEATABLE READ a plain SELECT after the lock would still read the
+    snapshot fixed by the transaction's first read, which can predate a debit
+    committed while this one waited for the lock, so the balance is read with
+    a locking read. Deposits for the user wait on it until the commit.
+    """
+    user_id = entries[0].user_id
+    locked = await session.scalar(
+        select(User.id).where(User.id == user_id).with_for_update()
+    )
+    if locked is None:
+        return False
+
+    balance = await get_balance(session, user_id, locking=True)
+    if balance < -sum(e.amount for e in entries):
+        return False
+
+    session.add_all(entries)
+    await session.flush()
+    return True
+
+
+def take_snapshots(session: Session) -> int:
+    """Folds every user's new entries into balance_snapshot.
+
+    Entry ids are allocated on insert, not on commit, so the highest id seen
+    doesn't mean every entry below it is committed. Writers hold a lock on
+    the user row until they commit, the shared ledger_lock or debit's
+    exclusive one, and a user is folded under the exclusive lock: the fold
+    waits for the user's open writers, and entries written after it get ids
+    above the new entry_id. Each user is folded and committed on its own so
+    writers wait for one fold at most. The shard's balance totals move with
+    the snapshots. Returns the number of users folded.
+    """
+    user_ids = session.scalars(
+        select(BalanceEntry.user_id)
+        .distinct()
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == BalanceEntry.user_id)
+        .where(BalanceEntry.id > func.coalesce(BalanceSnapshot.entry_id, 0))
+    ).all()
+    session.commit()
+
+    folded = 0
+    for user_id in user_ids:
+        session.execute(select(User.id).where(User.id == user_id).with_for_update())
+        snapshot = session.scalar(
+            select(BalanceSnapshot)
+            .where(BalanceSnapshot.user_id == user_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        # locking reads, they see whatever committed while the lock was awaited
+        row = session.execute(
+            select(
+                func.max(BalanceEntry.id).label("entry_id"),
+                func.sum(BalanceEntry.amount).label("balance"),
+                _sum_for(LedgerReason.Deposit).label("deposit_balance"),
+                _sum_for(LedgerReason.Withdraw, -1).label("withdraw_balance"),
+            )
+            .where(
+                and_(
+                    BalanceEntry.user_id == user_id,
+                    BalanceEntry.id > (0 if snapshot is None else snapshot.entry_id),
+                )
+            )
+            .with_for_update(read=True)
+        ).one()
+        if row.entry_id is None:
+            session.commit()
+            continue
+
+        if snapshot is None:
+            snapshot = BalanceSnapshot(
+                user_id=user_id, balance=0, deposit_balance=0, withdraw_balance=0
+            )
+            session.add(snapshot)
+        snapshot.entry_id = row.entry_id
+        snapshot.balance += int(row.balance)
+        snapshot.deposit_balance += int(row.deposit_balance)
+        snapshot.withdraw_balance += int(row.withdraw_balance)
+        for name, value in (
+            (summaries.BALANCE, row.balance),
+            (summaries.DEPOSIT_BALANCE, row.deposit_balance),
+            (summaries.WITHDRAW_BALANCE, row.withdraw_balance),
+        ):
+            if value:
+                session.execute(summaries.increment(name, int(value)))
+        session.commit()
+        folded += 1
+    return folded
@@ -0,0 +1,103 @@
+"""
+Chain identifiers stored as raw bytes instead of their text encodings.
+
+Values are normalized when they are bound, so "0xAbC..." and "0xabc..."
+are the same key and lookups compare bytes. Reads give back canonical text:
+lowercase 0x hex on Ethereum, base58 on Solana.
+"""
+from typing import Optional, Union
+
+from base58 import b58decode, b58encode
+from sqlalchemy.types import BINARY, VARBINARY, TypeDecorator
+
+EVM_ADDRESS_BYTES = 20
+SOLANA_KEY_BYTES = 32
+EVM_HASH_BYTES = 32
+SOLANA_SIGNATURE_BYTES = 64
+TOKEN_ID_BYTES = 32
+
+
+def _decode(value: Union[str, bytes], hex_size: int, base58_size: int) -> bytes:
+    """value as bytes, from 0x hex (prefix optional at hex_size) or base58."""
+    if isinstance(value, (bytes, bytearray)):
+        raw = bytes(value)
+    else:
+        text = value.strip()
+        prefixed = text[:2].lower() == "0x"
+        digits = text[2:] if prefixed else text
+        if prefixed or _is_hex(digits, hex_size):
+            raw = bytes.fromhex(digits)
+        else:
+            raw = b58decode(text)
+    if len(raw) not in (hex_size, base58_size):
+        raise ValueError(
+            "Not a {} or {} byte key: {!r}".format(hex_size, base58_size, value)
+        )
+    return raw
+
+
+def _is_hex(digits: str, size: int) -> bool:
+    if len(digits) != size * 2:
+        return False
+    try:
+        bytes.fromhex(digits)
+        return True
+    except ValueError:
+        return False
+
+
+def _encode(raw: bytes, hex_size: int) -> str:
+    if len(raw) == hex_size:
+        return "0x" + raw.hex()
+    return b58encode(raw).decode()
+
+
+class ChainAddress(TypeDecorator):
+    """An EVM address (20 bytes) or a Solana public key (32 bytes)."""
+
+    impl = VARBINARY(SOLANA_KEY_BYTES)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return _decode(value, EVM_ADDRESS_BYTES, SOLANA_KEY_BYTES)
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        if value is None:
+            return None
+        return _encode(value, EVM_ADDRESS_BYTES)
+
+
+class TransactionHash(TypeDecorator):
+    """An EVM transaction hash (32 bytes) or a Solana signature (64 bytes)."""
+
+    impl = VARBINARY(SOLANA_SIGNATURE_BYTES)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return _decode(value, EVM_HASH_BYTES, SOLANA_SIGNATURE_BYTES)
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        if value is None:
+            return None
+        return _encode(value, EVM_HASH_BYTES)
+
+
+class TokenId(TypeDecorator):
+    """A uint256 token id as 32 big-endian bytes, read back as a decimal string."""
+
+    impl = BINARY(TOKEN_ID_BYTES)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return int(value).to_bytes(TOKEN_ID_BYTES, "big")
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        if value is None:
+            return None
+        return str(int.from_bytes(value, "big"))
@@ -0,0 +1,160 @@
+"""
+Per-user row counts, kept in user_counter so paginated endpoints don't
+COUNT(*) for their total.
+
+Counters move in the same transaction as the rows they count. Anything that
+slips past that (manual edits, a crash between two commits) is put right by
+repair(), run daily by the repair_user_counters celery task.
+"""
+from typing import Dict, Tuple
+
+from sqlalchemy import and_, func, insert, or_, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from src.models import NFT, Network, NFTHistory, Transaction, User, UserCounter
+
+TRANSACTIONS = "transactions"
+REPAIR_BATCH = 1000
+
+
+def nft_history(network: Network) -> str:
+    """Rows of nft_history involving the user, archived rows not included."""
+    return "nft_history:" + network.name.lower()
+
+
+def nfts(network: Network) -> str:
+    """Undeleted nft rows (holdings) of the user."""
+    return "nfts:" + network.name.lower()
+
+
+def _increment(user_id: int, name: str, by: int):
+    return (
+        update(UserCounter)
+        .where(and_(UserCounter.user_id == user_id, UserCounter.name == name))
+        .values(value=UserCounter.value + by)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bump(session: AsyncSession, user_id: int, name: str, by: int = 1):
+    if (await session.execute(_increment(user_id, name, by))).rowcount:
+        return
+    try:
+        async with session.begin_nested():
+            session.add(UserCounter(user_id=user_id, name=name, value=by))
+    except IntegrityError:
+        # created by a concurrent request since our update
+        await session.execute(_increment(user_id, name, by))
+
+
+async def bump_history(session: AsyncSession, history: NFTHistory):
+    """Counts a new nft_history row once for each user it involves."""
+    for user_id in {history.before_user_id, history.after_user_id} - {None}:
+        await bump(session, int(user_id), nft_history(history.network))
+
+
+async def get(session: AsyncSession, user_id: int, name: str) -> int:
+    value = await session.scalar(
+        select(UserCounter.value).where(
+            and_(UserCounter.user_id == user_id, UserCounter.name == name)
+        )
+    )
+    return value or 0
+
+
+def history_counts(history, users) -> Select:
+    """(user_id, network, value) rows counting each row of history once per
+    user it involves, for the users matching the users(column) predicate."""
+    sides = union_all(
+        select(history.before_user_id.label("user_id"), history.network).where(
+            users(history.before_user_id)
+        ),
+        select(history.after_user_id.label("user_id"), history.network).where(
+            and_(
+                users(history.after_user_id),
+                or_(
+                    history.before_user_id == None,
+                    history.before_user_id != history.after_user_id,
+                ),
+            )
+        ),
+    ).subquery()
+    return (
+        select(sides.c.user_id, sides.c.network, func.count().label("value"))
+        .where(sides.c.network != None)
+        .group_by(sides.c.user_id, sides.c.network)
+    )
+
+
+def actual_counts(session: Session, low: int, high: int) -> Dict[Tuple[int, str], int]:
+    """Every counter of the users with low <= id < high, counted from scratch."""
+    counts = {}
+    for user_id, value in session.execute(
+        select(Transaction.user_id, func.count())
+        .where(and_(Transaction.user_id >= low, Transaction.user_id < high))
+        .group_by(Transaction.user_id)
+    ):
+        counts[(user_id, TRANSACTIONS)] = value
+    for user_id, network, value in session.execute(
+        select(NFT.user_id, NFT.network, func.count())
+        .where(and_(NFT.user_id >= low, NFT.user_id < high, NFT.deleted == False))
+        .group_by(NFT.user_id, NFT.network)
+    ):
+        counts[(user_id, nfts(network))] = value
+    for user_id, network, value in session.execute(
+        history_counts(NFTHistory, lambda column: and_(column >= low, column < high))
+    ):
+        counts[(user_id, nft_history(network))] = value
+    return counts
+
+
+def repair(session: Session, batch: int = REPAIR_BATCH) -> int:
+    """Sets every drifted counter to its actual count, batch users at a time.
+
+    A counter that moves while its batch is being checked is left for the
+    next run rather than overwritten with a count that may predate the
+    move. Returns the number of counters fixed.
+    """
+    fixed = 0
+    last_id = session.scalar(select(func.max(User.id))) or 0
+    for low in range(0, last_id + 1, batch):
+        high = low + batch
+        seen = {
+            (row.user_id, row.name): row.value
+            for row in session.execute(
+                select(UserCounter).where(
+                    and_(UserCounter.user_id >= low, UserCounter.user_id < high)
+                )
+            ).scalars()
+        }
+        actual = actual_counts(session, low, high)
+        for key in seen.keys() | actual.keys():
+            value = actual.get(key, 0)
+            if key not in seen:
+                result = session.execute(
+                    insert(UserCounter)
+                    .prefix_with("IGNORE", dialect="mysql")
+                    .prefix_with("OR IGNORE", dialect="sqlite")
+                    .values(user_id=key[0], name=key[1], value=value)
+                )
+            elif seen[key] != value:
+                result = session.execute(
+                    update(UserCounter)
+                    .where(
+                        and_(
+                            UserCounter.user_id == key[0],
+                            UserCounter.name == key[1],
+                            UserCounter.value == seen[key],
+                        )
+                    )
+                    .values(value=value)
+                    .execution_options(synchronize_session=False)
+                )
+            else:
+                continue
+            fixed += result.rowcount
+        session.commit()
+    return fixed
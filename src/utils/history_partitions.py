@@ -0,0 +1,155 @@
+"""
+Monthly RANGE partitions of nft_history and their move to nft_history_archive.
+
+Partitions are named after their month (p202610 holds October 2026) and the
+last one, pmax, catches anything past the newest month. MySQL only.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from config import cfg
+from src.models import Network, NFTHistoryArchive
+from src.utils import counters
+
+ARCHIVE_BATCH = 10000
+
+
+def month_start(day: datetime, months: int = 0) -> datetime:
+    """First instant of day's month, moved by months."""
+    index = day.year * 12 + day.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return month.strftime("p%Y%m")
+
+
+def hot_since(now: Optional[datetime] = None) -> datetime:
+    """Oldest created_at the history endpoints read from the hot partitions."""
+    return month_start(now or datetime.now(), -int(cfg.NFT_HISTORY_HOT_MONTHS))
+
+
+def partition_clause(month: datetime) -> str:
+    return "PARTITION {} VALUES LESS THAN (UNIX_TIMESTAMP('{}'))".format(
+        partition_name(month), month_start(month, 1).strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+def partitions(connection: Connection) -> List[Tuple[str, Optional[int]]]:
+    """(name, upper bound as a unix timestamp) in order, None for MAXVALUE."""
+    rows = connection.execute(
+        text(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION"
+            " FROM information_schema.PARTITIONS"
+            " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'nft_history'"
+            " ORDER BY PARTITION_ORDINAL_POSITION"
+        )
+    )
+    return [(name, None if bound == "MAXVALUE" else int(bound)) for name, bound in rows]
+
+
+def add_partitions(connection: Connection, months_ahead: int) -> List[str]:
+    """Splits pmax so every month up to months_ahead has its own partition."""
+    existing = {name for name, _ in partitions(connection)}
+    now = datetime.now()
+    added = [
+        month_start(now, months)
+        for months in range(months_ahead + 1)
+        if partition_name(month_start(now, months)) not in existing
+    ]
+    if added:
+        connection.execute(
+            text(
+                "ALTER TABLE nft_history REORGANIZE PARTITION pmax INTO ({},"
+                " PARTITION pmax VALUES LESS THAN MAXVALUE)".format(
+                    ", ".join(partition_clause(month) for month in added)
+                )
+            )
+        )
+    return [partition_name(month) for month in added]
+
+
+def _uncount_batch(connection: Connection, name: str, params: dict):
+    """Takes the rows of the batch that aren't archived yet off the users'
+    nft_history counters, the same rows the INSERT IGNORE is about to copy."""
+    side = (
+        "SELECT {0}_user_id AS user_id, network FROM nft_history PARTITION ({1}) h"
+        " WHERE id > :last_id AND id <= :last_id_in_batch"
+        " AND {0}_user_id IS NOT NULL {2}"
+        " AND NOT EXISTS (SELECT 1 FROM nft_history_archive a WHERE a.id = h.id)"
+    )
+    rows = connection.execute(
+        text(
+            "SELECT user_id, network, COUNT(*) FROM ({} UNION ALL {}) s"
+            " WHERE network IS NOT NULL GROUP BY user_id, network".format(
+                side.format("before", name, ""),
+                side.format(
+                    "after",
+                    name,
+                    "AND (before_user_id IS NULL OR before_user_id <> after_user_id)",
+                ),
+            )
+        ),
+        params,
+    ).all()
+    if rows:
+        connection.execute(
+            text(
+                "UPDATE user_counter SET value = value - :count"
+                " WHERE user_id = :user_id AND name = :name"
+            ),
+            [
+                {
+                    "user_id": user_id,
+                    "name": counters.nft_history(Network[network]),
+                    "count": count,
+                }
+                for user_id, network, count in rows
+            ],
+        )
+
+
+def archive_partitions(connection: Connection, before: datetime) -> List[str]:
+    """Moves every partition that ends at or before `before` into the archive.
+
+    Rows are copied in id batches with INSERT IGNORE, so a run interrupted
+    between the copy and the DROP PARTITION is simply repeated by the next one.
+    Each batch takes its rows off the user counters in the same transaction.
+    """
+    columns = ", ".join(NFTHistoryArchive.__table__.columns.keys())
+    cutoff = int(before.timestamp())
+    archived = []
+    for name, bound in partitions(connection):
+        if bound is None or bound > cutoff:
+            continue
+        last_id = 0
+        while True:
+            last_id_in_batch = connection.scalar(
+                text(
+                    "SELECT MAX(id) FROM (SELECT id FROM nft_history PARTITION ({})"
+                    " WHERE id > :last_id ORDER BY id LIMIT :batch) b".format(name)
+                ),
+                {"last_id": last_id, "batch": ARCHIVE_BATCH},
+            )
+            if last_id_in_batch is None:
+                break
+            params = {"last_id": last_id, "last_id_in_batch": last_id_in_batch}
+            _uncount_batch(connection, name, params)
+            connection.execute(
+                text(
+                    "INSERT IGNORE INTO nft_history_archive ({0})"
+                    " SELECT {0} FROM nft_history PARTITION ({1})"
+                    " WHERE id > :last_id AND id <= :last_id_in_batch".format(
+                        columns, name
+                    )
+                ),
+                {"last_id": last_id, "last_id_in_batch": last_id_in_batch},
+            )
+            connection.commit()
+            last_id = last_id_in_batch
+        connection.execute(text("ALTER TABLE nft_history DROP PARTITION " + name))
+        archived.append(name)
+    return archived
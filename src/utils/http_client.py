@@ -0,0 +1,67 @@
+"""
+The worker's HTTP client for the third-party APIs the handlers call
+(CoinGecko, ChangeNOW, Magic Eden, Solscan, OpenSea, Google), so a call
+awaits on the event loop and reuses a kept-alive TLS connection instead of
+blocking every request of the worker while it opens a new one.
+
+Init opens it on startup and closes it on shutdown. Celery tasks and scripts
+are not on an event loop and keep their blocking clients.
+"""
+import asyncio
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import cfg
+
+_client: Optional[httpx.AsyncClient] = None
+_hosts: Dict[str, asyncio.Semaphore] = {}
+
+
+def client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        connections = int(cfg.HTTP_MAX_CONNECTIONS)
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                float(cfg.HTTP_TIMEOUT_SECONDS),
+                connect=float(cfg.HTTP_CONNECT_TIMEOUT_SECONDS),
+            ),
+            limits=httpx.Limits(
+                max_connections=connections,
+                max_keepalive_connections=connections,
+                keepalive_expiry=float(cfg.HTTP_KEEPALIVE_SECONDS),
+            ),
+        )
+    return _client
+
+
+def _host_slots(url) -> asyncio.Semaphore:
+    # httpx only limits the whole pool, one slow API must not take all of it
+    host = urlsplit(str(url)).netloc
+    if host not in _hosts:
+        _hosts[host] = asyncio.Semaphore(int(cfg.HTTP_MAX_CONNECTIONS_PER_HOST))
+    return _hosts[host]
+
+
+async def request(method: str, url, **kwargs) -> httpx.Response:
+    """httpx.AsyncClient.request, at most HTTP_MAX_CONNECTIONS_PER_HOST calls
+    in flight per host. The body is read before the slot is freed."""
+    async with _host_slots(url):
+        return await client().request(method, url, **kwargs)
+
+
+async def get(url, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,32 @@
+"""
+The OpenSea v1 calls of the NFT routes, through the worker's pooled client,
+see src.utils.http_client. They replace the opensea-api package, which
+blocked the event loop on requests.
+"""
+from typing import Optional
+
+from config import cfg
+from src.utils import http_client
+
+API_URL = "https://api.opensea.io/api/v1/"
+# the most assets OpenSea returns per call
+MAX_ASSET_ITEMS = 50
+
+
+async def _get(endpoint: str, params: Optional[dict] = None) -> dict:
+    response = await http_client.get(
+        API_URL + endpoint, params=params, headers={"X-API-KEY": cfg.OPENSEA_API}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def assets(owner: str, order_by: Optional[str] = None) -> dict:
+    params = {"owner": owner, "limit": MAX_ASSET_ITEMS}
+    if order_by is not None:
+        params["order_by"] = order_by
+    return await _get("assets", params)
+
+
+async def asset(asset_contract_address: str, token_id: str) -> dict:
+    return await _get("asset/{}/{}".format(asset_contract_address, token_id))
@@ -0,0 +1,74 @@
+"""
+Transactional outbox for celery tasks.
+
+A request adds its task to the outbox in the transaction that writes the rows
+the task acts on, so the task exists exactly when those rows do and the
+request never talks to the broker. The relay (python -m src.outbox_relay)
+publishes pending rows in id order, a batch per broker connection, and marks
+them published in the same database transaction.
+
+Delivery is at least once: a relay that dies between publishing and its
+commit publishes the batch again, so tasks sent through here must tolerate
+running twice.
+"""
+from datetime import datetime, timedelta
+
+from celery import Celery, Task
+from sqlalchemy import and_, delete, select, update
+from sqlalchemy.orm import Session
+
+from src.models import Outbox
+
+
+def enqueue(session, task: Task, *args):
+    """Adds task(*args) to the outbox, session is an AsyncSession or a Session."""
+    session.add(Outbox(task=task.name, args=list(args)))
+
+
+def relay(session: Session, app: Celery, batch: int) -> int:
+    """Publishes up to batch pending tasks, returns how many."""
+    pending = session.execute(
+        select(Outbox.id, Outbox.task, Outbox.args)
+        .where(Outbox.published_at == None)
+        .order_by(Outbox.id)
+        .limit(batch)
+        # a second relay waits here instead of publishing the same rows
+        .with_for_update()
+    ).all()
+    if not pending:
+        session.commit()
+        return 0
+
+    with app.producer_or_acquire() as producer:
+        for row in pending:
+            app.send_task(row.task, args=row.args, producer=producer)
+    session.execute(
+        update(Outbox)
+        .where(Outbox.id.in_([row.id for row in pending]))
+        .values(published_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return len(pending)
+
+
+def purge(session: Session, keep: timedelta, batch: int = 10000) -> int:
+    """Deletes rows published more than keep ago, returns how many."""
+    ids = session.scalars(
+        select(Outbox.id)
+        .where(
+            and_(
+                Outbox.published_at != None,
+                Outbox.published_at < datetime.now() - keep,
+            )
+        )
+        .limit(batch)
+    ).all()
+    if ids:
+        session.execute(
+            delete(Outbox)
+            .where(Outbox.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+    return len(ids)
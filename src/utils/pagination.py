@@ -0,0 +1,59 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, Callable, Optional, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value: Union[datetime, int], id: int) -> str:
+    """Cursor of the row with sort key (value, id)."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, id]).encode("utf-8")
+    return urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_key(cursor: str, parse: Callable[[Any], Any] = int) -> Tuple[Any, int]:
+    try:
+        value, id = json.loads(urlsafe_b64decode(cursor.encode("ascii")))
+        return parse(value), int(id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    return decode_key(cursor, datetime.fromisoformat)
+
+
+def keyset_past(value_column, id_column, value, id: int, descending: bool = True):
+    """Rows strictly after (value, id) in (value, id) order, both columns
+    descending or both ascending.
+
+    Spelled out instead of a row comparison so MySQL keeps the range scan on
+    the (owner, value) indexes, which carry id as their implicit suffix.
+    """
+    if descending:
+        return or_(value_column < value, and_(value_column == value, id_column < id))
+    return or_(value_column > value, and_(value_column == value, id_column > id))
+
+
+def keyset_before(created_at_column, id_column, cursor: str):
+    """Rows strictly after the cursor in (created_at DESC, id DESC) order."""
+    return keyset_past(created_at_column, id_column, *decode_cursor(cursor))
+
+
+def next_page(
+    rows: list, count: int, key: Callable[[object], Tuple[Any, int]]
+) -> Tuple[list, Optional[str]]:
+    """Trims the look-ahead row of a limit(count + 1) query.
+
+    Returns the page and the cursor of the following page, None on the last one.
+    """
+    if len(rows) <= count:
+        return rows, None
+    rows = rows[:count]
+    return rows, encode_cursor(*key(rows[-1]))
@@ -0,0 +1,211 @@
+"""
+Connection pool instrumentation: how long checkouts wait, how long connections
+are held and by which route, overflow use, invalidations and timeouts.
+
+Every engine of src.database is built with an instrumented pool class and
+handed to watch(). Counters are per process, like the pools themselves.
+"""
+import time
+from contextvars import ContextVar
+from typing import Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# what the running task is doing, UnitOfWorkRoute sets it for web requests
+current_holder: ContextVar[str] = ContextVar("db_pool_holder", default="unknown")
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60)
+# a checkout waiting this long is logged along with who holds the pool
+SLOW_CHECKOUT = 1.0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def buckets(self) -> List[tuple]:
+        """Cumulative (upper bound, count) pairs, the last one is +Inf."""
+        total, pairs = 0, []
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            pairs.append((str(bound), total))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "buckets": dict(self.buckets()),
+        }
+
+
+class PoolStats:
+    def __init__(self, name: str, pool):
+        self.name = name
+        self.pool = pool
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait = Histogram()
+        self.held = Histogram()
+        # connection record -> (route, checked out at)
+        self.holders = {}
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        self.checkouts += 1
+        if self.pool.overflow() > 0:
+            self.overflow_checkouts += 1
+        self.holders[record] = (current_holder.get(), time.perf_counter())
+
+    def on_checkin(self, dbapi_connection, record):
+        holder = self.holders.pop(record, None)
+        if holder is not None:
+            self.held.observe(time.perf_counter() - holder[1])
+
+    def on_invalidate(self, dbapi_connection, record, exception):
+        self.invalidations += 1
+
+    def current_holders(self) -> List[dict]:
+        now = time.perf_counter()
+        return sorted(
+            (
+                {"pool": self.name, "route": route, "held": round(now - since, 3)}
+                for route, since in list(self.holders.values())
+            ),
+            key=lambda holder: -holder["held"],
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "size": self.pool.size(),
+            "checked_out": self.pool.checkedout(),
+            "overflow": max(0, self.pool.overflow()),
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait": self.wait.as_dict(),
+            "held": self.held.as_dict(),
+        }
+
+
+# engine kind -> stats of its current pool
+pools: Dict[str, PoolStats] = {}
+
+
+def _report(stats: PoolStats, message: str):
+    holders = ", ".join(
+        "{route} {held}s".format(**holder) for holder in stats.current_holders()[:10]
+    )
+    print("DB pool {} {}, held by : {}".format(stats.name, message, holders))
+
+
+class _Instrumented:
+    """Times connect(), from the call until a connection is handed out."""
+
+    def connect(self):
+        stats = pools.get(self._orig_logging_name)
+        if stats is None:
+            return super().connect()
+        stats.pool = self
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeout:
+            stats.timeouts += 1
+            _report(stats, "timed out")
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            stats.wait.observe(waited)
+            if waited >= SLOW_CHECKOUT:
+                _report(stats, "checkout waited {:.1f}s".format(waited))
+
+
+class InstrumentedQueuePool(_Instrumented, QueuePool):
+    pass
+
+
+class InstrumentedAsyncPool(_Instrumented, AsyncAdaptedQueuePool):
+    pass
+
+
+def watch(kind: str, engine):
+    """Starts collecting for engine, its pool must be named after kind."""
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = PoolStats(kind, pool)
+    event.listen(pool, "checkout", stats.on_checkout)
+    event.listen(pool, "checkin", stats.on_checkin)
+    event.listen(pool, "invalidate", stats.on_invalidate)
+    event.listen(pool, "soft_invalidate", stats.on_invalidate)
+    pools[kind] = stats
+    return engine
+
+
+def holders() -> List[dict]:
+    """Every connection checked out of this process's pools, longest first."""
+    return sorted(
+        (
+            holder
+            for stats in list(pools.values())
+            for holder in stats.current_holders()
+        ),
+        key=lambda holder: -holder["held"],
+    )
+
+
+def snapshot() -> dict:
+    return {kind: stats.as_dict() for kind, stats in list(pools.items())}
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    return "db_pool_{}{{{}}} {}".format(
+        name, ",".join('{}="{}"'.format(k, v) for k, v in labels.items()), value
+    )
+
+
+def prometheus(pid: int) -> str:
+    """snapshot() in the Prometheus text format, labelled with pid and pool."""
+    data = snapshot()
+    lines = []
+    for name, kind, help in (
+        ("size", "gauge", "Connections the pool keeps open."),
+        ("checked_out", "gauge", "Connections currently checked out."),
+        ("overflow", "gauge", "Connections open beyond the pool size."),
+        ("checkouts", "counter", "Connections handed out."),
+        ("overflow_checkouts", "counter", "Checkouts served past the pool size."),
+        ("invalidations", "counter", "Connections invalidated."),
+        ("timeouts", "counter", "Checkouts that gave up after pool_timeout."),
+        ("wait", "histogram", "Seconds spent waiting for a connection."),
+        ("held", "histogram", "Seconds a connection stayed checked out."),
+    ):
+        metric = name + "_seconds" if kind == "histogram" else name
+        lines.append("# HELP db_pool_{} {}".format(metric, help))
+        lines.append("# TYPE db_pool_{} {}".format(metric, kind))
+        for pool, values in data.items():
+            labels = {"pid": pid, "pool": pool}
+            if kind != "histogram":
+                lines.append(_sample(metric, labels, values[name]))
+                continue
+            for bound, count in values[name]["buckets"].items():
+                lines.append(_sample(metric + "_bucket", dict(labels, le=bound), count))
+            lines.append(_sample(metric + "_sum", labels, values[name]["sum"]))
+            lines.append(_sample(metric + "_count", labels, values[name]["count"]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from typing import Dict
+
+from config import cfg
+from src.utils import http_client
+
+URL = "https://api.coingecko.com/api/v3/simple/price"
+# coin -> CoinGecko id
+COINS = {"eth": "ethereum", "sol": "solana"}
+
+
+class PriceUnavailable(Exception):
+    """No price younger than PRICE_MAX_STALE_SECONDS."""
+
+
+class PriceOracle:
+    """USD prices of the COINS, held per worker and refreshed in the
+    background, so the price routes and the fees computed from them read
+    memory instead of calling CoinGecko.
+
+    run() refreshes every PRICE_REFRESH_SECONDS. A failed refresh keeps the
+    last good prices, which are served until PRICE_MAX_STALE_SECONDS old;
+    past that get() tries CoinGecko itself, once for all waiting callers.
+    """
+
+    def __init__(self):
+        self._prices: Dict[str, float] = {}
+        self._fetched_at = None
+        self._lock = asyncio.Lock()
+
+    def age(self) -> float:
+        if self._fetched_at is None:
+            return float("inf")
+        return time.monotonic() - self._fetched_at
+
+    async def refresh(self) -> bool:
+        """Fetches every coin in one call, False keeps the last prices."""
+        try:
+            response = await http_client.get(
+                URL, params={"ids": ",".join(COINS.values()), "vs_currencies": "usd"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._prices = {coin: float(data[id]["usd"]) for coin, id in COINS.items()}
+            self._fetched_at = time.monotonic()
+            return True
+        except Exception as ex:
+            print("Error refreshing prices : ", ex)
+            return False
+
+    async def get(self, coin: str) -> float:
+        max_stale = float(cfg.PRICE_MAX_STALE_SECONDS)
+        if self.age() > max_stale:
+            async with self._lock:
+                if self.age() > max_stale:
+                    await self.refresh()
+            if self.age() > max_stale:
+                raise PriceUnavailable(
+                    "No {} price for {:.0f} seconds".format(coin, self.age())
+                )
+        return self._prices[coin]
+
+    async def run(self):
+        """Runs for the life of the worker, see UserAPI.Bootstrap."""
+        refresh = float(cfg.PRICE_REFRESH_SECONDS)
+        while True:
+            # a failed refresh is retried sooner, the last prices age meanwhile
+            await asyncio.sleep(refresh if await self.refresh() else min(refresh, 5))
+
+
+price_oracle = PriceOracle()
@@ -0,0 +1,129 @@
+"""
+ChangeNOW exchange estimates for the /user/price/<from>/<to>/<input|output>
+routes, which the deposit form calls on every keystroke.
+
+A quote is kept QUOTE_CACHE_SECONDS for its exact amount, and callers asking
+for one that is being fetched wait for that call instead of making their
+own. Failed calls are not kept. Amounts aren't rounded into shared buckets:
+ChangeNOW's network fees and fixed-rate reverse quotes aren't proportional
+to the amount, and a rounded amount can cross its minimum either way.
+
+Cache and counters are per worker process, like the HTTP client.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from config import cfg
+from src.utils import http_client
+
+URL = "https://vip-api.changenow.io/v1.2/exchange/estimate"
+
+# (from currency, from network, to currency, to network, reverse, amount)
+Key = Tuple[str, str, str, str, bool, float]
+
+_cache: Dict[Key, Tuple[float, Optional[float]]] = {}
+_inflight: Dict[Key, asyncio.Future] = {}
+counts = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+
+class QuoteFailed(Exception):
+    """ChangeNOW answered with something other than 200."""
+
+
+def _params(key: Key) -> dict:
+    from_currency, from_network, to_currency, to_network, reverse, amount = key
+    params = {
+        "fromCurrency": from_currency,
+        "fromNetwork": from_network,
+        "toCurrency": to_currency,
+        "toNetwork": to_network,
+    }
+    if reverse:
+        params.update(toAmount=amount, flow="fixed-rate", type="reverse")
+    else:
+        params.update(fromAmount=amount, type="direct")
+    return params
+
+
+def _prune(now: float):
+    for key in [key for key, (expires, _) in _cache.items() if expires <= now]:
+        del _cache[key]
+    # still full of live quotes, the oldest go first to make room for one
+    excess = len(_cache) + 1 - int(cfg.QUOTE_CACHE_MAX_ENTRIES)
+    for key in sorted(_cache, key=lambda key: _cache[key][0])[: max(excess, 0)]:
+        del _cache[key]
+
+
+async def _fetch(key: Key) -> Optional[float]:
+    try:
+        response = await http_client.get(URL, params=_params(key))
+        if response.status_code != 200:
+            raise QuoteFailed(
+                "ChangeNOW estimate answered {}: {}".format(
+                    response.status_code, response.text
+                )
+            )
+        estimate = response.json()["summary"]["estimatedAmount"]
+    except Exception:
+        counts["errors"] += 1
+        raise
+
+    now = time.monotonic()
+    if len(_cache) >= int(cfg.QUOTE_CACHE_MAX_ENTRIES):
+        _prune(now)
+    # None is ChangeNOW's "too low", kept like any other answer
+    _cache[key] = (now + float(cfg.QUOTE_CACHE_SECONDS), estimate)
+    return estimate
+
+
+async def estimate(
+    from_currency: str,
+    from_network: str,
+    to_currency: str,
+    to_network: str,
+    amount: float,
+    reverse: bool = False,
+) -> Optional[float]:
+    """What ChangeNOW estimates amount of from_currency exchanges to, or with
+    reverse how much from_currency it takes to get amount of to_currency.
+    None when amount is below ChangeNOW's minimum, QuoteFailed when ChangeNOW
+    refuses the request."""
+    key = (from_currency, from_network, to_currency, to_network, reverse, amount)
+
+    cached = _cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        counts["hits"] += 1
+        return cached[1]
+
+    task = _inflight.get(key)
+    if task is None:
+        counts["misses"] += 1
+        task = _inflight[key] = asyncio.ensure_future(_fetch(key))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        counts["coalesced"] += 1
+    # a caller going away must not cancel the call the others wait for
+    return await asyncio.shield(task)
+
+
+def snapshot() -> dict:
+    return dict(counts, cached=len(_cache), inflight=len(_inflight))
+
+
+def prometheus(pid: int) -> str:
+    """snapshot() in the Prometheus text format, labelled with pid."""
+    data = snapshot()
+    lines = []
+    for name, kind, help in (
+        ("hits", "counter", "Estimates answered from the cache."),
+        ("misses", "counter", "Estimates fetched from ChangeNOW."),
+        ("coalesced", "counter", "Estimates that waited for a call in flight."),
+        ("errors", "counter", "ChangeNOW calls that failed."),
+        ("cached", "gauge", "Quotes held in the cache, expired ones included."),
+        ("inflight", "gauge", "ChangeNOW calls in flight."),
+    ):
+        lines.append("# HELP changenow_quote_{} {}".format(name, help))
+        lines.append("# TYPE changenow_quote_{} {}".format(name, kind))
+        lines.append('changenow_quote_{}{{pid="{}"}} {}'.format(name, pid, data[name]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,61 @@
+"""
+Read-your-writes for the read replica: a user whose write committed in the
+last DB_READ_YOUR_WRITES_SECONDS reads from the primary, see
+get_async_db_read_session.
+
+The window is a redis key per user, so it follows the access token to every
+worker and every client of that user, cookie or not.
+"""
+from redis import asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import cfg
+
+KEY = "db-written:{}"
+
+_client = None
+
+
+def _redis() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(cfg.REDIS_URL, socket_timeout=0.5)
+    return _client
+
+
+def _window() -> int:
+    # without a replica every read is on the primary already
+    return int(cfg.DB_READ_YOUR_WRITES_SECONDS) if cfg.DB_REPLICA_HOST else 0
+
+
+async def mark(user_id: int):
+    """Starts user_id's window, call it once the write has committed."""
+    window = _window()
+    if window <= 0:
+        return
+    try:
+        await _redis().set(KEY.format(user_id), 1, ex=window)
+    except Exception as ex:
+        print("Error marking a recent write : ", ex)
+
+
+def mark_after_commit(session: AsyncSession, user_id: int):
+    """mark() once the write session has committed, for writes on behalf of a
+    user the access token doesn't name yet, like a signup."""
+
+    async def callback():
+        await mark(user_id)
+
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+async def wrote_recently(user_id: int) -> bool:
+    """Whether user_id's window is open. Redis being down sends the read to
+    the primary, a stale read is the one thing this is here to prevent."""
+    if _window() <= 0:
+        return False
+    try:
+        return bool(await _redis().exists(KEY.format(user_id)))
+    except Exception as ex:
+        print("Error reading recent writes : ", ex)
+        return True
@@ -0,0 +1,112 @@
+"""
+Daily deposit and withdrawal volume, kept in transaction_rollup so finance
+reports read a row per (day, method, direct, status) instead of grouping the
+whole transaction table.
+
+A transaction's status keeps changing after insert, so refresh() recounts
+whole days: each day holding a row changed since the watermark is counted
+again from transaction over ix_transaction_created, the changed rows are
+found on ix_transaction_updated. Changes younger than the settle window are
+left for the next run, a slow transaction could still commit an updated_at
+below the new watermark.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, distinct, func, insert, select
+from sqlalchemy.orm import Session
+
+from src.models import (
+    Direct,
+    DWMethod,
+    RollupWatermark,
+    Transaction,
+    TransactionRollup,
+)
+
+WATERMARK = "transaction_rollup"
+
+
+def _day(column):
+    return func.date(column, type_=TransactionRollup.day.type)
+
+
+def changed_days(through: datetime, since: Optional[datetime] = None):
+    """Days of the transactions changed in (since, through]."""
+    changed = [Transaction.updated_at <= through]
+    if since is not None:
+        changed.append(Transaction.updated_at > since)
+    return select(distinct(_day(Transaction.created_at))).where(and_(*changed))
+
+
+def recount(day: date):
+    """INSERT ... SELECT of day's rollup rows, delete the old ones first."""
+    start = datetime.combine(day, time())
+    return insert(TransactionRollup).from_select(
+        ["day", "method", "direct", "status", "count", "amount_in", "amount_out"],
+        select(
+            _day(Transaction.created_at),
+            Transaction.method,
+            Transaction.direct,
+            Transaction.status,
+            func.count(),
+            func.coalesce(func.sum(Transaction.amount_in), 0),
+            func.coalesce(func.sum(Transaction.amount_out), 0),
+        )
+        .where(
+            and_(
+                Transaction.created_at >= start,
+                Transaction.created_at < start + timedelta(days=1),
+                Transaction.status.isnot(None),
+            )
+        )
+        .group_by(
+            _day(Transaction.created_at),
+            Transaction.method,
+            Transaction.direct,
+            Transaction.status,
+        ),
+    )
+
+
+def refresh(session: Session, settle_seconds: int, full: bool = False) -> int:
+    """Recounts every day changed since the last run, or every day when full,
+    commits each day on its own. Returns the number of days recounted."""
+    through = (datetime.now() - timedelta(seconds=settle_seconds)).replace(
+        microsecond=0
+    )
+    watermark = session.get(RollupWatermark, WATERMARK)
+    since = None if full or watermark is None else watermark.through
+
+    days = session.scalars(changed_days(through, since)).all()
+    for day in days:
+        session.execute(delete(TransactionRollup).where(TransactionRollup.day == day))
+        session.execute(recount(day))
+        session.commit()
+
+    # moved only once every day is recounted, a failed run starts over
+    if watermark is None:
+        session.add(RollupWatermark(name=WATERMARK, through=through))
+    else:
+        watermark.through = through
+    session.commit()
+    return len(days)
+
+
+async def load(
+    session,
+    day_from: date,
+    day_to: date,
+    method: Optional[DWMethod] = None,
+    direct: Optional[Direct] = None,
+) -> List:
+    """Rollup rows of the days in [day_from, day_to], session is an
+    AsyncSession."""
+    conditions = [TransactionRollup.day >= day_from, TransactionRollup.day <= day_to]
+    if method is not None:
+        conditions.append(TransactionRollup.method == method)
+    if direct is not None:
+        conditions.append(TransactionRollup.direct == direct)
+    return list(
+        await session.scalars(select(TransactionRollup).where(and_(*conditions)))
+    )
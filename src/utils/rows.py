@@ -0,0 +1,72 @@
+"""
+Column selections and their JSON shapes for the list endpoints.
+
+The endpoints select these columns instead of whole entities, so a page is a
+list of plain Row tuples with no identity map or attribute instrumentation
+behind it, and turn each row straight into JSON types. Their responses can
+then skip FastAPI's reflective jsonable_encoder pass, see
+benchmarks/list_rows.py.
+"""
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy.engine import Row
+
+from src.models import NFT, Transaction
+
+NFT_ITEM = (NFT.id, NFT.image_url, NFT.price, NFT.quantity)
+# everything the ORM object used to be encoded with, updated_at came later
+# for the rollups
+TRANSACTION_ITEM = tuple(
+    getattr(Transaction, column.key)
+    for column in Transaction.__table__.columns
+    if column.key != "updated_at"
+)
+
+
+def _json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def nft_item(row: Row) -> dict:
+    return {
+        "id": row.id,
+        "imageUrl": row.image_url,
+        "price": row.price,
+        "quantity": row.quantity,
+    }
+
+
+def history_item_columns(history) -> tuple:
+    """history is NFTHistory or NFTHistoryArchive, id and created_at are the
+    keyset paging key."""
+    return (
+        history.id,
+        history.created_at,
+        history.nft_image_url,
+        history.nft_name,
+        history.transaction_hash,
+        history.note,
+        history.price,
+        history.quantity,
+    )
+
+
+def history_item(row: Row) -> dict:
+    return {
+        "imageUrl": row.nft_image_url,
+        "name": row.nft_name,
+        "created_at": _json(row.created_at),
+        "transactionHash": row.transaction_hash,
+        "note": _json(row.note),
+        "price": row.price,
+        "quantity": row.quantity,
+    }
+
+
+def transaction_item(row: Row) -> dict:
+    return {key: _json(value) for key, value in row._mapping.items()}
@@ -0,0 +1,161 @@
+"""
+Per-request SQL profile: statements, time spent in the database and
+statements repeated with the same shape, the usual sign of an N+1.
+
+Engines are hooked once by watch(). Nothing is recorded unless the running
+request was picked by SQLProfileMiddleware, so unprofiled requests only pay
+for a contextvar lookup per statement.
+"""
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from config import cfg
+from src.utils.auth import is_debug_key
+
+current_profile: ContextVar[Optional["Profile"]] = ContextVar(
+    "sql_profile", default=None
+)
+
+# distinct shapes kept per route, the rest is only counted
+MAX_ROUTE_SHAPES = 20
+
+
+def shape(statement: str) -> str:
+    """statement with expanded IN lists and VALUES rows collapsed."""
+    statement = " ".join(statement.split())
+    statement = re.sub(r"\((?:\s*(?:%s|\?|%\(\w+\)s)\s*,?)+\)", "(?)", statement)
+    return re.sub(r"(\(\?\)(?:\s*,\s*\(\?\))+)", "(?)", statement)
+
+
+class Profile:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.statements += 1
+        self.seconds += seconds
+        self.shapes[shape(statement)] += 1
+
+    def repeated(self) -> Dict[str, int]:
+        """Shapes run at least SQL_PROFILE_REPEAT_THRESHOLD times."""
+        threshold = int(cfg.SQL_PROFILE_REPEAT_THRESHOLD)
+        return {s: n for s, n in self.shapes.most_common() if n >= threshold}
+
+
+class RouteSummary:
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.max_statements = 0
+        self.seconds = 0.0
+        self.repeated = Counter()
+
+    def add(self, profile: Profile):
+        self.requests += 1
+        self.statements += profile.statements
+        self.max_statements = max(self.max_statements, profile.statements)
+        self.seconds += profile.seconds
+        for statement, count in profile.repeated().items():
+            if statement in self.repeated or len(self.repeated) < MAX_ROUTE_SHAPES:
+                self.repeated[statement] += count
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "statements": self.statements,
+            "avg_statements": round(self.statements / self.requests, 1),
+            "max_statements": self.max_statements,
+            "db_seconds": round(self.seconds, 6),
+            "avg_db_ms": round(self.seconds * 1000 / self.requests, 3),
+            "repeated": dict(self.repeated.most_common()),
+        }
+
+
+# "GET /user/" -> summary of every profiled request of that route
+routes: Dict[str, RouteSummary] = {}
+
+
+def summary() -> dict:
+    """Route summaries, the most database time first."""
+    return {
+        route: data.as_dict()
+        for route, data in sorted(routes.items(), key=lambda item: -item[1].seconds)
+    }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("sql_profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    starts = conn.info.get("sql_profile_start")
+    if profile is not None and starts:
+        profile.record(statement, time.perf_counter() - starts.pop())
+
+
+def watch(engine):
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class SQLProfileMiddleware:
+    """Profiles requests sent with X-SQL-Profile (and a valid X-Debug-Key) or
+    picked at SQL_PROFILE_SAMPLE_RATE.
+
+    Requests asked for by header get the figures back in X-SQL-* headers.
+    Repeated shapes are logged, and every profile is added to its route's
+    summary, see /debug/sql.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        asked = b"x-sql-profile" in headers and is_debug_key(
+            headers.get(b"x-debug-key", b"").decode("latin-1")
+        )
+        if not asked and random.random() >= float(cfg.SQL_PROFILE_SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+
+        profile = Profile()
+        token = current_profile.set(profile)
+
+        async def send_with_profile(message):
+            if asked and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-sql-statements", str(profile.statements).encode()),
+                    (
+                        b"x-sql-time-ms",
+                        "{:.3f}".format(profile.seconds * 1000).encode(),
+                    ),
+                    (b"x-sql-repeated", str(len(profile.repeated())).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            current_profile.reset(token)
+            # unmatched paths share one entry, scanners can't grow the dict
+            route = scope.get("route")
+            name = "{} {}".format(
+                scope["method"], route.path if route is not None else "unmatched"
+            )
+            routes.setdefault(name, RouteSummary()).add(profile)
+            for statement, count in profile.repeated().items():
+                print("Possible N+1 in {}, {}x : {}".format(name, count, statement))
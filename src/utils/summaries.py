@@ -0,0 +1,115 @@
+"""
+Totals over the users of a shard, kept in shard_summary so the admin
+overview never scans user or balance_snapshot.
+
+User counts move in the transaction that signs the user up or confirms it.
+Balance totals move when take_snapshots folds entries into balance_snapshot,
+so they are as of the last snapshot, like the balances admin search filters
+on. Every row exists from migration 0012 on, an increment is a plain UPDATE.
+repair(), run daily by the repair_user_counters celery task, recounts them.
+"""
+from typing import Dict
+
+from sqlalchemy import and_, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Update
+
+from src.models import BalanceSnapshot, ShardSummary, SignMethod, User, UserAccessKey
+
+PENDING = "users:pending"
+BALANCE = "balance"
+DEPOSIT_BALANCE = "deposit_balance"
+WITHDRAW_BALANCE = "withdraw_balance"
+
+
+def users(sign_method: SignMethod) -> str:
+    """Undeleted users who signed up with sign_method."""
+    return "users:" + sign_method.name.lower()
+
+
+def increment(name: str, by: int = 1) -> Update:
+    """Statement moving a total by by, run it in the transaction that makes
+    the change."""
+    return (
+        update(ShardSummary)
+        .where(ShardSummary.name == name)
+        .values(value=ShardSummary.value + by)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def actual(session: Session) -> Dict[str, int]:
+    """Every total, counted from scratch."""
+    totals = {users(sign_method): 0 for sign_method in SignMethod}
+    for sign_method, value in session.execute(
+        select(User.sign_method, func.count())
+        .where(User.deleted == False)
+        .group_by(User.sign_method)
+    ):
+        totals[users(sign_method)] = value
+    totals[PENDING] = session.scalar(
+        select(func.count())
+        .select_from(User)
+        .where(
+            and_(
+                User.deleted == False,
+                User.id.in_(
+                    select(UserAccessKey.user_id).where(UserAccessKey.is_pending)
+                ),
+            )
+        )
+    )
+    balances = session.execute(
+        select(
+            func.coalesce(func.sum(BalanceSnapshot.balance), 0),
+            func.coalesce(func.sum(BalanceSnapshot.deposit_balance), 0),
+            func.coalesce(func.sum(BalanceSnapshot.withdraw_balance), 0),
+        )
+    ).one()
+    totals[BALANCE], totals[DEPOSIT_BALANCE], totals[WITHDRAW_BALANCE] = (
+        int(value) for value in balances
+    )
+    return totals
+
+
+def repair(session: Session) -> int:
+    """Sets every drifted total to its actual value, returns how many.
+
+    A total that moves while it is being recounted is left for the next run.
+    """
+    seen = {row.name: row.value for row in session.scalars(select(ShardSummary))}
+    fixed = 0
+    for name, value in actual(session).items():
+        if name not in seen:
+            result = session.execute(
+                insert(ShardSummary)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+                .values(name=name, value=value)
+            )
+        elif seen[name] != value:
+            result = session.execute(
+                update(ShardSummary)
+                .where(
+                    and_(ShardSummary.name == name, ShardSummary.value == seen[name])
+                )
+                .values(value=value)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            continue
+        fixed += result.rowcount
+    session.commit()
+    return fixed
+
+
+async def load(session) -> Dict[str, int]:
+    """Every total of session's shard, session is an AsyncSession."""
+    return {row.name: row.value for row in await session.scalars(select(ShardSummary))}
+
+
+async def count_signup(session, sign_method: SignMethod, pending: bool):
+    """Counts a new user in the AsyncSession that adds it."""
+    await session.execute(increment(users(sign_method)))
+    if pending:
+        await session.execute(increment(PENDING))
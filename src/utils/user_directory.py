@@ -0,0 +1,39 @@
+"""
+Lookups by sign up address, which can't be routed to a shard on their own.
+
+The directory on the home shard maps an address to user ids, and each id to
+its shard through src.database.shard_for. A new user's id is allocated here
+before the user row is written on its shard.
+"""
+from typing import Optional
+
+from sqlalchemy import and_, select
+
+from src.database import ShardSessions
+from src.models import User, UserDirectory
+
+
+async def find_user(shards: ShardSessions, address: str, *options) -> Optional[User]:
+    """The user signed up with address and not deleted, loaded with options
+    from its shard."""
+    user_ids = await shards.home.scalars(
+        select(UserDirectory.id).where(UserDirectory.address == address)
+    )
+    for user_id in list(user_ids):
+        user = await shards.for_user(user_id).scalar(
+            select(User)
+            .options(*options)
+            .where(and_(User.id == user_id, User.deleted == False))
+        )
+        if user is not None:
+            return user
+    return None
+
+
+async def allocate(shards: ShardSessions, address: str) -> int:
+    """A new user id for address, create the User with it in
+    shards.for_user(id) and commit the home shard first."""
+    entry = UserDirectory(address=address)
+    shards.home.add(entry)
+    await shards.home.flush()
+    return entry.id
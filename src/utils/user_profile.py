@@ -0,0 +1,116 @@
+import json
+from typing import Optional
+
+import redis
+from redis import asyncio as aioredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from config import cfg
+from src.models import Avatar, User, UserAccessKey
+from src.utils.balance import balance_query, from_minor
+
+KEY = "user-profile:{}"
+
+_client = None
+
+
+def profile_query(user_id: int) -> Select:
+    """Everything GET /user/ returns, in one statement."""
+    # a scalar subquery, a second access key row must not double the balance
+    is_pending = (
+        select(UserAccessKey.is_pending)
+        .where(UserAccessKey.user_id == User.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        balance_query(user_id)
+        .add_columns(
+            User.name,
+            User.address,
+            User.sign_method,
+            User.is_privacy,
+            Avatar.url.label("avatar"),
+            is_pending.label("is_pending"),
+        )
+        .outerjoin(Avatar, Avatar.id == User.avatar_id)
+        .where(User.deleted == False)
+        .group_by(Avatar.url)
+    )
+
+
+async def load(session: AsyncSession, user_id: int) -> Optional[dict]:
+    row = (await session.execute(profile_query(user_id))).first()
+    if row is None:
+        return None
+    return {
+        "name": row.name,
+        "address": row.address,
+        "avatar": row.avatar,
+        "signMethod": row.sign_method,
+        "balance": from_minor(row.balance),
+        "rollback": from_minor(row.rollback),
+        "isPrivacy": row.is_privacy,
+        "isPending": row.is_pending,
+    }
+
+
+def _redis() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(cfg.REDIS_URL, socket_timeout=0.5)
+    return _client
+
+
+async def cached(session: AsyncSession, user_id: int) -> Optional[dict]:
+    """The profile from redis, loaded and stored for USER_PROFILE_CACHE_SECONDS
+    on a miss. Redis being down only costs the cache."""
+    ttl = int(cfg.USER_PROFILE_CACHE_SECONDS)
+    if ttl <= 0:
+        return await load(session, user_id)
+
+    try:
+        data = await _redis().get(KEY.format(user_id))
+        if data is not None:
+            return json.loads(data)
+    except Exception as ex:
+        print("Error reading user profile cache : ", ex)
+
+    profile = await load(session, user_id)
+    if profile is not None:
+        try:
+            await _redis().set(KEY.format(user_id), json.dumps(profile), ex=ttl)
+        except Exception as ex:
+            print("Error writing user profile cache : ", ex)
+    return profile
+
+
+async def forget(user_id: int):
+    try:
+        await _redis().delete(KEY.format(user_id))
+    except Exception as ex:
+        print("Error invalidating user profile cache : ", ex)
+
+
+def forget_after_commit(session: AsyncSession, user_id: int):
+    """Drops the cached profile once the write session has committed, see
+    get_async_db_write_session. Dropping it earlier lets a concurrent read
+    cache the old row again."""
+
+    async def callback():
+        await forget(user_id)
+
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+def forget_sync(user_id: int):
+    """forget() for celery tasks, call it after the commit."""
+    client = redis.Redis.from_url(cfg.REDIS_URL, socket_timeout=0.5)
+    try:
+        client.delete(KEY.format(user_id))
+    except Exception as ex:
+        print("Error invalidating user profile cache : ", ex)
+    finally:
+        client.close()
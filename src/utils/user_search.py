@@ -0,0 +1,112 @@
+"""
+Admin user search over one shard, the admin router merges the shards' pages.
+
+Every filter has an index to range over: created_at on ix_user_created,
+sign method (and created_at) on ix_user_sign_method_created, the address
+prefix on ix_user_address_deleted, pending on ix_user_access_key_pending_user
+and balance ranges and order on ix_balance_snapshot_balance. Balances are
+balance_snapshot's, as of the last snapshot_balances run.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import Select
+
+from src.models import BalanceSnapshot, SignMethod, User, UserAccessKey
+from src.utils.balance import from_minor
+from src.utils.pagination import decode_key, keyset_past
+
+SORTS = {"created_at": User.created_at, "balance": BalanceSnapshot.balance}
+
+
+def _like_prefix(prefix: str) -> str:
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def search_query(
+    sort: str,
+    descending: bool,
+    limit: int,
+    cursor: Optional[str] = None,
+    sign_method: Optional[SignMethod] = None,
+    pending: Optional[bool] = None,
+    address_prefix: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    min_balance: Optional[int] = None,
+    max_balance: Optional[int] = None,
+) -> Select:
+    """limit users matching every filter given, after cursor in sort order.
+    Balances are in minor units."""
+    is_pending = (
+        select(UserAccessKey.is_pending)
+        .where(UserAccessKey.user_id == User.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    conditions = [User.deleted == False]
+    if sign_method is not None:
+        conditions.append(User.sign_method == sign_method)
+    if pending is not None:
+        conditions.append(
+            User.id.in_(
+                select(UserAccessKey.user_id).where(UserAccessKey.is_pending == pending)
+            )
+        )
+    if address_prefix:
+        conditions.append(User.address.like(_like_prefix(address_prefix)))
+    if created_from is not None:
+        conditions.append(User.created_at >= created_from)
+    if created_to is not None:
+        conditions.append(User.created_at < created_to)
+    if min_balance is not None:
+        conditions.append(BalanceSnapshot.balance >= min_balance)
+    if max_balance is not None:
+        conditions.append(BalanceSnapshot.balance <= max_balance)
+
+    column = SORTS[sort]
+    if cursor is not None:
+        parse = datetime.fromisoformat if sort == "created_at" else int
+        conditions.append(
+            keyset_past(column, User.id, *decode_key(cursor, parse), descending)
+        )
+    order = (column.desc(), User.id.desc()) if descending else (column, User.id)
+    return (
+        select(
+            User.id,
+            User.name,
+            User.address,
+            User.sign_method,
+            User.role,
+            User.created_at,
+            BalanceSnapshot.balance,
+            is_pending.label("is_pending"),
+        )
+        .join(BalanceSnapshot, BalanceSnapshot.user_id == User.id)
+        .where(and_(*conditions))
+        .order_by(*order)
+        .limit(limit)
+    )
+
+
+def sort_key(sort: str):
+    def key(row: Row) -> Tuple[object, int]:
+        return getattr(row, sort), row.id
+
+    return key
+
+
+def item(row: Row) -> dict:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "address": row.address,
+        "signMethod": row.sign_method.value,
+        "role": row.role.value,
+        "isPending": row.is_pending,
+        "balance": from_minor(row.balance),
+        "created_at": row.created_at.isoformat(),
+    }
@@ -1,3 +1,5 @@
+import threading
+
 from eth_abi import decode_abi, decode_single
 from hexbytes import HexBytes
 from web3 import Web3, Account
@@ -16,6 +18,9 @@ web3_eth.middleware_onion.add(
     construct_sign_and_send_raw_middleware(cfg.ETH_TREASURY_PRIVATE_KEY)
 )
 web3_eth.eth.default_account = cfg.ETH_TREASURY_ADDRESS
+# the handlers send from threadpool threads, see _send()
+_nonce_lock = threading.Lock()
+_next_nonce = None
 
 ETH_ERC1155_TRANSFER_TOPIC = (
     "0xc3d58168c5ae7397731d063d5bbf3d657854427343f4c083240f7aacaa2d0f62"
@@ -117,6 +122,37 @@ def get_eth_erc1155_contract(address: str) -> Contract:
     return contract
 
 
+def _send(function) -> HexBytes:
+    """Builds and sends the treasury's transaction calling function.
+
+    Sends of a worker are serialized on _nonce_lock. The pending count covers
+    what other workers already sent, the local one what this worker sent that
+    the node doesn't count yet, so two sends never share a nonce.
+    """
+    global _next_nonce
+    with _nonce_lock:
+        nonce = web3_eth.eth.getTransactionCount(
+            web3_eth.eth.default_account, "pending"
+        )
+        if _next_nonce is not None and _next_nonce > nonce:
+            nonce = _next_nonce
+        transaction = function.buildTransaction(
+            {
+                "from": web3_eth.eth.default_account,
+                "nonce": nonce,
+                "gas": cfg.ETH_MAX_FEE,
+            }
+        )
+        try:
+            hash_hex = web3_eth.eth.send_transaction(transaction)
+        except Exception:
+            # the nonce may be unused, leave the next one to the node
+            _next_nonce = None
+            raise
+        _next_nonce = nonce + 1
+    return hash_hex
+
+
 def send_eth_stable_to(token_address: str, wallet: str, amount: int) -> object:
     contract_address = Web3.toChecksumAddress(token_address)
     wallet_address = Web3.toChecksumAddress(wallet)
@@ -126,17 +162,7 @@ def send_eth_stable_to(token_address: str, wallet: str, amount: int) -> object:
     decimal = contract.functions.decimals().call()
 
     amount_wei = int(amount * 10**decimal)
-    transaction = contract.functions.transfer(
-        wallet_address, amount_wei
-    ).buildTransaction(
-        {
-            "from": web3_eth.eth.default_account,
-            "nonce": web3_eth.eth.getTransactionCount(web3_eth.eth.default_account),
-            "gas": cfg.ETH_MAX_FEE,
-        }
-    )
-
-    hash_hex = web3_eth.eth.send_transaction(transaction)
+    hash_hex = _send(contract.functions.transfer(wallet_address, amount_wei))
     receipt = wait_transaction_receipt(hash_hex)
 
     return receipt
@@ -148,39 +174,29 @@ def send_eth_erc721_to(to_wallet: str, address: str, id: str) -> object:
 
     # try:
     contract = get_eth_erc721_contract(contract_address)
-    transaction = contract.functions.transferFrom(
-        web3_eth.eth.default_account, to_address, int(id)
-    ).buildTransaction(
-        {
-            "from": web3_eth.eth.default_account,
-            "nonce": web3_eth.eth.getTransactionCount(web3_eth.eth.default_account),
-            "gas": cfg.ETH_MAX_FEE,
-        }
+    hash_hex = _send(
+        contract.functions.transferFrom(
+            web3_eth.eth.default_account, to_address, int(id)
+        )
     )
-
-    hash_hex = web3_eth.eth.send_transaction(transaction)
     receipt = wait_transaction_receipt(hash_hex)
 
     return receipt
 
 
-def send_eth_erc1155_to(to_wallet: str, address: str, id: str) -> object:
+def send_eth_erc1155_to(
+    to_wallet: str, address: str, id: str, amount: int = 1
+) -> object:
     contract_address = Web3.toChecksumAddress(address)
     to_address = Web3.toChecksumAddress(to_wallet)
 
     # try:
     contract = get_eth_erc1155_contract(contract_address)
-    transaction = contract.functions.safeTransferFrom(
-        web3_eth.eth.default_account, to_address, to_address, int(id), 1, ""
-    ).buildTransaction(
-        {
-            "from": web3_eth.eth.default_account,
-            "nonce": web3_eth.eth.getTransactionCount(web3_eth.eth.default_account),
-            "gas": cfg.ETH_MAX_FEE,
-        }
+    hash_hex = _send(
+        contract.functions.safeTransferFrom(
+            web3_eth.eth.default_account, to_address, int(id), amount, b""
+        )
     )
-
-    hash_hex = web3_eth.eth.send_transaction(transaction)
     receipt = wait_transaction_receipt(hash_hex)
 
     return receipt